@@ -1,6 +1,9 @@
 import random
 import math
+import heapq
+import itertools
 import multiprocessing
+import Queue
 import logging
 import copy
 import random
@@ -8,15 +11,35 @@ from setproctitle import *
 import signal
 import time
 import copy
+import os
 
 from .util import *
-from . import unafold
+from . import folding, unafold
 
 logger = logging.getLogger(__name__)
+checknode_logger = logging.getLogger('fealden.backtracking.checknode')
+
+# Order is important here, since we do a depth first
+# search.
+guesses = ["C","A","G","T"]
+
+# How many processes sensorsearch() searches with, and the depth down
+# to which it splits the tree between them to start with, see frontier()
+search_workers = 1
+frontier_depth = 2
+
+# How long, in seconds, an idle worker waits on the WorkPool before
+# checking whether the search is over
+steal_interval = 0.25
+
+# The ways sensorsearch() can search the tree: depth first, in the
+# order of guesses, or best first, see bestfirst_worker()
+strategies = ["depthfirst", "bestfirst"]
 
 def sensorsearch(sensor, maxtime, bindingratiorange=None,
                  maxunknownpercent=None, maxsolutions=None,
-                 numfoldrange=None, maxenergy=None):
+                 numfoldrange=None, maxenergy=None, engine=None,
+                 workers=None, depth=None, strategy=None, beamwidth=None):
 
     if not bindingratiorange:
         bindingratiorange=(.9,1.1)
@@ -24,6 +47,12 @@ def sensorsearch(sensor, maxtime, bindingratiorange=None,
         maxunknownpercent=.2
     if not maxsolutions:
         maxsolutions=1
+    if not workers:
+        workers = search_workers
+    if depth is None:
+        depth = frontier_depth
+    if not strategy:
+        strategy = "depthfirst"
 
     logger.debug("sensorsearch(%s, %d, %d, %s, %s,%s,%s): has been called as such" %
                  (sensor, maxtime, maxsolutions, bindingratiorange,
@@ -44,6 +73,7 @@ def sensorsearch(sensor, maxtime, bindingratiorange=None,
                 logger.info("sensorsearch(...): _maxtimewatcher(%d) time exceeded, stopping search" % maxtime)
                 command.value = 0
 
+    deadline = time.time() + maxtime
     recognition_queue = multiprocessing.Queue()
     command = multiprocessing.Value("i", 1)
     maxdepth = 0
@@ -58,17 +88,40 @@ def sensorsearch(sensor, maxtime, bindingratiorange=None,
     timep.start()
     subprocesses.append(timep)
     
-    logger.debug("sensorsearch(...): starting checknode worker")
-    # Now, launch the backtracking search
-    sensor1 = copy.deepcopy(sensor)
+    # Everything the search needs that does not depend on the node
+    context = SearchContext(sensor.Recognition, bindingratiorange,
+                            maxunknownpercent, numfoldrange, maxenergy,
+                            engine, deadline)
+
+    # Now, launch the backtracking search, split into subtrees to
+    # start with, which the workers then share out between them as
+    # they go
+    sensor1 = sensor.Copy()
     sensor1.GuessStems('T')
-    worker1 = multiprocessing.Process(target=checknode,
-                                      args=(sensor1, 0,
-                                            recognition_queue,
-                                            command))
-    worker1.daemon = True
-    worker1.start()
-    subprocesses.append(worker1)
+    searchers = []
+    if strategy == "bestfirst":
+        logger.debug("sensorsearch(...): starting best first worker, beam width %s" %
+                     beamwidth)
+        searchers.append(multiprocessing.Process(target=bestfirst_worker,
+                                                 args=(sensor1, recognition_queue,
+                                                       command, context,
+                                                       beamwidth)))
+    else:
+        pool = WorkPool(workers)
+        tasks = frontier(sensor1, context, 0, depth)
+        for (node, node_depth, descend) in tasks:
+            pool.give((node, node_depth, None, None, descend))
+
+        logger.debug("sensorsearch(...): starting %d stealing workers for %d tasks" %
+                     (workers, len(tasks)))
+        for i in range(workers):
+            searchers.append(multiprocessing.Process(target=stealing_worker,
+                                                     args=(pool, recognition_queue,
+                                                           command, context)))
+    for worker in searchers:
+        worker.daemon = True
+        worker.start()
+        subprocesses.append(worker)
 
     logger.debug("sensorsearch(...): beggining to loop over recognition_queue")
 
@@ -76,11 +129,19 @@ def sensorsearch(sensor, maxtime, bindingratiorange=None,
     solutions = []
     maxdepth = 0
 
+    debug = logger.isEnabledFor(logging.DEBUG)
     while command.value == 1:
-        logger.debug("sensorsearch(...): QUEUE -- len(recognition_queue) = %d" %
-                     recognition_queue.qsize())
-
-        result = recognition_queue.get(block=True)
+        if debug:
+            logger.debug("sensorsearch(...): QUEUE -- len(recognition_queue) = %d" %
+                         recognition_queue.qsize())
+
+        try:
+            result = recognition_queue.get(block=True, timeout=1)
+        except Queue.Empty:
+            if not [worker for worker in searchers if worker.is_alive()]:
+                logger.info("sensorsearch(...): the whole tree has been searched")
+                break
+            continue
 
         if not result.valid():
             logger.debug("sensorsearch(...): QUEUE -- INVALID %s" %
@@ -89,20 +150,21 @@ def sensorsearch(sensor, maxtime, bindingratiorange=None,
         elif result.command == "SOLUTION":
             # Validate solution and if valid append it to
             # our list of solutions
-            logger.debug("sensorsearch(...): QUEUE -- SOLUTION(%s, len(scores) = %d, len(folds) = %d)" %
-                         (result.sensor, len(result.scores), len(result.folds)))
+            if debug:
+                logger.debug("sensorsearch(...): QUEUE -- SOLUTION(%s, len(scores) = %d, len(folds) = %d)" %
+                             (result.sensor, len(result.scores), len(result.folds)))
             if unafold.validate_sensor(result.sensor, result.scores, result.folds,
-                                       bindingratiorange=bindingratiorange,
-                                       maxunknownpercent=maxunknownpercent,
-                                       numfoldrange=numfoldrange,
-                                       maxenergy=maxenergy):
+                                       context=context):
                 logger.debug("sensorsearch(...): QUEUE -- VALID SOLUTION %s" % result.command)
+                # Its output shows every fold, so classify them all
+                result.scores = unafold.score_sensor(result.sensor,
+                                                     result.folds)
                 solutions.append(result)
                 #solutions.append((result[1], result[2], result[3]))
                 if len(solutions) == maxsolutions:
                     command.value = 0
                     break
-            else:
+            elif debug:
                 logger.debug("sensorsearch(...): QUEUE -- INVALID SOLUTION %s" % result.sensor)
         elif result.command == "PRUNED":
             # Add depth to list of nodes pruned
@@ -130,79 +192,439 @@ def sensorsearch(sensor, maxtime, bindingratiorange=None,
 
     return solutions
 
-def checknode(sensor, depth, recognition_q, command):
-    # Reset default signal handlers
-    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+def _worker_terminate(signum, frame):
+    """SIGTERM handler for the search workers, stealing_worker() and
+       bestfirst_worker(), kills any hybrid-ss-min still running and
+       then dies of SIGTERM as usual"""
+    unafold.kill_running()
     signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    os.kill(os.getpid(), signal.SIGTERM)
+
+def promising(sensor, context):
+    """Return True if sensor is promising, that is if its children may
+       still hold solutions, see checknode()"""
+    return sensor.StemEnergy() > context.promising_energy
+
+def frontier(sensor, context, depth, maxdepth):
+    """Split the search from sensor, at depth, in to tasks for the
+       search workers, down to maxdepth
+
+       Every promising node above maxdepth is a task of its own, and
+       every other node, at maxdepth or pruned above it, a task with its
+       whole subtree. Together they are the nodes checknode() would
+       visit from sensor, up to 4^(maxdepth - depth) subtrees.
+
+       Arguments:
+       sensor -- the util.Sensor to search from
+       context -- the util.SearchContext of the search
+       depth -- the depth of sensor
+       maxdepth -- the depth to split the tree down to
+
+       Returns:
+       a list of (sensor, depth, descend) tuples, descend being True for
+       a task with its subtree
+       """
+    if depth >= maxdepth or not promising(sensor, context):
+        return [(sensor, depth, True)]
+    tasks = []
+    for guess in guesses:
+        child = sensor.Copy()
+        child.PushGuess(guess)
+        tasks.extend(frontier(child, context, depth + 1, maxdepth))
+    tasks.append((sensor, depth, False))
+    return tasks
+
+class WorkPool(object):
+    """Nodes handed from busy search workers to idle ones, see
+       stealing_worker()
+
+       Each worker searches the nodes it has itself, depth first, and
+       only takes one from the pool once it has none left. While any
+       worker is waiting on the pool, the busy ones give it their
+       shallowest pending node, that is the one with the most work
+       under it. The search is over once every worker is waiting and
+       the pool is empty.
+
+       Arguments:
+       workers -- the number of workers sharing the pool
+    """
+    def __init__(self, workers):
+        self.workers = workers
+        self.nodes = multiprocessing.Queue()
+        self.lock = multiprocessing.Lock()
+        self.idle = multiprocessing.Value("i", 0, lock=False)
+        self.pending = multiprocessing.Value("i", 0, lock=False)
+        self.over = multiprocessing.Value("i", 0, lock=False)
+
+    def wanted(self):
+        """Return True if a worker is waiting for a node that has not
+           been given yet"""
+        return self.idle.value > self.pending.value
+
+    def give(self, node):
+        """Put node in the pool for another worker"""
+        with self.lock:
+            self.pending.value += 1
+        self.nodes.put(node)
+
+    def take(self, command):
+        """Wait for a node from the pool and return it, or None once
+           the search is over, either because every worker is waiting
+           or because command was set to 0"""
+        with self.lock:
+            self.idle.value += 1
+        while command.value == 1 and not self.over.value:
+            with self.lock:
+                if self.idle.value == self.workers and self.pending.value == 0:
+                    self.over.value = 1
+                    break
+            try:
+                node = self.nodes.get(block=True, timeout=steal_interval)
+            except Queue.Empty:
+                continue
+            with self.lock:
+                self.pending.value -= 1
+                self.idle.value -= 1
+            return node
+        return None
+
+    def finished(self):
+        """Return True if every node has been searched"""
+        return bool(self.over.value)
+
+def stealing_worker(pool, recognition_q, command, context):
+    """Search the nodes taken from pool, in a process of its own, until
+       the search is over
+
+       Nodes are (sensor, depth, folds, mfe, descend) tuples, as
+       checknode() is given them. Each one is searched depth first, with
+       search(), and while any worker is left idle the shallowest
+       children not yet searched are given to it (see WorkPool).
+       Folding stops at the deadline of context or once command is set
+       to 0 (see unafold.stop_when()), and any hybrid-ss-min still
+       running is killed if this process is terminated (see
+       _worker_terminate()).
+    """
+    signal.signal(signal.SIGTERM, _worker_terminate)
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    unafold.stop_when(context.deadline, command)
+    unafold.use_type_cache(context.recognition)
+    setproctitle("fealden: stealing_worker(%s)" % ''.join(context.recognition))
 
-    setproctitle("fealden: checknode(%s)" % sensor.GetRecognition())
-    checknode_logger = logging.getLogger('fealden.backtracking.checknode')
+    while command.value == 1:
+        node = pool.take(command)
+        if node is None:
+            break
+        (sensor, depth, folds, mfe, descend) = node
+        if not search(sensor, depth, recognition_q, command, context, folds,
+                      mfe, descend, pool):
+            break
+
+    checknode_logger.info(" stealing_worker(%s): search is over" %
+                          ''.join(context.recognition))
+    if folding.fold_cache is not None:
+        checknode_logger.info(" stealing_worker(): %s" % folding.fold_cache)
+    if unafold.type_cache is not None:
+        checknode_logger.info(" stealing_worker(): %s" % unafold.type_cache)
+    return True
 
-    # Order is important here, since we do a depth first
-    # search.
-    guesses = ["C","A","G","T"]
+def bestfirst_worker(sensor, recognition_q, command, context,
+                     beamwidth=None):
+    """Search from sensor best first, in a process of its own
+
+       Rather than depth first, the next node searched is always the
+       one, of all those found so far, whose scores are closest to a
+       valid solution's (see unafold.solution_distance()), the deepest
+       first where they are as close. Those scores are only settled as
+       far as it takes to tell whether each node is valid (see
+       unafold.settle_sensor()), folds being classified in full only
+       for solutions. A node whose minimum free energy ruled it out
+       takes the place of its parent. Folding stops at the deadline of
+       context or once command is set to 0 (see unafold.stop_when()),
+       and any hybrid-ss-min still running is killed if this process is
+       terminated (see _worker_terminate()).
+
+       Arguments:
+       sensor -- the util.Sensor to search from
+       recognition_q -- where to put solutions, see checknode()
+       command -- the search goes on while this is 1
+       context -- the util.SearchContext of the search
+       beamwidth -- if given, only this many of the best nodes found are
+                    kept to be searched, the rest are dropped
+    """
+    signal.signal(signal.SIGTERM, _worker_terminate)
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    unafold.stop_when(context.deadline, command)
+    unafold.use_type_cache(context.recognition)
+    setproctitle("fealden: bestfirst_worker(%s)" % ''.join(context.recognition))
+    engine = context.engine
+
+    # (distance, -depth, order found, sensor, depth, folds, mfe)
+    order = itertools.count()
+    nodes = [(0.0, 0, next(order), sensor, 0, None, None)]
+    while nodes and command.value == 1:
+        (distance, negdepth, found, sensor, depth, folds, mfe) = heapq.heappop(nodes)
+        recognition_q.put(SolutionElement(command="DEPTH", depth=depth))
+
+        children = expand(sensor, depth, recognition_q, context)
+        if children is None:
+            break
+        for (guess, new_folds, new_mfe) in children:
+            new_sensor = sensor.Copy()
+            new_sensor.PushGuess(guess)
+            if new_folds is None:
+                new_distance = distance
+            else:
+                # Only as many folds are classified as it takes to tell
+                # whether the child is valid, which bounds its scores
+                new_distance = unafold.solution_distance(
+                    unafold.score_sensor(new_sensor, new_folds, context),
+                    context.bindingratiorange, context.maxunknownpercent)
+            heapq.heappush(nodes, (new_distance, -(depth + 1), next(order),
+                                   new_sensor, depth + 1, new_folds, new_mfe))
+        evaluate(sensor, depth, recognition_q, context, folds, mfe)
+
+        if beamwidth and len(nodes) > beamwidth:
+            nodes.sort()
+            for dropped in nodes[beamwidth:]:
+                folding.release(dropped[3], engine)
+            del nodes[beamwidth:]
+
+    checknode_logger.info(" bestfirst_worker(%s): search is over, %d nodes "
+                          "left" % (''.join(context.recognition), len(nodes)))
+    if folding.fold_cache is not None:
+        checknode_logger.info(" bestfirst_worker(): %s" % folding.fold_cache)
+    if unafold.type_cache is not None:
+        checknode_logger.info(" bestfirst_worker(): %s" % unafold.type_cache)
+    return True
 
-    # Backtracking algorithms consist of two parts, the first is to
-    # determine if a node is "promising", that is, does it contain any
-    # characterstics that would preclude *all* of the children of that
-    # node from containing valid solutions.
+def expand(sensor, depth, recognition_q, context):
+    """Return the children of sensor to search, see checknode()
 
-    # If a node is promising, it does not imply that the node is a
-    # condidate solution.  Likewise, if a node is a candidate
-    # solution, it may not be a candidate solution.
+       Returns:
+       a list of (guess, folds, mfe) tuples, empty if sensor is
+       not promising, or None if the search is over
+       """
+    engine = context.engine
+    debug = checknode_logger.isEnabledFor(logging.DEBUG)
 
-    # Send message indicating what depth we've arrived at
-    recognition_q.put(SolutionElement(command="DEPTH", depth=depth))
+    if not promising(sensor, context):
+        # Node is not promising, prune the tree here.
+        folding.release(sensor, engine)
+        recognition_q.put(SolutionElement(command="PRUNED", depth=depth))
+        if debug:
+            checknode_logger.debug(" checknode(%s,%d): PRUNED" %
+                                   (sensor, depth))
+        return []
 
-    # Check command queue
-    #checknode_logger.debug(" checknode(%s, %d): command is %d" % (sensor,command.value)
-    if command.value == 0:
-        checknode_logger.info(" checknode(%s, %d): command is 0, returning True" %
-                 (sensor, depth))
-        return True
-    
-    #    checknode_logger.debug("backtracking.checknode(%s): this worker is checking its %d node" %
-    #                 (sensor, nodecounter.value()))
-    #checknode_logger.debug(" checknode(%s, %d): StemEnergy (%f), RecognitionEnergy - 2.0 (%f)" %
-    #             (sensor, depth, sensor.StemEnergy(), sensor.RecognitionEnergy() - 2.0))
-    if (sensor.StemEnergy() > sensor.RecognitionEnergy() - 2.0):
-        # Node is still promising
+    # Node is still promising
+    if debug:
         checknode_logger.debug(" checknode(%s,%d): PROMISING" %
-                      (sensor, depth))
-
-        # Check each child of this node and append any valid solutions
-        # from those children
-        for guess in guesses:
-            checknode_logger.debug(" checknode(%s,%d): checking guess %s" %
-                          (sensor, depth, guess))
+                               (sensor, depth))
 
-            # Create new sensor with this guess and recursively check
-            # for solutions
-            new_sensor = copy.deepcopy(sensor)
-            new_sensor.GuessStems(guess)
+    # Every child is folded when it is visited, so fold them all at
+    # once here, which lets the backend run hybrid-ss-min once for all
+    # four. Only their sequences are needed, so rather than a new
+    # sensor for each guess, sensor is changed and then changed back.
+    children = []
+    for guess in guesses:
+        sensor.PushGuess(guess)
+        children.append(str(sensor))
+        sensor.PopGuess()
+
+    # Children whose minimum free energy is already too high can
+    # never be valid solutions, so only the rest are fully folded
+    # (their own children are still searched).
+    try:
+        if context.maxenergy:
+            children_mfes = folding.mfe_sensors(children, engine,
+                                                parent=sensor)
+        else:
+            children_mfes = [None] * len(children)
+        passed = [new_mfe is None or context.within_maxenergy(new_mfe)
+                  for new_mfe in children_mfes]
+        tofold = [new_sensor for (new_sensor, ok) in zip(children, passed)
+                  if ok]
+        if tofold:
+            folded = folding.fold_sensors(tofold, engine, parent=sensor)
+        else:
+            folded = []
+    except unafold.UNAFoldCancelled, err:
+        checknode_logger.info(" checknode(%s, %d): %s, returning True" %
+                              (sensor, depth, err))
+        return None
+    folding.release(sensor, engine)
+
+    folded.reverse()
+    children_folds = [folded.pop() if ok else None for ok in passed]
+    return zip(guesses, children_folds, children_mfes)
+
+def evaluate(sensor, depth, recognition_q, context, folds=None, mfe=None):
+    """Fold sensor, unless folds are given, and put it on recognition_q
+       if it is a solution, see checknode()"""
+    engine = context.engine
+    debug = checknode_logger.isEnabledFor(logging.DEBUG)
+
+    # At each node we visit, we will generate all of the foldings of
+    # the sensor and, if they make it a solution, put them and its
+    # scores on recognition queue where another process collects them.
+    # Our parent will have already folded us along with our siblings,
+    # or found that our minimum free energy rules us out.
+    try:
+        if context.maxenergy and folds is None:
+            if mfe is None:
+                mfe = folding.mfe_sensors([sensor], engine)[0]
+            if not context.within_maxenergy(mfe):
+                if debug:
+                    checknode_logger.debug(" checknode(%s,%d): SCREENED, minimum free "
+                                           "energy %f exceeds max of %f" %
+                                           (sensor, depth, mfe,
+                                            context.energy_limit))
+                return True
+        if folds is None:
+            folds = folding.fold_sensor(sensor, engine)
+    except unafold.UNAFoldCancelled, err:
+        checknode_logger.info(" checknode(%s, %d): %s, returning True" %
+                              (sensor, depth, err))
+        return True
+    # The cheapest constraints are checked first, and only as many
+    # folds are classified as it takes to tell whether this is a
+    # solution
+    scores = unafold.evaluate_sensor(sensor, folds, context)
+    if scores is None:
+        if debug:
+            checknode_logger.debug(" checknode(%s,%d): REJECTED" %
+                                   (sensor, depth))
+        return True
 
-            checknode(new_sensor, depth + 1, recognition_q, command)
+    # sensor may be changed in place once this returns, see search()
+    recognition_q.put(SolutionElement(command="SOLUTION", sensor=sensor.Copy(),
+                                      scores=scores, folds=folds))
+    return True
 
+def search(sensor, depth, recognition_q, command, context, folds=None,
+           mfe=None, descend=True, pool=None):
+    """Search the tree from sensor, at depth, depth first, for
+       checknode()
+
+       The nodes of the tree are all the one sensor, each guess being
+       pushed on to it on the way down and popped back off on the way
+       up (see util.Sensor.PushGuess()), and the path to the node being
+       searched is kept on a stack rather than by recursion, so the
+       tree may be any depth. Every node's children are searched before
+       the node itself, as recursion would. Once the search returns,
+       sensor is as it was.
+
+       Arguments:
+       sensor -- the util.Sensor to search from
+       depth, recognition_q, command, context, folds, mfe, descend --
+               see checknode()
+       pool -- optionally a WorkPool, whenever it wants nodes the
+               shallowest children not yet searched are given to it
+               rather than searched here
+
+       Returns:
+       True, or False if the search was stopped
+       """
+    engine = context.engine
+    debug = checknode_logger.isEnabledFor(logging.DEBUG)
+
+    # Each node on the path is [depth, folds, mfe, children], children
+    # being None until it is expanded, then the (guess, folds, mfe) of
+    # those left to search, last first
+    stack = [[depth, folds, mfe, None]]
+    while stack:
+        node = stack[-1]
+        if node[3] is None:
+            # Send message indicating what depth we've arrived at
+            recognition_q.put(SolutionElement(command="DEPTH", depth=node[0]))
+
+            # Check command queue
+            if command.value == 0:
+                checknode_logger.info(" checknode(%s, %d): command is 0, returning" %
+                                      (sensor, node[0]))
+                if folding.fold_cache is not None:
+                    checknode_logger.info(" checknode(%s, %d): %s" %
+                                          (sensor, node[0], folding.fold_cache))
+                if unafold.type_cache is not None:
+                    checknode_logger.info(" checknode(%s, %d): %s" %
+                                          (sensor, node[0], unafold.type_cache))
+                break
+
+            # Unless descend, the first node's children are searched
+            # elsewhere (see frontier())
+            if descend or len(stack) > 1:
+                children = expand(sensor, node[0], recognition_q, context)
+                if children is None:
+                    break
+                node[3] = list(reversed(children))
+            else:
+                node[3] = []
+
+        # While another worker is waiting on the pool with nothing to
+        # search (and no node has been given it yet, see
+        # WorkPool.wanted()), give it the shallowest child not yet
+        # searched here, the one with the most work under it
+        while pool is not None and pool.wanted():
+            for (level, shallow) in enumerate(stack):
+                if shallow[3]:
+                    break
+            else:
+                break
+            (guess, new_folds, new_mfe) = shallow[3].pop(0)
+            given = sensor.Copy()
+            for i in range(len(stack) - 1 - level):
+                given.PopGuess()
+            given.PushGuess(guess)
+            folding.release(given, engine)
+            pool.give((given, shallow[0] + 1, new_folds, new_mfe, True))
+
+        if node[3]:
+            # Check the next child of this node
+            (guess, new_folds, new_mfe) = node[3].pop()
+            if debug:
+                checknode_logger.debug(" checknode(%s,%d): checking guess %s" %
+                                       (sensor, node[0], guess))
+            sensor.PushGuess(guess)
+            stack.append([node[0] + 1, new_folds, new_mfe, None])
+            continue
+
+        # Every child has been searched, so this node is checked and
+        # the search goes back up to its parent
+        evaluate(sensor, node[0], recognition_q, context, node[1], node[2])
+        stack.pop()
+        if stack:
+            sensor.PopGuess()
     else:
-        # Node is not promising, prune the tree here.
-        recognition_q.put(SolutionElement(command="PRUNED", depth=depth))
-        checknode_logger.debug(" checknode(%s,%d): PRUNED" %
-                               (sensor, depth))
+        return True
 
-    # At each node we visit, we will score the sensor and generate
-    # all of its foldings and put those scores on recognition queue
-    # where another process can evaluate them. 
-    folds = unafold.parse_ct(unafold.run_hybrid_ss_min(sensor))
-    scores = unafold.score_sensor(sensor,folds)
-    
-    recognition_q.put(SolutionElement(command="SOLUTION", sensor=sensor,
-                                      scores=scores, folds=folds))
-    
-    return True
+    # The search was stopped, leave sensor as it was
+    for i in range(len(stack) - 1):
+        sensor.PopGuess()
+    return False
 
+def checknode(sensor, depth, recognition_q, command, context=None, folds=None,
+              mfe=None, descend=True):
+    # Reset default signal handlers
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
 
+    if context is None:
+        context = SearchContext(sensor.Recognition)
 
+    setproctitle("fealden: checknode(%s)" % sensor.GetRecognition())
 
+    # Backtracking algorithms consist of two parts, the first is to
+    # determine if a node is "promising", that is, does it contain any
+    # characterstics that would preclude *all* of the children of that
+    # node from containing valid solutions.
 
+    # If a node is promising, it does not imply that the node is a
+    # condidate solution.  Likewise, if a node is a candidate
+    # solution, it may not be a candidate solution.
+
+    # The tree is searched depth first, without recursion, sensor
+    # itself being changed to each node in turn
+    search(sensor, depth, recognition_q, command, context, folds, mfe,
+           descend)
+    return True
 
-    
@@ -13,7 +13,13 @@ class ConfigError(Exception):
         return str(self.msg)
 
 def getconfig(ini=None):
-    fealden = ConfigParser.ConfigParser({'timeout':"60"})
+    fealden = ConfigParser.ConfigParser({'timeout':"60",
+                                         'foldcache_size':"256",
+                                         'folding_concurrency':"1",
+                                         'typecache_size':"4096",
+                                         'classified_weight':"1.0",
+                                         'search_workers':"1",
+                                         'frontier_depth':"2"})
     toread = ["/etc/fealden.ini",
               "../etc/fealden.ini",
               "etc/fealden.ini",
@@ -52,6 +58,10 @@ def getconfig(ini=None):
                             "workqueue",
                             "solutions"]
     
+    # The fold cache is optional, but if it is set it must be writable
+    if fealden.has_option("Locations", "foldcache"):
+        required_rw_settings.append("foldcache")
+
     # Check writability
     for location in [fealden.get("Locations", x) for x in required_rw_settings]:
         if not os.access(location, os.W_OK):
@@ -1,6 +1,10 @@
 import logging
 import collections
 
+import numpy as np
+
+from . import unafold
+
 #import orderedset
 
 logging.basicConfig(level=logging.DEBUG)
@@ -10,7 +14,7 @@ def gen_graph(fold):
     """Returns a graph of our fold
 
        Arguments:
-        fold -- as described in unafold
+        fold -- as described in unafold, a unafold.Fold or its "seq"
        Returns:
 	    a graph as given by Python Patterns -- Implementing Graphs
 	    (https://www.python.org/doc/essays/graphs/), each node is a single
@@ -19,23 +23,148 @@ def gen_graph(fold):
     def getvertexes(nucl):
         return [x for x in [nucl["bp"], nucl["upstream"],nucl["downstream"]] if x != 0]
 
+    if isinstance(fold, unafold.Fold):
+        fold = fold["seq"]
     graph = { index + 1: getvertexes(nucl) for (index,nucl) in enumerate (fold)}
     return graph
 
 def find_shortest_path(graph, start, end, path=[]):
+    """Returns the shortest path from start to end, a list of nodes
+       beginning with path and start, or None if there is none.
+
+       The graph is searched breadth first, so the first path found to
+       end is a shortest one. Nodes already in path are not revisited.
+       """
     path = path + [start]
     if start == end:
         return path
-    if not graph.has_key(start):
+    if start not in graph:
         return None
-    shortest = None
-    for node in graph[start]:
-        if node not in path:
-            newpath = find_shortest_path(graph, node, end, path)
-            if newpath:
-                if not shortest or len(newpath) < len(shortest):
-                    shortest = newpath
-    return shortest
+
+    # Each node reached points back to the node it was reached from
+    previous = dict([(node, None) for node in path])
+    queue = collections.deque([start])
+    while queue:
+        node = queue.popleft()
+        for following in graph.get(node, []):
+            if following in previous:
+                continue
+            previous[following] = node
+            if following == end:
+                found = [end]
+                while found[-1] != start:
+                    found.append(previous[found[-1]])
+                found.reverse()
+                return path[:-1] + found
+            queue.append(following)
+    return None
+
+# The graphs of the last folds linear() was asked about, by id(), each
+# kept with its fold so that the id is not reused
+_graphs = collections.OrderedDict()
+graph_cache_size = 64
+
+def graph_of(fold):
+    """Return gen_graph() of fold, made once for each of the last
+       graph_cache_size folds asked for"""
+    key = id(fold)
+    if key in _graphs and _graphs[key][0] is fold:
+        entry = _graphs.pop(key)
+    else:
+        entry = (fold, gen_graph(fold))
+    _graphs[key] = entry
+    while len(_graphs) > graph_cache_size:
+        _graphs.popitem(last=False)
+    return entry[1]
 
 def linear(fold, nucl1, nucl2):
-    return find_shortest_path(gen_graph(fold), nucl1, nucl2)
+    return find_shortest_path(graph_of(fold), nucl1, nucl2)
+
+def neighbours(folds):
+    """Return the neighbours of every nucleotide of folds of the same
+       length, stacked
+
+       Arguments:
+        folds -- a list of unafold.Fold (or of the older dictionary form)
+       Returns:
+        an int array, [fold, nucleotide, 0:3], of the 0-based index of
+        the nucleotide paired with, upstream of and downstream of each
+        nucleotide, n (one past the last nucleotide) for none
+       """
+    columns = []
+    for fold in folds:
+        if isinstance(fold, unafold.Fold):
+            columns.append((fold.bp, fold.upstream, fold.downstream))
+        else:
+            columns.append(tuple([[nucl[name] for nucl in fold["seq"]]
+                                  for name in ("bp", "upstream", "downstream")]))
+    stacked = np.array(columns, dtype=np.int32).reshape(len(folds), 3, -1)
+    n = stacked.shape[2]
+    # 1-based with 0 for none, to 0-based with n for none
+    stacked = np.where(stacked == 0, n + 1, stacked) - 1
+    return stacked.transpose(0, 2, 1)
+
+def batch_distances(folds, sources):
+    """Return the length of the shortest path from each of sources to
+       every nucleotide, in every one of folds, all found at once by a
+       breadth first search over the stacked graphs
+
+       Arguments:
+        folds -- a list of unafold.Fold (or of the older dictionary form),
+                 all of the same length
+        sources -- a list of nucleotide indexes (1-based)
+       Returns:
+        an int array, [fold, source, nucleotide], -1 where there is no
+        path
+       """
+    adjacent = neighbours(folds)
+    (count, n) = adjacent.shape[:2]
+    distances = np.full((count, len(sources), n), -1, dtype=np.int32)
+    if count == 0 or n == 0:
+        return distances
+
+    # The column past the last nucleotide stands for "none", it is never
+    # reached
+    frontier = np.zeros((count, len(sources), n + 1), dtype=bool)
+    for (index, source) in enumerate(sources):
+        frontier[:, index, source - 1] = True
+    visited = frontier.copy()
+    distances[frontier[:, :, :n]] = 0
+
+    step = 0
+    while frontier.any():
+        step += 1
+        # The graph is undirected, so a nucleotide is reached when any
+        # of its neighbours was on the frontier
+        reached = np.zeros_like(frontier)
+        for column in range(adjacent.shape[2]):
+            index = np.broadcast_to(adjacent[:, np.newaxis, :, column],
+                                    (count, len(sources), n))
+            reached[:, :, :n] |= np.take_along_axis(frontier, index, axis=2)
+        frontier = reached & ~visited
+        visited |= frontier
+        distances[frontier[:, :, :n]] = step
+    return distances
+
+def fluorophore_quencher(folds, quencher, bases=None):
+    """Return the distances in each of folds from the fluorophore (at
+       the 5' end) and from the quencher, to the quencher and to each of
+       bases
+
+       Arguments:
+        folds -- a list of unafold.Fold, all of the same length
+        quencher -- the index (1-based) of the quencher
+        bases -- a list of nucleotide indexes (1-based), for instance
+                 the bases of the stems
+       Returns:
+        (to_quencher, from_fluorophore, from_quencher), an int array
+        with the distance from fluorophore to quencher in each fold and
+        two int arrays [fold, base] of the distances to bases
+       """
+    if bases is None:
+        bases = []
+    distances = batch_distances(folds, [1, quencher])
+    positions = np.array(bases, dtype=np.intp) - 1
+    return (distances[:, 0, quencher - 1],
+            distances[:, 0, positions],
+            distances[:, 1, positions])
@@ -0,0 +1,69 @@
+"""Drawings of folds for the web output, made from the folds themselves
+   rather than by UNAFold.pl, see folding.FoldingBackend.draw()"""
+
+import logging
+import os
+
+from matplotlib.backends.backend_ps import FigureCanvasPS
+from matplotlib.figure import Figure
+from matplotlib.patches import Arc
+
+from . import unafold
+
+logger = logging.getLogger(__name__)
+
+def draw_fold(fold, path, title=None):
+    """Draw fold as an arc diagram, the sequence along the bottom with
+       an arc joining each pair, to the postscript file path
+
+       Arguments:
+       fold -- a unafold.Fold (or a fold in the older dictionary form)
+       path -- the file to write
+       title -- optionally, a title for the drawing
+    """
+    bp = unafold.fold_bp(fold)
+    sequence = [element["nucl"] for element in fold["seq"]]
+    n = len(sequence)
+
+    figure = Figure(figsize=(min(max(n * .15, 4), 20), 4))
+    FigureCanvasPS(figure)
+    ax = figure.add_subplot(1, 1, 1)
+    ax.plot(range(1, n + 1), [0] * n, "k-", linewidth=.5)
+    for (index, nucl) in enumerate(sequence):
+        ax.text(index + 1, -.5, nucl, ha="center", va="top", fontsize=6)
+
+    highest = 1
+    for (i, j) in enumerate(bp.tolist(), 1):
+        if j > i:
+            ax.add_patch(Arc(((i + j) / 2.0, 0), j - i, j - i,
+                             theta1=0, theta2=180))
+            highest = max(highest, (j - i) / 2.0)
+
+    ax.set_xlim(0, n + 1)
+    ax.set_ylim(-2, highest + 1)
+    ax.set_aspect("equal")
+    ax.axis("off")
+    if title:
+        ax.set_title(title)
+    figure.savefig(path)
+
+def draw_folds(sequence, folds, directory):
+    """Draw each of folds, the folds of sequence, to <sequence>_<n>.ps in
+       directory for the nth fold, as UNAFold.pl names its drawings
+
+       Arguments:
+       sequence -- a sequence, or a util.Sensor
+       folds -- a list of folds, see draw_fold()
+       directory -- where to write the drawings
+
+       Returns:
+       list of the files written
+    """
+    paths = []
+    for (index, fold) in enumerate(folds):
+        path = os.path.join(directory, "%s_%d.ps" % (sequence, index + 1))
+        logger.debug("draw_folds(%s): drawing fold %d to %s" %
+                     (sequence, index + 1, path))
+        draw_fold(fold, path, "%s: dG = %.2f" % (index + 1, fold["energy"]))
+        paths.append(path)
+    return paths
@@ -0,0 +1,213 @@
+"""A persistent cache of folds, shared by every search.
+
+   Folds are stored on disk, one pickled file per sequence, under a
+   name derived from the sequence and the conditions (engine,
+   temperature, salt, mfold parameters) it was folded under, so that
+   any process, and any later run of fealdend, can reuse them.
+
+   The total size of the cache directory is capped, the least recently
+   used entries (by modification time, which is updated on every hit)
+   are removed first. A small number of recently used entries are also
+   kept in memory."""
+
+import collections
+import errno
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+class FoldCacheError(Exception):
+    """Exception raised for errors in creating a fold cache"""
+
+    def __init__(self, msg):
+        self.msg = msg
+
+    def __str__(self):
+        return repr(self.msg)
+
+
+def key(sequence, conditions):
+    """Return the cache key for sequence folded under conditions
+
+       Arguments:
+       sequence -- a sequence, or a util.Sensor
+       conditions -- a dictionary of everything that affects the
+                     folds, for example the engine and temperature
+
+       Returns:
+       str -- a hex digest
+    """
+    description = repr((str(sequence).upper(), sorted(conditions.items())))
+    return hashlib.sha1(description.encode("ascii")).hexdigest()
+
+
+class FoldCache(object):
+    def __init__(self, directory, maxbytes=256 * 1024 * 1024, hotsize=1024):
+        """An on disk cache of lists of folds
+
+           Arguments:
+           directory -- where to keep the cache, created if needed
+           maxbytes -- the most that may be stored in directory
+           hotsize -- the number of entries to also keep in memory
+        """
+        self.directory = directory
+        self.maxbytes = maxbytes
+        self.hotsize = hotsize
+
+        # Each entry is kept pickled, so that callers are free to
+        # modify the folds they are given.
+        self.hot = collections.OrderedDict()
+
+        self.hits = 0
+        self.hot_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError, err:
+                raise FoldCacheError("FoldCache(): could not create %s, %s" %
+                                     (directory, err))
+
+        # Approximately how much is stored, other processes may be
+        # adding to the cache too, so this is only a hint as to when
+        # to scan the directory.
+        self.size = self._scan()[0]
+
+    def _path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def _scan(self):
+        """Return the total size and a list of (mtime, size, path) of
+           every entry"""
+        total = 0
+        entries = []
+        for subdir in os.listdir(self.directory):
+            subpath = os.path.join(self.directory, subdir)
+            if not os.path.isdir(subpath):
+                continue
+            for name in os.listdir(subpath):
+                path = os.path.join(subpath, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    # Removed by another process
+                    continue
+                total += stat.st_size
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return total, entries
+
+    def _remember(self, digest, data):
+        self.hot[digest] = data
+        while len(self.hot) > self.hotsize:
+            self.hot.popitem(last=False)
+
+    def get(self, sequence, conditions):
+        """Return the folds for sequence under conditions, or None if
+           they are not in the cache"""
+        digest = key(sequence, conditions)
+
+        if digest in self.hot:
+            data = self.hot.pop(digest)
+            self.hot[digest] = data
+            self.hits += 1
+            self.hot_hits += 1
+            return pickle.loads(data)
+
+        path = self._path(digest)
+        try:
+            cached = open(path, "rb")
+            try:
+                data = cached.read()
+            finally:
+                cached.close()
+            folds = pickle.loads(data)
+        except (IOError, OSError):
+            self.misses += 1
+            return None
+        except Exception, err:
+            # A corrupt entry is just a miss, it will be replaced
+            logger.info("FoldCache.get(%s): unreadable entry %s, %s" %
+                        (sequence, path, err))
+            self.misses += 1
+            return None
+
+        # Mark this as recently used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+        self._remember(digest, data)
+        self.hits += 1
+        return folds
+
+    def put(self, sequence, conditions, folds):
+        """Store the folds for sequence under conditions"""
+        digest = key(sequence, conditions)
+        data = pickle.dumps(folds, pickle.HIGHEST_PROTOCOL)
+        self._remember(digest, data)
+
+        path = self._path(digest)
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                try:
+                    os.makedirs(os.path.dirname(path))
+                except OSError, err:
+                    if err.errno != errno.EEXIST:
+                        raise
+
+            # Write to a temporary file and rename it in to place, so
+            # that readers never see a partial entry
+            (fd, temppath) = tempfile.mkstemp(dir=os.path.dirname(path))
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+            os.rename(temppath, path)
+        except (IOError, OSError), err:
+            logger.info("FoldCache.put(%s): could not store %s, %s" %
+                        (sequence, path, err))
+            return
+
+        self.size += len(data)
+        if self.size > self.maxbytes:
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache is
+           below 90% of maxbytes"""
+        (total, entries) = self._scan()
+        entries.sort()
+        target = self.maxbytes * .9
+        for (mtime, size, path) in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.hot.pop(os.path.basename(path), None)
+            total -= size
+            self.evictions += 1
+        self.size = total
+
+    def stats(self):
+        """Return a dictionary of hits, hot_hits, misses, evictions and
+           size"""
+        return {"hits": self.hits,
+                "hot_hits": self.hot_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": self.size}
+
+    def __str__(self):
+        return ("FoldCache(%s): %d hits (%d in memory), %d misses, "
+                "%d evictions, %d bytes" %
+                (self.directory, self.hits, self.hot_hits, self.misses,
+                 self.evictions, self.size))
@@ -0,0 +1,482 @@
+"""Folding backends.
+
+   Everything that needs the folds of a sensor (the search, scoring and
+   output) goes through a FoldingBackend, chosen by name with
+   get_backend(), rather than calling a particular folding program.
+
+   hybrid-ss-min -- UNAfold's hybrid-ss-min, see unafold.run_hybrid_ss_min()
+   native -- the in-process folder in nativefold
+   replay -- serves the folds stored with the test cases under
+             fealden/test/tests, so that searches can be run (and timed)
+             deterministically without UNAfold installed, for tests and
+             benchmarks only
+
+   fold_sensor() and fold_sensors() also read through fold_cache, if it
+   has been set."""
+
+import collections
+import copy
+import logging
+import os
+import pickle
+import subprocess
+
+from . import drawing
+from . import nativefold
+from . import unafold
+
+logger = logging.getLogger(__name__)
+
+class FoldingError(Exception):
+    """Exception raised for errors in folding a sequence"""
+
+    def __init__(self, msg):
+        self.msg = msg
+
+    def __str__(self):
+        return repr(self.msg)
+
+
+class FoldingBackend(object):
+    """A way of folding sequences. Subclasses must set name and implement
+       fold(), and may override fold_many() when folding many sequences at
+       once is cheaper than one at a time, and mfe_many() when the
+       minimum free energy is cheaper to find than every fold."""
+
+    name = None
+
+    def fold(self, sequence, conditions):
+        """Return the folds of sequence under conditions
+
+           Arguments:
+           sequence -- a sequence, or a util.Sensor
+           conditions -- a dictionary, as unafold.conditions
+
+           Returns:
+           list of folds, as described in unafold.parse_ct()
+        """
+        raise NotImplementedError
+
+    def fold_many(self, sequences, conditions, parent=None):
+        """Return, for each of sequences, its list of folds
+
+           Arguments:
+           sequences -- a list of sequences, or util.Sensors
+           conditions -- as in fold()
+           parent -- optionally, the sequence that each of sequences was
+                     grown from (see util.Sensor.GuessStems()), which a
+                     backend may use to save work
+        """
+        return [self.fold(sequence, conditions) for sequence in sequences]
+
+    def mfe_many(self, sequences, conditions, parent=None):
+        """Return, for each of sequences, its minimum free energy (the
+           energy of the first of its folds), see fold_many()"""
+        return [min([fold["energy"] for fold in folds] or [0.0])
+                for folds in self.fold_many(sequences, conditions, parent)]
+
+    def release(self, sequence):
+        """Called once sequence will no longer be given as a parent to
+           fold_many(), so anything kept for it can be dropped"""
+        pass
+
+    def draw(self, sequence, directory, folds=None, conditions=None,
+             command="UNAFold.pl"):
+        """Draw the structures of sequence as postscript files in
+           directory, <sequence>_<n>.ps for its nth fold, for the web
+           output. Unless a backend draws them its own way, folds are
+           drawn as they are (see drawing.draw_folds()), so that the
+           drawings are of exactly the folds scored.
+
+           Arguments:
+           sequence -- a sequence, or a util.Sensor
+           directory -- where to write the drawings
+           folds -- the folds of sequence to draw, by default it is
+                    folded
+           conditions -- a dictionary, as unafold.conditions
+           command -- the UNAFold.pl to run, for backends drawing with it
+        """
+        if conditions is None:
+            conditions = unafold.conditions
+        if folds is None:
+            folds = self.fold(sequence, conditions)
+        try:
+            drawing.draw_folds(sequence, folds, directory)
+        except (OSError, IOError), err:
+            raise FoldingError(str(err))
+
+
+class HybridSSMin(FoldingBackend):
+    """Folds with hybrid-ss-min.
+
+       Arguments:
+       concurrency -- fold_many() splits the sequences between up to this
+                      many runs of hybrid-ss-min at once, see
+                      unafold.FoldDispatcher
+    """
+    name = "hybrid-ss-min"
+
+    def __init__(self, concurrency=1):
+        self.concurrency = concurrency
+
+    def fold(self, sequence, conditions):
+        return unafold.parse_ct(unafold.run_hybrid_ss_min(sequence,
+                                                          folding_conditions=conditions))
+
+    def fold_many(self, sequences, conditions, parent=None):
+        if len(sequences) == 1:
+            return [self.fold(sequences[0], conditions)]
+        if self.concurrency <= 1:
+            return [unafold.parse_ct(lines) for lines in
+                    unafold.run_hybrid_ss_min_batch(sequences,
+                                                    folding_conditions=conditions)]
+
+        names = []
+        for sequence in sequences:
+            if str(sequence) not in names:
+                names.append(str(sequence))
+
+        # Deal the sequences out between the runs
+        runs = min(self.concurrency, len(names))
+        dispatcher = unafold.FoldDispatcher(runs, conditions)
+        for index in range(runs):
+            dispatcher.submit(names[index::runs], index)
+
+        by_name = {}
+        for (index, lines) in dispatcher.as_completed():
+            by_name.update(unafold.split_ct(lines))
+
+        missing = [name for name in names if name not in by_name]
+        if missing:
+            raise FoldingError("HybridSSMin.fold_many(): no structures for %s" %
+                               ', '.join(missing))
+        return [unafold.parse_ct(by_name[str(sequence)])
+                for sequence in sequences]
+
+    def mfe_many(self, sequences, conditions, parent=None):
+        # Without --mfold hybrid-ss-min only finds the minimum free
+        # energy structure of each
+        return [float(unafold.parse_ct_arrays(lines).energy[0]) for lines in
+                unafold.run_hybrid_ss_min_batch(sequences,
+                                                folding_conditions=conditions,
+                                                mfe=True)]
+
+    def draw(self, sequence, directory, folds=None, conditions=None,
+             command="UNAFold.pl"):
+        """Draw with UNAFold.pl, whose folds are those of hybrid-ss-min,
+           so folds are not needed, see FoldingBackend.draw()"""
+        if conditions is None:
+            conditions = unafold.conditions
+        try:
+            seqfile = open(os.path.join(directory, str(sequence)),"w")
+            seqfile.write(str(sequence))
+            seqfile.close()
+            command = [command,'-n','DNA',
+                       '--temp=%s' % conditions["temperature"],
+                       '--sodium=%s' % conditions["sodium"],
+                       '--magnesium=%s' % conditions["magnesium"],
+                       '--percent=%s' % conditions["percent"], str(sequence)]
+            logger.debug("%s.draw(%s): running %s in %s" %
+                         (self.name, sequence, command, directory))
+            subprocess.check_output(command, cwd=directory,
+                                    stderr=subprocess.STDOUT)
+        except (OSError, IOError), err:
+            raise FoldingError(str(err))
+        except subprocess.CalledProcessError, err:
+            logger.error("%s.draw(%s): %s and output as follows: %s" %
+                         (self.name, sequence, err, err.output))
+
+
+class Native(FoldingBackend):
+    """Folds in-process with nativefold.
+
+       The dynamic programming tables of each sequence folded are kept
+       until it is release()d (or until there are more than keep of
+       them), so that when its children are folded, with it as their
+       parent, only the entries the inserted nucleotides change are
+       computed again. Finding the minimum free energy only needs the
+       inside tables, and those are kept too, so folding a sequence
+       after mfe_many() only has to find its structures.
+    """
+    name = "native"
+
+    def __init__(self, keep=256):
+        self.keep = keep
+        self.tables = collections.OrderedDict()
+        self.reused = 0
+
+    def _tables(self, sequence, conditions, parent=None):
+        """Return the FoldTables of sequence, with the inside filled"""
+        if unafold.stopped():
+            raise unafold.UNAFoldCancelled("Native: not folding %s, the search "
+                                           "has ended" % sequence)
+        energy = nativefold.energies(conditions["temperature"],
+                                     conditions["sodium"],
+                                     conditions["magnesium"])
+        key = str(sequence).upper()
+        tables = self.tables.get(key)
+        if tables is not None and tables.energy is energy:
+            return tables
+
+        parent_tables = None
+        if parent is not None:
+            parent_tables = self.tables.get(str(parent).upper())
+
+        tables = nativefold.fold_tables(key, conditions["temperature"],
+                                        conditions["sodium"],
+                                        conditions["magnesium"],
+                                        parent=parent_tables)
+        if tables.n == 0:
+            return tables
+        if parent_tables is not None:
+            self.reused += 1
+
+        self.tables[key] = tables
+        while len(self.tables) > self.keep:
+            self.tables.popitem(last=False)
+        return tables
+
+    def fold(self, sequence, conditions, parent=None):
+        tables = self._tables(sequence, conditions, parent)
+        if tables.n == 0:
+            return []
+        return tables.folds(conditions["percent"], conditions["window"],
+                            conditions["maxfolds"])
+
+    def fold_many(self, sequences, conditions, parent=None):
+        return [self.fold(sequence, conditions, parent)
+                for sequence in sequences]
+
+    def mfe_many(self, sequences, conditions, parent=None):
+        return [self._tables(sequence, conditions, parent).mfe()
+                for sequence in sequences]
+
+    def release(self, sequence):
+        self.tables.pop(str(sequence).upper(), None)
+
+
+class Replay(FoldingBackend):
+    """Serves the folds recorded in the test cases. Those were all folded
+       by hybrid-ss-min under the default unafold.conditions.
+
+       Arguments:
+       directory -- the test case directory
+       strict -- if True, folding a sequence (or using conditions) that
+                 was not recorded raises a FoldingError, otherwise it is
+                 folded by fallback
+       fallback -- a FoldingBackend, defaults to Native()
+    """
+    name = "replay"
+
+    def __init__(self, directory=None, strict=False, fallback=None):
+        if directory is None:
+            directory = os.path.join(os.path.dirname(__file__), "test", "tests")
+        self.directory = directory
+        self.strict = strict
+        self.fallback = fallback
+        self.recorded = None
+
+    def _load(self, path):
+        try:
+            pickled = open(path, "rb")
+            try:
+                return pickle.load(pickled)
+            finally:
+                pickled.close()
+        except Exception, err:
+            logger.debug("Replay._load(%s): skipping, %s" % (path, err))
+            return None
+
+    def _record(self, sequence, folds):
+        # Leave out anything score_sensor() added, so that these are
+        # exactly what parse_ct() returned
+        clean = []
+        for fold in folds:
+            if not isinstance(fold, unafold.Fold):
+                fold = unafold.Fold.from_dict(fold)
+            clean.append(unafold.Fold(fold.energy, fold.sequence, fold.bp,
+                                      fold.upstream, fold.downstream))
+        self.recorded.setdefault(str(sequence).upper(), clean)
+
+    def index(self):
+        """Read every recorded fold list under directory"""
+        self.recorded = {}
+
+        # .ct files exactly as hybrid-ss-min produced them
+        ct_dir = os.path.join(self.directory, "run_hybrid_ss_min")
+        if os.path.isdir(ct_dir):
+            for name in sorted(os.listdir(ct_dir)):
+                lines = self._load(os.path.join(ct_dir, name))
+                if lines:
+                    self._record(name, unafold.parse_ct(lines))
+
+        # (sensor, folds, scores)
+        score_dir = os.path.join(self.directory, "score_sensor")
+        if os.path.isdir(score_dir):
+            for name in sorted(os.listdir(score_dir)):
+                test = self._load(os.path.join(score_dir, name))
+                if test:
+                    self._record(test[0], test[1])
+
+        # (sensor, scores, folds, ...)
+        validate_dir = os.path.join(self.directory, "validate_sensor")
+        if os.path.isdir(validate_dir):
+            for name in sorted(os.listdir(validate_dir)):
+                test = self._load(os.path.join(validate_dir, name))
+                if test:
+                    self._record(test[0], test[2])
+
+        # <test>/work/pickle.dat holds (sensor, scores, folds)
+        output_dir = os.path.join(self.directory, "solution_output_tests")
+        if os.path.isdir(output_dir):
+            for name in sorted(os.listdir(output_dir)):
+                test = self._load(os.path.join(output_dir, name, "work",
+                                               "pickle.dat"))
+                if test:
+                    self._record(test[0], test[2])
+
+        logger.debug("Replay.index(%s): %d sequences recorded" %
+                     (self.directory, len(self.recorded)))
+        return self.recorded
+
+    def sequences(self):
+        """Return every recorded sequence"""
+        if self.recorded is None:
+            self.index()
+        return sorted(self.recorded)
+
+    def fold(self, sequence, conditions):
+        if self.recorded is None:
+            self.index()
+
+        key = str(sequence).upper()
+        if key in self.recorded and conditions == unafold.conditions:
+            return copy.deepcopy(self.recorded[key])
+
+        if self.strict:
+            raise FoldingError("Replay.fold(): no recorded folds for %s under %s" %
+                               (sequence, conditions))
+        if self.fallback is None:
+            self.fallback = Native()
+        return self.fallback.fold(sequence, conditions)
+
+
+# Backends by name. Requests may only give those in
+# util.RequestElement.valid_engines, replay is for tests and benchmarks.
+backends = {HybridSSMin.name: HybridSSMin,
+            Native.name: Native,
+            Replay.name: Replay}
+
+default_backend = HybridSSMin.name
+
+_instances = {}
+
+def get_backend(name=None):
+    """Return the (shared) FoldingBackend called name, defaults to
+       default_backend"""
+    if not name:
+        name = default_backend
+    if name not in backends:
+        raise FoldingError("get_backend(): unknown folding backend %s" % name)
+    if name not in _instances:
+        _instances[name] = backends[name]()
+    return _instances[name]
+
+
+# An optional foldcache.FoldCache that fold_sensor() and fold_sensors()
+# read through
+fold_cache = None
+
+def fold_sensor(sensor, engine=None, conditions=None):
+    """Fold a sensor and return all of its folds
+
+       Arguments:
+       sensor -- a util.Sensor, or anything whose str() is a sequence
+       engine -- the name of a backend, see get_backend()
+       conditions -- defaults to unafold.conditions
+
+       Returns:
+       list of folds, as described in unafold.parse_ct()
+    """
+    return fold_sensors([sensor], engine, conditions)[0]
+
+def fold_sensors(sensors, engine=None, conditions=None, parent=None):
+    """Fold a list of sensors, all at once if the backend can. If
+       fold_cache is set, sensors that have been folded before are taken
+       from it and any newly folded are added to it.
+
+       Arguments:
+       sensors -- a list of util.Sensor, or of their sequences
+       engine, conditions -- as in fold_sensor()
+       parent -- optionally, the util.Sensor that every one of sensors
+                 was grown from, see FoldingBackend.fold_many()
+
+       Returns:
+       list -- for each sensor, its list of folds
+    """
+    backend = get_backend(engine)
+    if conditions is None:
+        conditions = unafold.conditions
+
+    cache_conditions = dict(conditions, engine=backend.name)
+
+    folds = [None] * len(sensors)
+    if fold_cache is not None:
+        for index, sensor in enumerate(sensors):
+            folds[index] = fold_cache.get(sensor, cache_conditions)
+
+    tofold = [sensor for (sensor, cached) in zip(sensors, folds)
+              if cached is None]
+    if not tofold:
+        return folds
+
+    folded = backend.fold_many(tofold, conditions, parent)
+
+    folded.reverse()
+    for index, sensor in enumerate(sensors):
+        if folds[index] is None:
+            folds[index] = folded.pop()
+            if fold_cache is not None:
+                fold_cache.put(sensor, cache_conditions, folds[index])
+    return folds
+
+def mfe_sensors(sensors, engine=None, conditions=None, parent=None):
+    """Return the minimum free energy of each of sensors, which is
+       usually much quicker than fold_sensors(). Sensors whose folds are
+       in fold_cache are taken from there.
+
+       Arguments:
+       as in fold_sensors()
+
+       Returns:
+       list -- for each sensor, the energy of its first fold
+    """
+    backend = get_backend(engine)
+    if conditions is None:
+        conditions = unafold.conditions
+
+    energies = [None] * len(sensors)
+    if fold_cache is not None:
+        cache_conditions = dict(conditions, engine=backend.name)
+        for index, sensor in enumerate(sensors):
+            folds = fold_cache.get(sensor, cache_conditions)
+            if folds is not None:
+                energies[index] = min([fold["energy"] for fold in folds] or [0.0])
+
+    tofind = [sensor for (sensor, energy) in zip(sensors, energies)
+              if energy is None]
+    if not tofind:
+        return energies
+
+    found = backend.mfe_many(tofind, conditions, parent)
+
+    found.reverse()
+    for index in range(len(sensors)):
+        if energies[index] is None:
+            energies[index] = found.pop()
+    return energies
+
+def release(sensor, engine=None):
+    """Tell the backend sensor won't be used as a parent again, see
+       FoldingBackend.release()"""
+    get_backend(engine).release(sensor)
@@ -0,0 +1,686 @@
+"""An in-process DNA folding engine.
+
+   This is a Zuker style minimum free energy folder, with mfold style
+   suboptimal structures, written in Python and NumPy so that folding
+   a sensor does not require a temporary directory, a fork/exec of
+   hybrid-ss-min and a trip through the filesystem.
+
+   The energy model is a simplified nearest neighbor model:
+
+   * Watson-Crick stacks from SantaLucia & Hicks (2004), corrected for
+     temperature and salt.
+   * Hairpin, bulge and internal loop initiation energies from the same
+     source, treated as purely entropic.
+   * A terminal A-T penalty at the end of every helix.
+   * A linear multiloop penalty, a + b * unpaired + c * branches.
+
+   It does not model dangles, terminal mismatches, special hairpins or
+   coaxial stacking, so energies will not match hybrid-ss-min exactly,
+   but the folds returned have exactly the same shape as those returned
+   by unafold.parse_ct()."""
+
+from __future__ import division
+
+import logging
+import math
+
+import numpy as np
+
+from . import unafold
+
+logger = logging.getLogger(__name__)
+
+# Anything at or above this is treated as "can not form"
+INF = 1.0e7
+
+# Tolerance used to recognize which term produced a value during
+# traceback.
+EPS = 1.0e-6
+
+MIN_HAIRPIN = 3
+MAX_LOOP = 30
+MAX_HAIRPIN = MAX_LOOP * 4
+
+# Multiloop penalties (kcal/mol), as used by mfold for DNA
+MULTI_A = 3.4
+MULTI_B = 0.0
+MULTI_C = 0.4
+
+INTERNAL_ASYMMETRY = 0.3
+
+GAS_CONSTANT = 0.0019872
+KELVIN = 273.15
+
+PAIRS = frozenset(["AT", "TA", "GC", "CG"])
+
+# Nearest neighbor stacks (dH kcal/mol, dS cal/mol/K) keyed by the 5'->3'
+# dinucleotide on the top strand, SantaLucia & Hicks (2004).
+STACKS = {"AA": (-7.6, -21.3), "TT": (-7.6, -21.3),
+          "AT": (-7.2, -20.4),
+          "TA": (-7.2, -21.3),
+          "CA": (-8.5, -22.7), "TG": (-8.5, -22.7),
+          "GT": (-8.4, -22.4), "AC": (-8.4, -22.4),
+          "CT": (-7.8, -21.0), "AG": (-7.8, -21.0),
+          "GA": (-8.2, -22.2), "TC": (-8.2, -22.2),
+          "CG": (-10.6, -27.2),
+          "GC": (-9.8, -24.4),
+          "GG": (-8.0, -19.9), "CC": (-8.0, -19.9)}
+
+TERMINAL_AT = (2.2, 6.9)
+
+# Loop initiation free energies at 37C (kcal/mol) by loop size
+HAIRPIN = {3: 3.5, 4: 3.5, 5: 3.3, 6: 4.0, 7: 4.2, 8: 4.3, 9: 4.5, 10: 4.6,
+           12: 5.0, 14: 5.1, 16: 5.3, 18: 5.5, 20: 5.7, 25: 6.1, 30: 6.3}
+BULGE = {1: 4.0, 2: 2.9, 3: 3.1, 4: 3.2, 5: 3.3, 6: 3.5, 7: 3.7, 8: 3.9,
+         9: 4.1, 10: 4.3, 12: 4.5, 14: 4.8, 16: 5.0, 18: 5.2, 20: 5.3,
+         25: 5.6, 30: 5.9}
+INTERNAL = {3: 3.2, 4: 3.6, 5: 4.0, 6: 4.4, 7: 4.6, 8: 4.8, 9: 4.9, 10: 4.9,
+            12: 5.2, 14: 5.4, 16: 5.6, 18: 5.8, 20: 5.9, 25: 6.3, 30: 6.6}
+
+
+def _loop_initiation(table, size):
+    """Return the 37C initiation energy of a loop of size nucleotides,
+       interpolating between and extrapolating beyond the tabulated
+       sizes"""
+    if size in table:
+        return table[size]
+    sizes = sorted(table)
+    if size < sizes[0]:
+        return table[sizes[0]]
+    if size > sizes[-1]:
+        # Jacobson-Stockmayer extrapolation
+        return (table[sizes[-1]] +
+                1.75 * GAS_CONSTANT * (KELVIN + 37) *
+                math.log(float(size) / sizes[-1]))
+    lo = max([x for x in sizes if x < size])
+    hi = min([x for x in sizes if x > size])
+    return table[lo] + (table[hi] - table[lo]) * (size - lo) / (hi - lo)
+
+
+class Energies(object):
+    """Free energies for a given set of folding conditions
+
+       Arguments:
+       temperature -- degrees C
+       sodium -- molar concentration of Na+
+       magnesium -- molar concentration of Mg++
+       """
+    def __init__(self, temperature=25, sodium=0.15, magnesium=0.005):
+        self.temperature = temperature
+        kelvin = temperature + KELVIN
+
+        # Fold magnesium into an equivalent sodium concentration and
+        # apply the per-phosphate entropy correction.
+        salt = 0.368 * math.log(sodium + 3.3 * math.sqrt(magnesium))
+
+        self.stack = {}
+        for key, (dh, ds) in STACKS.items():
+            self.stack[key] = dh - kelvin * (ds + salt) / 1000.0
+
+        self.terminal = TERMINAL_AT[0] - kelvin * TERMINAL_AT[1] / 1000.0
+
+        # Loops are treated as purely entropic. Hairpins are tabulated
+        # up to MAX_HAIRPIN, larger ones are extrapolated when asked for
+        # (see hairpin_energy())
+        scale = self.scale = kelvin / (KELVIN + 37)
+        self.hairpin = [INF] * (MIN_HAIRPIN) + [
+            scale * _loop_initiation(HAIRPIN, size)
+            for size in range(MIN_HAIRPIN, MAX_HAIRPIN + 1)]
+        self.bulge = [INF] + [scale * _loop_initiation(BULGE, size)
+                              for size in range(1, MAX_LOOP + 1)]
+        self.internal = [INF, INF] + [scale * _loop_initiation(INTERNAL, size)
+                                      for size in range(2, MAX_LOOP + 1)]
+
+    def hairpin_energy(self, size):
+        """Return the initiation energy of a hairpin loop of size
+           nucleotides, by the log term of _loop_initiation() beyond
+           MAX_HAIRPIN"""
+        if size < len(self.hairpin):
+            return self.hairpin[size]
+        return self.scale * _loop_initiation(HAIRPIN, size)
+
+_energies = {}
+
+def energies(temperature=25, sodium=0.15, magnesium=0.005):
+    """Return a (shared) Energies for these conditions"""
+    key = (temperature, sodium, magnesium)
+    if key not in _energies:
+        _energies[key] = Energies(temperature, sodium, magnesium)
+    return _energies[key]
+
+
+def default_window(length):
+    """The mfold default window for a sequence of length nucleotides"""
+    if length <= 30:
+        return 0
+    elif length <= 50:
+        return 1
+    elif length <= 120:
+        return 2
+    elif length <= 200:
+        return 3
+    elif length <= 300:
+        return 5
+    else:
+        return 7
+
+
+class FoldTables(object):
+    """The dynamic programming tables for a single sequence.
+
+       All indexes are 0-based and inclusive. Inside tables:
+
+       V[i,j]   -- best energy of i..j given i and j pair
+       WM1[i,j] -- best energy of i..j as one multiloop branch closed by
+                   i, followed by unpaired nucleotides
+       WM[i,j]  -- best energy of i..j as one or more multiloop branches
+       W5[j]    -- best energy of the first j nucleotides
+
+       Outside tables (VO, WM1O, WMO, WO5) hold the best energy of
+       everything *but* the corresponding inside entry, so that V + VO is
+       the best energy of any structure that contains the pair i,j.
+       """
+
+    def __init__(self, sequence, energy):
+        self.seq = str(sequence).upper()
+        self.n = len(self.seq)
+        self.energy = energy
+        n = self.n
+
+        self.canpair = np.zeros((n, n), dtype=bool)
+        for i in range(n):
+            for j in range(i + MIN_HAIRPIN + 1, n):
+                if self.seq[i] + self.seq[j] in PAIRS:
+                    self.canpair[i, j] = True
+
+        self.partners = [[j for j in range(n) if self.canpair[i, j]]
+                         for i in range(n)]
+
+        self.V = np.full((n, n), INF)
+        self.WM = np.full((n, n), INF)
+        self.WM1 = np.full((n, n), INF)
+        self.W5 = np.zeros(n + 1)
+
+    def terminal(self, i, j):
+        """Terminal A-T penalty for the helix end i,j"""
+        if self.seq[i] in "AT":
+            return self.energy.terminal
+        return 0.0
+
+    def hairpin(self, i, j):
+        return self.energy.hairpin_energy(j - i - 1) + self.terminal(i, j)
+
+    def interior(self, i, j, k, l):
+        """Energy of the loop closed by i,j with the inner pair k,l"""
+        left = k - i - 1
+        right = j - l - 1
+        if left == 0 and right == 0:
+            return self.energy.stack[self.seq[i] + self.seq[k]]
+        elif left == 0 or right == 0:
+            size = left + right
+            if size == 1:
+                # A single bulged nucleotide does not break the stack
+                return (self.energy.bulge[1] +
+                        self.energy.stack[self.seq[i] + self.seq[k]])
+            return (self.energy.bulge[size] + self.terminal(i, j) +
+                    self.terminal(k, l))
+        return (self.energy.internal[left + right] +
+                INTERNAL_ASYMMETRY * abs(left - right) +
+                self.terminal(i, j) + self.terminal(k, l))
+
+    def inner_pairs(self, i, j):
+        """Every pair k,l that may close an interior loop with i,j"""
+        for k in range(i + 1, min(i + MAX_LOOP + 2, j - MIN_HAIRPIN - 1)):
+            for l in self.partners[k]:
+                if l >= j:
+                    break
+                if (k - i - 1) + (j - l - 1) <= MAX_LOOP:
+                    yield k, l
+
+    def outer_pairs(self, k, l):
+        """Every pair i,j that may close an interior loop around k,l"""
+        n = self.n
+        for i in range(k - 1, max(k - MAX_LOOP - 2, -1), -1):
+            for j in range(l + 1, min(l + MAX_LOOP + 2, n)):
+                if (k - i - 1) + (j - l - 1) > MAX_LOOP:
+                    break
+                if self.canpair[i, j]:
+                    yield i, j
+
+    def fill_inside(self, skip=None):
+        """Fill V, WM1, WM and W5.
+
+           Arguments:
+           skip -- optionally, an n x n boolean array that is True for
+                   the entries of V, WM1 and WM that have already been
+                   filled in, see reuse()
+           """
+        n = self.n
+        V, WM, WM1 = self.V, self.WM, self.WM1
+        mc = MULTI_A + MULTI_C
+
+        for j in range(n):
+            for i in range(j, -1, -1):
+                if skip is not None and skip[i, j]:
+                    continue
+                best = INF
+                if self.canpair[i, j]:
+                    best = self.hairpin(i, j)
+                    for k, l in self.inner_pairs(i, j):
+                        if V[k, l] < INF:
+                            e = self.interior(i, j, k, l) + V[k, l]
+                            if e < best:
+                                best = e
+                    if j - i > 2 * (MIN_HAIRPIN + 2):
+                        e = (WM[i + 1, i + 1:j - 1] +
+                             WM1[i + 2:j, j - 1]).min()
+                        e += mc + self.terminal(i, j)
+                        if e < best:
+                            best = e
+                V[i, j] = best
+
+                e = INF
+                if best < INF:
+                    e = best + MULTI_C + self.terminal(i, j)
+                if j > i and WM1[i, j - 1] + MULTI_B < e:
+                    e = WM1[i, j - 1] + MULTI_B
+                WM1[i, j] = e
+
+                e = (WM1[i:j + 1, j] +
+                     MULTI_B * np.arange(j - i + 1)).min()
+                if j > i:
+                    e = min(e, (WM[i, i:j] + WM1[i + 1:j + 1, j]).min())
+                WM[i, j] = min(e, INF)
+
+        W5 = self.W5
+        W5[0] = 0.0
+        for j in range(1, n + 1):
+            best = W5[j - 1]
+            for i in range(0, j - MIN_HAIRPIN - 1):
+                if V[i, j - 1] < INF:
+                    e = W5[i] + V[i, j - 1] + self.terminal(i, j - 1)
+                    if e < best:
+                        best = e
+            W5[j] = best
+        return W5[n]
+
+    def reuse(self, parent):
+        """Copy in the inside entries that are the same as parent's.
+
+           The inside energies of i..j depend only on the nucleotides
+           i..j, so if this sequence is parent's with some nucleotides
+           inserted (as Sensor.GuessStems() does), every interval that
+           doesn't contain an inserted nucleotide was already computed
+           for parent.
+
+           Arguments:
+           parent -- FoldTables, with its inside filled, for the same
+                     energies
+
+           Returns:
+           the n x n boolean array of entries copied, to be passed to
+           fill_inside() as skip, or None if nothing could be reused
+           """
+        if parent.energy is not self.energy or parent.n >= self.n:
+            return None
+        inserted = insertions(parent.seq, self.seq)
+        if inserted is None or len(inserted) > self.n // 4:
+            return None
+
+        n = self.n
+        isinserted = np.zeros(n, dtype=int)
+        isinserted[inserted] = 1
+        origin = np.arange(n) - np.cumsum(isinserted)
+
+        # counts[k] is the number of inserted nucleotides before k, so
+        # i..j contains none when counts[j + 1] == counts[i]
+        counts = np.zeros(n + 1, dtype=int)
+        counts[1:] = np.cumsum(isinserted)
+        same = counts[np.newaxis, 1:] == counts[:n, np.newaxis]
+        same &= np.triu(np.ones((n, n), dtype=bool))
+
+        (iis, jjs) = np.nonzero(same)
+        (pis, pjs) = (origin[iis], origin[jjs])
+        self.V[iis, jjs] = parent.V[pis, pjs]
+        self.WM1[iis, jjs] = parent.WM1[pis, pjs]
+        self.WM[iis, jjs] = parent.WM[pis, pjs]
+        return same
+
+    def fill_outside(self):
+        """Fill VO, WM1O, WMO and WO5, see the class docstring"""
+        n = self.n
+        V, WM, WM1, W5 = self.V, self.WM, self.WM1, self.W5
+        VO = self.VO = np.empty((n, n))
+        WM1O = self.WM1O = np.empty((n, n))
+        WMO = self.WMO = np.empty((n, n))
+        VO.fill(INF)
+        WM1O.fill(INF)
+        WMO.fill(INF)
+        WO5 = self.WO5 = np.empty(n + 1)
+        WO5.fill(INF)
+        WO5[n] = 0.0
+        mc = MULTI_A + MULTI_C
+
+        for j in range(n, 0, -1):
+            WO5[j - 1] = min(WO5[j - 1], WO5[j])
+            for i in range(0, j - MIN_HAIRPIN - 1):
+                if V[i, j - 1] < INF:
+                    e = WO5[j] + self.terminal(i, j - 1)
+                    WO5[i] = min(WO5[i], e + V[i, j - 1])
+                    VO[i, j - 1] = min(VO[i, j - 1], e + W5[i])
+
+        for span in range(n - 1, -1, -1):
+            for i in range(0, n - span):
+                j = i + span
+
+                out = WMO[i, j]
+                if out < INF:
+                    np.minimum(WM1O[i:j + 1, j],
+                               out + MULTI_B * np.arange(j - i + 1),
+                               out=WM1O[i:j + 1, j])
+                    if j > i:
+                        np.minimum(WM1O[i + 1:j + 1, j],
+                                   out + WM[i, i:j],
+                                   out=WM1O[i + 1:j + 1, j])
+                        np.minimum(WMO[i, i:j],
+                                   out + WM1[i + 1:j + 1, j],
+                                   out=WMO[i, i:j])
+
+                out = WM1O[i, j]
+                if out < INF:
+                    if V[i, j] < INF:
+                        VO[i, j] = min(VO[i, j],
+                                       out + MULTI_C + self.terminal(i, j))
+                    if j > i:
+                        WM1O[i, j - 1] = min(WM1O[i, j - 1], out + MULTI_B)
+
+                out = VO[i, j]
+                if out < INF and V[i, j] < INF:
+                    for k, l in self.inner_pairs(i, j):
+                        if V[k, l] < INF:
+                            e = out + self.interior(i, j, k, l)
+                            if e < VO[k, l]:
+                                VO[k, l] = e
+                    if j - i > 2 * (MIN_HAIRPIN + 2):
+                        e = out + mc + self.terminal(i, j)
+                        np.minimum(WMO[i + 1, i + 1:j - 1],
+                                   e + WM1[i + 2:j, j - 1],
+                                   out=WMO[i + 1, i + 1:j - 1])
+                        np.minimum(WM1O[i + 2:j, j - 1],
+                                   e + WM[i + 1, i + 1:j - 1],
+                                   out=WM1O[i + 2:j, j - 1])
+
+    # Traceback.  Each of these pushes further work on to a stack
+    # rather than recursing and adds any pairs it finds to pairs.
+
+    def _trace(self, todo, pairs):
+        close = lambda a, b: abs(a - b) < EPS
+        V, WM, WM1, W5 = self.V, self.WM, self.WM1, self.W5
+        mc = MULTI_A + MULTI_C
+
+        while todo:
+            (kind, i, j) = todo.pop()
+            if kind == "W5":
+                if j == 0:
+                    continue
+                if close(W5[j], W5[j - 1]):
+                    todo.append(("W5", 0, j - 1))
+                    continue
+                for k in range(0, j - MIN_HAIRPIN - 1):
+                    if (V[k, j - 1] < INF and
+                        close(W5[j], W5[k] + V[k, j - 1] +
+                              self.terminal(k, j - 1))):
+                        todo.append(("W5", 0, k))
+                        todo.append(("V", k, j - 1))
+                        break
+            elif kind == "V":
+                pairs.append((i, j))
+                if close(V[i, j], self.hairpin(i, j)):
+                    continue
+                found = False
+                for k, l in self.inner_pairs(i, j):
+                    if (V[k, l] < INF and
+                        close(V[i, j], self.interior(i, j, k, l) + V[k, l])):
+                        todo.append(("V", k, l))
+                        found = True
+                        break
+                if found:
+                    continue
+                e = V[i, j] - mc - self.terminal(i, j)
+                for u in range(i + 1, j - 1):
+                    if close(e, WM[i + 1, u] + WM1[u + 1, j - 1]):
+                        todo.append(("WM", i + 1, u))
+                        todo.append(("WM1", u + 1, j - 1))
+                        break
+            elif kind == "WM1":
+                if (V[i, j] < INF and
+                    close(WM1[i, j], V[i, j] + MULTI_C + self.terminal(i, j))):
+                    todo.append(("V", i, j))
+                else:
+                    todo.append(("WM1", i, j - 1))
+            elif kind == "WM":
+                for u in range(i, j + 1):
+                    if close(WM[i, j], MULTI_B * (u - i) + WM1[u, j]):
+                        todo.append(("WM1", u, j))
+                        break
+                    if u > i and close(WM[i, j], WM[i, u - 1] + WM1[u, j]):
+                        todo.append(("WM", i, u - 1))
+                        todo.append(("WM1", u, j))
+                        break
+            elif kind == "VO":
+                self._trace_outside_pair(i, j, todo, pairs)
+            elif kind == "WM1O":
+                self._trace_outside_branch(i, j, todo, pairs)
+            elif kind == "WMO":
+                self._trace_outside_branches(i, j, todo, pairs)
+            elif kind == "WO5":
+                if j == self.n:
+                    continue
+                if close(self.WO5[j], self.WO5[j + 1]):
+                    todo.append(("WO5", 0, j + 1))
+                    continue
+                for q in range(j + MIN_HAIRPIN + 2, self.n + 1):
+                    if (V[j, q - 1] < INF and
+                        close(self.WO5[j], self.WO5[q] + V[j, q - 1] +
+                              self.terminal(j, q - 1))):
+                        todo.append(("WO5", 0, q))
+                        todo.append(("V", j, q - 1))
+                        break
+
+    def _trace_outside_pair(self, i, j, todo, pairs):
+        close = lambda a, b: abs(a - b) < EPS
+        VO = self.VO
+        if close(VO[i, j], self.WO5[j + 1] + self.W5[i] + self.terminal(i, j)):
+            todo.append(("WO5", 0, j + 1))
+            todo.append(("W5", 0, i))
+            return
+        for p, q in self.outer_pairs(i, j):
+            if (VO[p, q] < INF and
+                close(VO[i, j], VO[p, q] + self.interior(p, q, i, j))):
+                pairs.append((p, q))
+                todo.append(("VO", p, q))
+                return
+        todo.append(("WM1O", i, j))
+
+    def _trace_outside_branch(self, i, j, todo, pairs):
+        close = lambda a, b: abs(a - b) < EPS
+        WM, WMO, WM1O, VO = self.WM, self.WMO, self.WM1O, self.VO
+        target = WM1O[i, j]
+        for k in range(i, -1, -1):
+            if close(target, WMO[k, j] + MULTI_B * (i - k)):
+                todo.append(("WMO", k, j))
+                return
+            if k < i and close(target, WMO[k, j] + WM[k, i - 1]):
+                todo.append(("WMO", k, j))
+                todo.append(("WM", k, i - 1))
+                return
+        if j + 1 < self.n and close(target, WM1O[i, j + 1] + MULTI_B):
+            todo.append(("WM1O", i, j + 1))
+            return
+        if j + 1 < self.n:
+            q = j + 1
+            for p in range(i - 2, -1, -1):
+                if (VO[p, q] < INF and self.V[p, q] < INF and
+                    close(target, VO[p, q] + MULTI_A + MULTI_C +
+                          self.terminal(p, q) + WM[p + 1, i - 1])):
+                    pairs.append((p, q))
+                    todo.append(("VO", p, q))
+                    todo.append(("WM", p + 1, i - 1))
+                    return
+
+    def _trace_outside_branches(self, i, j, todo, pairs):
+        close = lambda a, b: abs(a - b) < EPS
+        WM1, WMO, VO = self.WM1, self.WMO, self.VO
+        target = WMO[i, j]
+        for k in range(j + 1, self.n):
+            if close(target, WMO[i, k] + WM1[j + 1, k]):
+                todo.append(("WMO", i, k))
+                todo.append(("WM1", j + 1, k))
+                return
+        if i > 0:
+            p = i - 1
+            for q in range(j + 2, self.n):
+                if (VO[p, q] < INF and self.V[p, q] < INF and
+                    close(target, VO[p, q] + MULTI_A + MULTI_C +
+                          self.terminal(p, q) + WM1[j + 1, q - 1])):
+                    pairs.append((p, q))
+                    todo.append(("VO", p, q))
+                    todo.append(("WM1", j + 1, q - 1))
+                    return
+
+    def mfe_pairs(self):
+        """Return the pairs of the minimum free energy structure"""
+        pairs = []
+        self._trace([("W5", 0, self.n)], pairs)
+        return sorted(pairs)
+
+    def pair_pairs(self, i, j):
+        """Return the pairs of the best structure containing i,j"""
+        pairs = []
+        self._trace([("VO", i, j), ("V", i, j)], pairs)
+        return sorted(set(pairs))
+
+    def suboptimals(self, percent=50, window=-1, maxfolds=100):
+        """Return a list of (energy, pairs) for the mfold style
+           suboptimal structures within percent of the minimum free
+           energy, sorted by energy"""
+        mfe = self.W5[self.n]
+        if mfe >= 0:
+            return [(0.0, [])]
+
+        if window < 0:
+            window = default_window(self.n)
+
+        total = self.V + self.VO
+        threshold = mfe + math.fabs(mfe) * percent / 100.0
+        (iis, jjs) = np.nonzero(self.canpair & (total <= threshold + EPS))
+        candidates = sorted(zip(total[iis, jjs], iis, jjs))
+
+        marked = np.zeros((self.n, self.n), dtype=bool)
+        found = []
+        seen = set()
+        for (e, i, j) in candidates:
+            if len(found) >= maxfolds:
+                break
+            if marked[i, j]:
+                continue
+            pairs = self.pair_pairs(i, j)
+            for (p, q) in pairs:
+                marked[max(p - window, 0):p + window + 1,
+                       max(q - window, 0):q + window + 1] = True
+            key = tuple(pairs)
+            if key in seen:
+                continue
+            seen.add(key)
+            found.append((float(e), pairs))
+        return found
+
+    def mfe(self):
+        """Return the minimum free energy, needs only the inside filled.
+           This is the energy of the first of folds()."""
+        if self.n == 0 or self.W5[self.n] >= 0:
+            return 0.0
+        return round(float(self.W5[self.n]), 3)
+
+    def folds(self, percent=50, window=-1, maxfolds=100):
+        """Return the folds, as described in unafold.parse_ct(), of the
+           suboptimal structures. The outside tables are only needed for
+           this, so they are dropped afterwards."""
+        self.fill_outside()
+        folds = [self.make_fold(energy, pairs)
+                 for (energy, pairs) in self.suboptimals(percent, window,
+                                                         maxfolds)]
+        self.VO = self.WM1O = self.WMO = self.WO5 = None
+        return folds
+
+    def make_fold(self, energy, pairs):
+        """Return a fold, as described in unafold.parse_ct(), for a
+           structure"""
+        bp = np.zeros(self.n, dtype=np.int32)
+        for (i, j) in pairs:
+            bp[int(i)] = int(j) + 1
+            bp[int(j)] = int(i) + 1
+        return unafold.Fold(round(energy, 3), self.seq, bp)
+
+
+def insertions(parent, child):
+    """Return the indexes of the nucleotides in child that, if removed,
+       would leave parent, or None if parent isn't a subsequence of child
+       """
+    inserted = []
+    p = 0
+    for c in range(len(child)):
+        if p < len(parent) and child[c] == parent[p]:
+            p += 1
+        else:
+            inserted.append(c)
+    if p != len(parent):
+        return None
+    return inserted
+
+
+def fold_tables(sequence, temperature=25, sodium=0.15, magnesium=0.005,
+                parent=None):
+    """Return the FoldTables for sequence with the inside filled.
+
+       Arguments:
+       sequence -- a DNA sequence
+       temperature, sodium, magnesium -- as in fold()
+       parent -- optionally, the FoldTables of a sequence that this one
+                 was made by inserting nucleotides into, whose entries
+                 will be reused where possible
+    """
+    tables = FoldTables(sequence, energies(temperature, sodium, magnesium))
+    skip = None
+    if parent is not None and tables.n > 0:
+        skip = tables.reuse(parent)
+    if tables.n > 0:
+        tables.fill_inside(skip)
+    return tables
+
+
+def fold(sequence, temperature=25, sodium=0.15, magnesium=0.005,
+         percent=50, window=-1, maxfolds=100):
+    """Fold sequence and return its folds, in the same form as
+       unafold.parse_ct(unafold.run_hybrid_ss_min(sequence)).
+
+       Arguments:
+       sequence -- a DNA sequence, or anything (like util.Sensor) whose
+                   str() is one
+       temperature -- degrees C
+       sodium, magnesium -- molar concentrations
+       percent, window, maxfolds -- as in hybrid-ss-min --mfold=P,W,MAX
+
+       Returns:
+       list of folds, lowest energy first
+    """
+    tables = fold_tables(sequence, temperature, sodium, magnesium)
+    if tables.n == 0:
+        return []
+    return tables.folds(percent, window, maxfolds)
+
+
+def mfe(sequence, temperature=25, sodium=0.15, magnesium=0.005):
+    """Return the minimum free energy of sequence, without working out
+       any of its structures, see fold() for the arguments"""
+    return fold_tables(sequence, temperature, sodium, magnesium).mfe()
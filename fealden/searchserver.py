@@ -10,9 +10,19 @@ from . import util, backtracking, weboutput
 
 logger = logging.getLogger(__name__)
 
+def _searchworker_terminate(signum, frame):
+    """SIGTERM handler for searchworker(), terminates the processes of
+       any search going on (which kill their hybrid-ss-min) and then dies
+       of SIGTERM as usual"""
+    for child in multiprocessing.active_children():
+        child.terminate()
+        child.join()
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    os.kill(os.getpid(), signal.SIGTERM)
+
 def searchworker(request_q, output_q, cmd_dictionary=None):
     # Reset default signal handlers
-    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, _searchworker_terminate)
     signal.signal(signal.SIGCHLD, signal.SIG_DFL)
     
     setproctitle("fealdend: searchworker")
@@ -28,7 +38,10 @@ def searchworker(request_q, output_q, cmd_dictionary=None):
                                               maxunknownpercent=request.maxunknown_percent,
                                               numfoldrange=(request.numfolds_lo,request.numfolds_hi),
                                               maxsolutions= request.numsolutions,
-                                              maxenergy = request.maxenergy)
+                                              maxenergy = request.maxenergy,
+                                              engine = request.engine,
+                                              strategy = request.strategy,
+                                              beamwidth = request.beamwidth)
         logger.info("fealdend: searchworker(%s), found %d solutions, putting them "
                      "on the queue" %
                      (sensor.GetRecognition(), len(solutions)))
@@ -47,7 +60,8 @@ def searchworker(request_q, output_q, cmd_dictionary=None):
                                                     sensor = solution.sensor,
                                                     scores = solution.scores,
                                                     folds = solution.folds,
-                                                    email = request.email)
+                                                    email = request.email,
+                                                    engine = request.engine)
                 if output_request.valid():
                     output_q.put(output_request)
                 else:
@@ -127,7 +141,8 @@ def solutionworker(output_q,cmd_dictionary=None):
             weboutput.solution_output(output_request.sensor,
                                       output_request.scores,
                                       output_request.folds,
-                                      output_request.output_dir)
+                                      output_request.output_dir,
+                                      output_request.engine)
 
             #email_notification(request[0], recognition, request[3])
         elif output_request.status == "FAILED":
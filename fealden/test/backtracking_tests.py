@@ -1,9 +1,13 @@
 import Queue
 import logging
 import multiprocessing
+import signal
+import copy
 
 from nose.tools import nottest
 
+from fealden import backtracking, util
+
 #from fealden.util import *
 #from fealden.backtracking import *
 
@@ -57,5 +61,111 @@ from nose.tools import nottest
 #         yield _checknode_tester, sensor, test[3]
 
 
-
-
+def frontier_test_generator():
+    # [ recognition, first guesses, depth ]
+    tests = [["GCCGAAAA", "T", 0],
+             ["GCCGAAAA", "T", 2],
+             ["ATTA", "T", 3],
+             # Stems already past the point of promise
+             ["ATTA", "GCGCGCGCGC", 2]]
+
+    def _run_frontier(recognition, first, depth):
+        sensor = util.Sensor(recognition)
+        for guess in first:
+            sensor.GuessStems(guess)
+        context = util.SearchContext(sensor.Recognition)
+        tasks = backtracking.frontier(sensor, context, 0, depth)
+        print("frontier(%s, %d): %s" %
+              (sensor, depth, [(str(task[0]), task[1], task[2])
+                               for task in tasks]))
+
+        # Every node is searched once
+        names = [str(task[0]) for task in tasks]
+        assert len(set(names)) == len(names)
+        assert len(tasks) <= sum([4 ** level for level in range(depth + 1)])
+        for (node, node_depth, descend) in tasks:
+            # Each guess goes in to a stem and its complement
+            assert len(str(node)) == len(str(sensor)) + 2 * node_depth
+            if descend:
+                assert (node_depth == depth or
+                        not backtracking.promising(node, context))
+            else:
+                assert node_depth < depth
+                assert backtracking.promising(node, context)
+        # Each node checked on its own has four children
+        assert len(tasks) == 1 + 4 * len([task for task in tasks
+                                          if not task[2]])
+        if depth == 0 or not backtracking.promising(sensor, context):
+            assert [task[1:] for task in tasks] == [(0, True)]
+
+    for test in tests:
+        yield _run_frontier, test[0], test[1], test[2]
+
+def WorkPool_test():
+    command = multiprocessing.Value("i", 1)
+    pool = backtracking.WorkPool(2)
+    assert not pool.wanted()
+
+    pool.give("node")
+    assert pool.take(command) == "node"
+    assert not pool.finished()
+
+    # With the other worker waiting, a node is wanted, and once both
+    # are waiting with nothing given the search is over
+    pool.idle.value += 1
+    assert pool.wanted()
+    assert pool.take(command) is None
+    assert pool.finished()
+    assert pool.take(command) is None
+
+    # As it is once command is set to 0
+    pool = backtracking.WorkPool(2)
+    command.value = 0
+    assert pool.take(command) is None
+
+class _ListQueue(object):
+    """Stands in for the recognition queue of a search"""
+    def __init__(self):
+        self.items = []
+
+    def put(self, item):
+        self.items.append(item)
+
+def bestfirst_worker_test():
+    """A best first search visits the same nodes and finds the same
+       solutions as the depth first one, unless its beam is narrowed"""
+    sensor = util.Sensor("CGTA")
+    sensor.GuessStems("T")
+    context = util.SearchContext(sensor.Recognition, (.01, 100.0), .9,
+                                 engine="native")
+    # Prune early, to keep the tree small
+    context.promising_energy = -1.5
+    command = multiprocessing.Value("i", 1)
+    handler = signal.getsignal(signal.SIGTERM)
+
+    def _search(search, *args):
+        queue = _ListQueue()
+        try:
+            search(copy.deepcopy(sensor), *((queue,) + args))
+        finally:
+            signal.signal(signal.SIGTERM, handler)
+        return ([item for item in queue.items if item.command == "DEPTH"],
+                sorted([str(item.sensor) for item in queue.items
+                        if item.command == "SOLUTION"]))
+
+    (depthfirst, solutions) = _search(
+        lambda node, queue: backtracking.checknode(node, 0, queue, command,
+                                                   context))
+    (bestfirst, found) = _search(backtracking.bestfirst_worker, command,
+                                 context)
+    (beam, beam_found) = _search(backtracking.bestfirst_worker, command,
+                                 context, 2)
+    print("bestfirst_worker_test(): %d nodes, %d solutions depth first, "
+          "%d nodes, %d solutions best first, %d nodes with a beam of 2" %
+          (len(depthfirst), len(solutions), len(bestfirst), len(found),
+           len(beam)))
+
+    assert len(bestfirst) == len(depthfirst)
+    assert found == solutions
+    assert len(beam) < len(bestfirst)
+    assert set(beam_found) <= set(found)
@@ -4,7 +4,7 @@ import os
 import pickle
 from nose.tools import nottest
 
-from fealden import distance
+from fealden import distance, unafold
 
 def test_generator():
     def _execute(function, fold, expected):
@@ -45,6 +45,54 @@ def test_generator():
 
         yield _gengraph_execute, expected[0]["seq"], expected[1]
             
+def find_shortest_path_test_generator():
+    # A hairpin, 1 to 3 paired with 10 to 8
+    fold = unafold.Fold(0.0, "CCCAAAAGGG", [10, 9, 8, 0, 0, 0, 0, 3, 2, 1])
+    graph = distance.gen_graph(fold)
+    tests = [(1, 1, [1], "same nucleotide"),
+             (1, 10, [1, 10], "paired"),
+             (4, 10, [4, 3, 8, 9, 10], "across the stem"),
+             (5, 6, [5, 6], "along the loop")]
+
+    def _find_shortest_path(start, end, expected, message):
+        result = distance.find_shortest_path(graph, start, end)
+        print "Testing {}".format(message)
+        print "Expected: {}".format(expected)
+        print "Got     : {}".format(result)
+        assert result == expected
+        assert distance.linear(fold, start, end) == expected
+
+    for test in tests:
+        yield _find_shortest_path, test[0], test[1], test[2], test[3]
+
+def batch_distances_test():
+    # The hairpin above, the same sequence unfolded and a fold with two
+    # hairpins
+    folds = [unafold.Fold(0.0, "CCCAAAAGGG", [10, 9, 8, 0, 0, 0, 0, 3, 2, 1]),
+             unafold.Fold(0.0, "CCCAAAAGGG", [0] * 10),
+             unafold.Fold(0.0, "CCAAAGGCAA", [7, 6, 0, 0, 0, 2, 1, 0, 0, 0])]
+    sources = [1, 5, 10]
+    distances = distance.batch_distances(folds, sources)
+    assert distances.shape == (3, 3, 10)
+
+    # Each distance is that of the shortest path
+    for (fold_index, fold) in enumerate(folds):
+        graph = distance.gen_graph(fold)
+        for (source_index, source) in enumerate(sources):
+            for nucl in range(1, 11):
+                path = distance.find_shortest_path(graph, source, nucl)
+                assert distances[fold_index, source_index, nucl - 1] == len(path) - 1
+
+    # The older dictionary form gives the same
+    assert (distance.batch_distances([fold.to_dict() for fold in folds],
+                                     sources) == distances).all()
+
+    (to_quencher, from_fluorophore,
+     from_quencher) = distance.fluorophore_quencher(folds, 10, [3, 8])
+    assert list(to_quencher) == [1, 9, 4]
+    assert from_fluorophore.tolist() == [[2, 3], [2, 7], [2, 2]]
+    assert from_quencher.tolist() == [[3, 2], [7, 2], [6, 2]]
+
 @nottest
 def gengraph_test_generator():
     def _gengraph_execute(fold, expected, message):
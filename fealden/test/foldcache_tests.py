@@ -0,0 +1,116 @@
+import os
+import shutil
+import tempfile
+import time
+
+from fealden import foldcache
+from fealden import folding
+from fealden import nativefold
+
+conditions = {"engine": "native", "temperature": 25}
+
+def test_key_generator():
+    """key() depends on the sequence and every condition"""
+    tests = [["CCCAAAAGGG", conditions, "CCCAAAAGGG", conditions, True,
+              "same sequence and conditions"],
+             ["CCCAAAAGGG", conditions, "cccaaaaggg", conditions, True,
+              "case of sequence"],
+             ["CCCAAAAGGG", conditions, "CCCAAAAGGGA", conditions, False,
+              "different sequence"],
+             ["CCCAAAAGGG", conditions, "CCCAAAAGGG",
+              {"engine": "native", "temperature": 37}, False,
+              "different temperature"],
+             ["CCCAAAAGGG", conditions, "CCCAAAAGGG",
+              {"engine": "hybrid-ss-min", "temperature": 25}, False,
+              "different engine"]]
+
+    def _key(seq1, conditions1, seq2, conditions2, expected, comment):
+        result = (foldcache.key(seq1, conditions1) ==
+                  foldcache.key(seq2, conditions2))
+        assert result == expected, comment
+
+    for test in tests:
+        yield _key, test[0], test[1], test[2], test[3], test[4], test[5]
+
+def test_get_put():
+    directory = tempfile.mkdtemp()
+    try:
+        cache = foldcache.FoldCache(directory)
+        folds = nativefold.fold("CCCAAAAGGG")
+
+        assert cache.get("CCCAAAAGGG", conditions) is None
+        cache.put("CCCAAAAGGG", conditions, folds)
+
+        # Callers are free to modify what they are given
+        result = cache.get("CCCAAAAGGG", conditions)
+        assert result == folds
+        result[0]["type"] = "binding_on"
+        assert cache.get("CCCAAAAGGG", conditions) == folds
+
+        assert cache.stats()["hits"] == 2
+        assert cache.stats()["hot_hits"] == 2
+        assert cache.stats()["misses"] == 1
+
+        # A new cache (another process, or a later run) reads it
+        # from disk
+        cache = foldcache.FoldCache(directory)
+        assert cache.get("CCCAAAAGGG", conditions) == folds
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["hot_hits"] == 0
+    finally:
+        shutil.rmtree(directory)
+
+def test_hot_size():
+    directory = tempfile.mkdtemp()
+    try:
+        cache = foldcache.FoldCache(directory, hotsize=2)
+        for seq in ["AAAA", "CCCC", "GGGG"]:
+            cache.put(seq, conditions, [seq])
+        assert len(cache.hot) == 2
+        assert cache.get("AAAA", conditions) == ["AAAA"]
+        assert cache.stats()["hot_hits"] == 0
+    finally:
+        shutil.rmtree(directory)
+
+def test_evict():
+    directory = tempfile.mkdtemp()
+    try:
+        cache = foldcache.FoldCache(directory, maxbytes=10 ** 6)
+        folds = nativefold.fold("CCCAAAAGGG")
+        cache.put("CCCAAAAGGG", conditions, folds)
+        size = cache.stats()["size"]
+
+        cache = foldcache.FoldCache(directory, maxbytes=int(size * 2.5))
+        cache.put("CCCAAAAGGG", dict(conditions, temperature=30), folds)
+
+        # Make the first entry the least recently used
+        for (index, temperature) in enumerate([25, 30]):
+            path = cache._path(foldcache.key("CCCAAAAGGG",
+                                             dict(conditions,
+                                                  temperature=temperature)))
+            os.utime(path, (time.time() - 100 + index, time.time() - 100 + index))
+
+        cache.put("CCCAAAAGGG", dict(conditions, temperature=35), folds)
+
+        assert cache.stats()["evictions"] == 1
+        assert cache.stats()["size"] <= size * 2.5
+
+        cache.hot.clear()
+        assert cache.get("CCCAAAAGGG", conditions) is None
+        assert cache.get("CCCAAAAGGG", dict(conditions, temperature=30)) == folds
+    finally:
+        shutil.rmtree(directory)
+
+def test_fold_sensors_read_through():
+    directory = tempfile.mkdtemp()
+    try:
+        folding.fold_cache = foldcache.FoldCache(directory)
+        first = folding.fold_sensors(["CCCAAAAGGG", "GGGAAAACCC"], "native")
+        assert folding.fold_cache.stats()["misses"] == 2
+
+        second = folding.fold_sensors(["GGGAAAACCC", "CCCAAAAGGG"], "native")
+        assert folding.fold_cache.stats()["hits"] == 2
+        assert second == first[::-1]
+    finally:
+        folding.fold_cache = None
+        shutil.rmtree(directory)
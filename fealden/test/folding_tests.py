@@ -0,0 +1,126 @@
+import os
+import pickle
+import shutil
+import tempfile
+
+from fealden import folding
+from fealden import unafold
+from fealden import util
+
+test_dir = "fealden/test/tests/"
+
+def test_get_backend_generator():
+    tests = [[None, folding.HybridSSMin],
+             ["hybrid-ss-min", folding.HybridSSMin],
+             ["native", folding.Native],
+             ["replay", folding.Replay]]
+
+    def _get_backend(name, expected):
+        backend = folding.get_backend(name)
+        assert isinstance(backend, expected)
+        assert folding.get_backend(name) is backend
+
+    for test in tests:
+        yield _get_backend, test[0], test[1]
+
+def test_get_backend_unknown():
+    try:
+        folding.get_backend("no-such-backend")
+    except folding.FoldingError:
+        assert True
+    else:
+        assert False
+
+def test_replay_run_hybrid_ss_min_generator():
+    """The replay backend serves exactly what parse_ct() makes of the
+       recorded .ct files"""
+    def _replay(seq, expected):
+        backend = folding.Replay(strict=True)
+        assert backend.fold(seq, unafold.conditions) == expected
+
+    for test in os.listdir(test_dir + "run_hybrid_ss_min"):
+        expected_file = open(test_dir + "run_hybrid_ss_min/" + test)
+        expected = unafold.parse_ct(pickle.load(expected_file))
+        expected_file.close()
+        yield _replay, test, expected
+
+def test_replay_score_sensor_generator():
+    """Folds recorded along with their scores are served without
+       anything score_sensor() added to them"""
+    def _replay(sensor, expected):
+        folds = folding.fold_sensor(sensor, "replay")
+        assert len(folds) == len(expected)
+        for (fold, recorded) in zip(folds, expected):
+            assert "percent_in_solution" not in fold
+            assert fold["energy"] == recorded["energy"]
+            assert fold["seq"] == recorded["seq"]
+
+    for test in os.listdir(test_dir + "score_sensor"):
+        expected_file = open(test_dir + "score_sensor/" + test)
+        expected = pickle.load(expected_file)
+        expected_file.close()
+        yield _replay, expected[0], expected[1]
+
+def test_replay_strict():
+    backend = folding.Replay(strict=True)
+    assert len(backend.sequences()) > 0
+    try:
+        backend.fold("CCCAAAAGGG", unafold.conditions)
+    except folding.FoldingError:
+        assert True
+    else:
+        assert False
+
+    # Only the default conditions were recorded
+    try:
+        backend.fold(backend.sequences()[0],
+                     dict(unafold.conditions, temperature=37))
+    except folding.FoldingError:
+        assert True
+    else:
+        assert False
+
+def test_replay_fallback():
+    backend = folding.Replay(fallback=folding.Native())
+    assert (backend.fold("CCCAAAAGGG", unafold.conditions) ==
+            folding.Native().fold("CCCAAAAGGG", unafold.conditions))
+
+def test_mfe_sensors_generator():
+    """mfe_sensors() gives the energy of the first fold of each"""
+    def _mfe_sensors(engine, sequences):
+        energies = folding.mfe_sensors(sequences, engine)
+        expected = [folding.fold_sensor(seq, engine)[0]["energy"]
+                    for seq in sequences]
+        for (energy, first) in zip(energies, expected):
+            assert abs(energy - first) < 1e-6
+
+    sequences = ["CCCAAAAGGG", "AAAAAAAA"] + folding.Replay().sequences()[:2]
+    for engine in ["native", "replay"]:
+        yield _mfe_sensors, engine, sequences
+
+def test_draw_generator():
+    """Backends other than hybrid-ss-min draw the folds they are given,
+       without UNAFold.pl"""
+    def _draw(engine, sequence):
+        folds = folding.fold_sensor(sequence, engine)
+        directory = tempfile.mkdtemp()
+        try:
+            folding.get_backend(engine).draw(sequence, directory, folds,
+                                             command="/tmp/does_not_exist")
+            assert (sorted(os.listdir(directory)) ==
+                    sorted(["%s_%d.ps" % (sequence, index + 1)
+                            for index in range(len(folds))]))
+        finally:
+            shutil.rmtree(directory)
+
+    for engine in ["native", "replay"]:
+        yield _draw, engine, "CCCAAAAGGG"
+        yield _draw, engine, folding.Replay().sequences()[0]
+
+def test_draw_missing_directory():
+    try:
+        folding.get_backend("native").draw("CCCAAAAGGG", "/tmp/does_not_exist")
+    except folding.FoldingError:
+        assert True
+    else:
+        assert False
@@ -0,0 +1,143 @@
+import copy
+import logging
+import os
+import pickle
+import random
+
+from fealden import folding
+from fealden import nativefold
+from fealden import unafold
+from fealden import util
+
+test_dir = "fealden/test/tests/"
+
+def test_fold_shape_generator():
+    """fold() returns folds shaped like parse_ct()"""
+    def _fold_shape(seq):
+        folds = nativefold.fold(seq)
+        assert len(folds) > 0
+        for fold in folds:
+            assert sorted(fold.keys()) == ["energy", "seq", "type"]
+            assert len(fold["seq"]) == len(seq)
+            for index, element in enumerate(fold["seq"]):
+                assert (sorted(element.keys()) ==
+                        ["bp", "downstream", "member", "nucl", "upstream"])
+                assert element["nucl"] == seq[index]
+                assert element["upstream"] == index
+                if element["bp"]:
+                    # Pairs must be symmetric
+                    assert fold["seq"][element["bp"] - 1]["bp"] == index + 1
+            assert fold["seq"][-1]["downstream"] == 0
+
+    for seq in ["CCCAAAAGGG",
+                "AAAAAAAA",
+                "TTACGCACCCAAACTTCAGCGTGGCAGTCCGGAT"]:
+        yield _fold_shape, seq
+
+def test_fold_energies_generator():
+    """Energies are sorted and within percent of the minimum"""
+    def _fold_energies(seq, percent):
+        energies = [fold["energy"] for fold in nativefold.fold(seq, percent=percent)]
+        assert energies == sorted(energies)
+        if energies[0] < 0:
+            assert energies[-1] <= energies[0] * (1 - percent / 100.0) + 0.001
+
+    for seq in ["CCCAAAAGGG",
+                "TTACGCACCCAAACTTCAGCGTGGCAGTCCGGAT"]:
+        for percent in [0, 10, 50]:
+            yield _fold_energies, seq, percent
+
+def test_fold_hairpin():
+    folds = nativefold.fold("CCCAAAAGGG")
+    assert folds[0]["energy"] < 0
+    assert ([x["bp"] for x in folds[0]["seq"]] ==
+            [10, 9, 8, 0, 0, 0, 0, 3, 2, 1])
+
+def test_fold_long_generator():
+    """Sequences with hairpins longer than MAX_HAIRPIN fold too"""
+    def _fold_long(seq):
+        folds = nativefold.fold(seq)
+        assert len(folds) > 0
+        for fold in folds:
+            assert len(fold["seq"]) == len(seq)
+
+    random.seed(130)
+    for length in [125, 130, 140]:
+        yield _fold_long, ''.join([random.choice("ACGT") for i in range(length)])
+    yield _fold_long, "GCGCGC" + "A" * (nativefold.MAX_HAIRPIN + 10) + "GCGCGC"
+
+def test_hairpin_energy():
+    energy = nativefold.energies()
+    sizes = range(nativefold.MAX_HAIRPIN - 2, nativefold.MAX_HAIRPIN + 10)
+    hairpins = [energy.hairpin_energy(size) for size in sizes]
+    assert hairpins == sorted(hairpins)
+    assert energy.hairpin_energy(nativefold.MAX_HAIRPIN) == energy.hairpin[-1]
+
+def test_fold_unfoldable():
+    folds = nativefold.fold("AAAAAAAA")
+    assert len(folds) == 1
+    assert folds[0]["energy"] == 0
+    assert [x["bp"] for x in folds[0]["seq"]] == [0] * 8
+
+def test_fold_sensor_generator():
+    """fold_sensor() with the native backend folds the sensors from the
+       run_hybrid_ss_min test cases into structures fold_type() can
+       classify"""
+    def _fold_sensor(seq):
+        folds = folding.fold_sensor(seq, "native")
+        assert len(folds) > 0
+        for fold in folds:
+            assert (unafold.fold_type(fold, list("GCCG"), 6) in
+                    ["binding_on", "nonbinding_off",
+                     "binding_unknown", "nonbinding_unknown"])
+
+    for test in os.listdir(test_dir + "run_hybrid_ss_min"):
+        yield _fold_sensor, test
+
+def test_insertions_generator():
+    tests = [["CCCGGG", "CCACGGGT", [2, 7]],
+             ["CCCGGG", "CCCGGG", []],
+             ["CCCGGG", "ACCCGGG", [0]],
+             ["CCCGGG", "CCAGGG", None],
+             ["CCCGGG", "CCC", None]]
+
+    def _insertions(parent, child, expected):
+        assert nativefold.insertions(parent, child) == expected
+
+    for test in tests:
+        yield _insertions, test[0], test[1], test[2]
+
+def test_fold_tables_parent_generator():
+    """Folding a child with its parent's tables gives exactly the folds
+       of folding it from scratch"""
+    def _fold_tables_parent(parent, child):
+        parent_tables = nativefold.fold_tables(str(parent))
+        tables = nativefold.fold_tables(str(child), parent=parent_tables)
+        assert tables.reuse(parent_tables) is not None
+        assert tables.folds() == nativefold.fold(str(child))
+
+    sensor = util.Sensor("GCCGAAAA")
+    for guesses in [["A"], ["A", "T"], ["G", "C", "C", "T"]]:
+        parent = sensor
+        for guess in guesses:
+            child = copy.deepcopy(parent)
+            child.GuessStems(guess)
+            yield _fold_tables_parent, parent, child
+            parent = child
+
+def test_native_backend_parent():
+    backend = folding.Native()
+    sensor = util.Sensor("GCCGAAAA")
+    children = []
+    for guess in ["A", "T", "G", "C"]:
+        child = copy.deepcopy(sensor)
+        child.GuessStems(guess)
+        children.append(child)
+
+    backend.fold(sensor, unafold.conditions)
+    folds = backend.fold_many(children, unafold.conditions, parent=sensor)
+    assert backend.reused == len(children)
+    assert folds == [nativefold.fold(str(child)) for child in children]
+
+    backend.release(sensor)
+    assert str(sensor) not in backend.tables
@@ -1,8 +1,15 @@
 import logging
+import math
+import multiprocessing
 import pickle
 import os
 import sys
 import argparse
+import shutil
+import subprocess
+import tempfile
+import time
+import numpy as np
 
 from nose.tools import nottest
 
@@ -262,6 +269,260 @@ def run_hybrid_ss_min_make_case(seq):
     pickle.dump(unafold.run_hybrid_ss_min(seq), tosave)
     tosave.close()
 
+def test_split_ct():
+    """Concatenates the .ct files in tests/run_hybrid_ss_min, as a
+       batch run of hybrid-ss-min would, and checks that split_ct()
+       gives back each of them"""
+    expected = {}
+    for test in os.listdir(test_dir + "run_hybrid_ss_min"):
+        expected_file = open(test_dir + "run_hybrid_ss_min/" + test)
+        expected[test] = pickle.load(expected_file)
+        expected_file.close()
+
+    batch = []
+    for test in sorted(expected):
+        batch.extend(expected[test])
+
+    assert unafold.split_ct(batch) == expected
+
+def test_parse_ct_arrays_generator():
+    """The arrays, and the folds made from them, hold what parse_ct()
+       does"""
+    def _parse_ct_arrays(lines):
+        folds = unafold.parse_ct(lines)
+        arrays = unafold.parse_ct_arrays(lines)
+
+        assert len(arrays) == len(folds)
+        assert arrays.bp.shape == (len(folds), len(folds[0]["seq"]))
+        assert arrays.sequence() == ''.join([x["nucl"] for x in folds[0]["seq"]])
+        assert list(arrays.energy) == [fold["energy"] for fold in folds]
+        for (row, fold) in zip(arrays, folds):
+            assert row == fold
+            assert row["seq"][-1]["bp"] == fold["seq"][-1]["bp"]
+        assert arrays.folds() == folds
+
+    for test in os.listdir(test_dir + "run_hybrid_ss_min"):
+        lines_file = open(test_dir + "run_hybrid_ss_min/" + test)
+        lines = pickle.load(lines_file)
+        lines_file.close()
+        yield _parse_ct_arrays, lines
+
+def test_parse_ct_arrays_bad():
+    lines = ["3\tdG = -1.0\tACG\n",
+             "1\tA\t0\t2\t0\t1\t0\t0\n",
+             "2\tC\t1\t3\t0\t2\t0\t0\n"]
+    try:
+        unafold.parse_ct_arrays(lines + lines[:2])
+    except unafold.UNAFoldError:
+        assert True
+    else:
+        assert False
+    assert len(unafold.parse_ct_arrays([])) == 0
+
+def test_fold_generator():
+    """Folds can be used as the dictionaries they replace, pickle
+       to the same fold and keep what is derived from them"""
+    def _fold(lines):
+        for fold in unafold.parse_ct(lines):
+            as_dict = fold.to_dict()
+            assert fold == as_dict
+            assert unafold.Fold.from_dict(as_dict) == fold
+            assert sorted(fold.keys()) == ["energy", "seq", "type"]
+            assert [x["bp"] for x in fold["seq"]] == list(fold.bp)
+            assert fold["seq"][-1] == as_dict["seq"][-1]
+
+            for protocol in [0, pickle.HIGHEST_PROTOCOL]:
+                assert pickle.loads(pickle.dumps(fold, protocol)) == fold
+
+            # stems() can be changed by the caller without changing
+            # what the fold keeps
+            stems = fold.stems()
+            assert stems == unafold.find_stems(as_dict)
+            if stems:
+                stems[0]["lh"]["start"] = -1
+            assert fold.stems() == unafold.find_stems(as_dict)
+
+            fold_type = unafold.fold_type(as_dict, list("GCCG"), 6)
+            assert fold.classify(list("GCCG"), 6) == fold_type
+            assert fold["type"] == fold_type
+
+            fold["percent_in_solution"] = 0.5
+            assert "percent_in_solution" in fold
+            assert pickle.loads(pickle.dumps(fold))["percent_in_solution"] == 0.5
+
+    for test in os.listdir(test_dir + "run_hybrid_ss_min"):
+        lines_file = open(test_dir + "run_hybrid_ss_min/" + test)
+        lines = pickle.load(lines_file)
+        lines_file.close()
+        yield _fold, lines
+
+def test_classify_folds_generator():
+    """classify_folds() gives every fold the type fold_type() does"""
+    def _classify_folds(lines, recognition, quencher):
+        folds = unafold.parse_ct(lines)
+        as_dicts = [fold.to_dict() for fold in folds]
+        expected = [unafold.fold_type(fold, recognition, quencher)
+                    for fold in as_dicts]
+
+        bp = np.vstack([fold.bp for fold in folds])
+        structures = unafold.batch_structures(bp)
+        assert structures == [unafold.Structure.of(fold) for fold in as_dicts]
+        assert ([structure.stems() for structure in structures] ==
+                [unafold.find_stems(fold) for fold in as_dicts])
+
+        assert unafold.classify_folds(folds, recognition, quencher) == expected
+        assert [fold["type"] for fold in folds] == expected
+        assert unafold.classify_folds(as_dicts, recognition, quencher) == expected
+        assert [fold["type"] for fold in as_dicts] == expected
+
+        # Folds already classified keep their type
+        assert unafold.classify_folds(folds, recognition, quencher) == expected
+
+    for test in os.listdir(test_dir + "run_hybrid_ss_min"):
+        lines_file = open(test_dir + "run_hybrid_ss_min/" + test)
+        lines = pickle.load(lines_file)
+        lines_file.close()
+        for (recognition, quencher) in [(list("GCCG"), 6), (list("ATAA"), 10)]:
+            yield _classify_folds, lines, recognition, quencher
+
+def test_type_cache():
+    cache = unafold.TypeCache(list("GCCG"), maxsize=2)
+    assert cache.get((10, ()), list("GCCG"), 6) is None
+    cache.put((10, ()), list("GCCG"), 6, "nonbinding_unknown")
+    cache.put((12, ()), list("GCCG"), 6, "binding_on")
+    assert cache.get((10, ()), list("GCCG"), 6) == "nonbinding_unknown"
+    # The quencher is part of the key
+    assert cache.get((10, ()), list("GCCG"), 7) is None
+
+    # (12, ()) is now the least recently used
+    cache.put((14, ()), list("GCCG"), 6, "binding_on")
+    assert cache.get((12, ()), list("GCCG"), 6) is None
+    assert cache.stats() == {"hits": 1, "misses": 3, "evictions": 1,
+                             "size": 2, "hit_rate": .25}
+
+    saved = unafold.type_cache
+    try:
+        unafold.type_cache = None
+        assert unafold.use_type_cache(list("GCCG")) is unafold.type_cache
+        kept = unafold.type_cache
+        assert unafold.use_type_cache(list("GCCG")) is kept
+        assert unafold.use_type_cache(list("GCCG"), keep=False) is not kept
+        assert unafold.use_type_cache(list("ATAA")).recognition == tuple("ATAA")
+    finally:
+        unafold.type_cache = saved
+
+def test_type_cache_classify_generator():
+    """Types read through the cache are those worked out without it"""
+    def _type_cache_classify(lines, recognition, quencher):
+        expected = [unafold.fold_type(fold.to_dict(), recognition, quencher)
+                    for fold in unafold.parse_ct(lines)]
+        saved = unafold.type_cache
+        try:
+            unafold.type_cache = unafold.TypeCache(recognition)
+            first = unafold.classify_folds(unafold.parse_ct(lines),
+                                           recognition, quencher)
+            misses = unafold.type_cache.misses
+            second = unafold.classify_folds(unafold.parse_ct(lines),
+                                            recognition, quencher)
+            print("_type_cache_classify(): %s" % unafold.type_cache)
+            assert first == expected
+            assert second == expected
+            # Every fold was seen the first time round
+            assert unafold.type_cache.misses == misses
+        finally:
+            unafold.type_cache = saved
+
+    for test in os.listdir(test_dir + "run_hybrid_ss_min"):
+        lines_file = open(test_dir + "run_hybrid_ss_min/" + test)
+        lines = pickle.load(lines_file)
+        lines_file.close()
+        for (recognition, quencher) in [(list("GCCG"), 6), (list("ATAA"), 10)]:
+            yield _type_cache_classify, lines, recognition, quencher
+
+def test_scratch_dir():
+    root = tempfile.mkdtemp()
+    saved = unafold.scratch_root
+    try:
+        unafold.scratch_root = root
+        unafold._scratch = (None, None)
+
+        # Left behind by a process that has exited
+        child = subprocess.Popen(["true"])
+        child.wait()
+        os.mkdir(os.path.join(root, "fealden-%d" % child.pid))
+        os.mkdir(os.path.join(root, "unrelated"))
+
+        path = unafold.scratch_dir()
+        assert path == os.path.join(root, "fealden-%d" % os.getpid())
+        assert os.path.isdir(path)
+        assert unafold.scratch_dir() == path
+        assert sorted(os.listdir(root)) == sorted([os.path.basename(path),
+                                                   "unrelated"])
+    finally:
+        unafold.scratch_root = saved
+        unafold._scratch = (None, None)
+        shutil.rmtree(root)
+
+def test_hybrid_ss_min_options():
+    options = unafold.hybrid_ss_min_options()
+    assert "--mfold=50,-1,100" in options
+    mfe_options = unafold.hybrid_ss_min_options(mfe=True)
+    assert [x for x in mfe_options if x.startswith("--mfold")] == []
+    assert mfe_options == options[:-1]
+
+fake_hybrid_ss_min = """#!%s
+# Writes an unfolded structure for every sequence in a FASTA file
+import sys
+prefix = sys.argv[-1]
+lines = open(prefix).read().split()
+ct = open(prefix + ".ct", "w")
+for index in range(0, len(lines), 2):
+    name = lines[index][1:]
+    seq = lines[index + 1]
+    ct.write("%%d\\tdG = 0.0\\t%%s\\n" %% (len(seq), name))
+    for n in range(len(seq)):
+        ct.write("%%d\\t%%s\\t%%d\\t%%d\\t0\\t%%d\\t0\\t0\\n" %%
+                 (n + 1, seq[n], n, (n + 2) %% (len(seq) + 1), n + 1))
+ct.close()
+open(prefix + ".plot", "w").close()
+sys.stdout.write("done\\n")
+"""
+
+def test_fold_dispatcher():
+    bindir = tempfile.mkdtemp()
+    root = tempfile.mkdtemp()
+    saved = (os.environ["PATH"], unafold.scratch_root)
+    try:
+        script = os.path.join(bindir, "hybrid-ss-min")
+        with open(script, "w") as f:
+            f.write(fake_hybrid_ss_min % sys.executable)
+        os.chmod(script, 0o755)
+        os.environ["PATH"] = bindir + os.pathsep + os.environ["PATH"]
+        unafold.scratch_root = root
+        unafold._scratch = (None, None)
+
+        groups = [["ACGT", "TTTT"], ["GGGG"], ["CCCCA"], ["AAAAT", "GCGC"]]
+        dispatcher = unafold.FoldDispatcher(2)
+        for (index, group) in enumerate(groups):
+            dispatcher.submit(group, index)
+
+        finished = []
+        for (index, lines) in dispatcher.as_completed():
+            finished.append(index)
+            folds = unafold.split_ct(lines)
+            assert sorted(folds) == sorted(groups[index])
+            for name in groups[index]:
+                assert len(unafold.parse_ct(folds[name])[0]["seq"]) == len(name)
+
+        assert sorted(finished) == range(len(groups))
+        # Nothing but the .ct files was kept, and they are gone too
+        assert os.listdir(unafold.scratch_dir()) == []
+    finally:
+        (os.environ["PATH"], unafold.scratch_root) = saved
+        unafold._scratch = (None, None)
+        shutil.rmtree(bindir)
+        shutil.rmtree(root)
+
 def test_find_stems_generator():
     def _find_stems(folding, expected):
         results = unafold.find_stems(folding, True)
@@ -289,6 +550,79 @@ def test_find_stems_generator():
         yield _find_stems, expected[0], expected[1]
             
 
+def test_find_elements_generator():
+    # CCC AAAA GGG with tails, and the same with a bulge loop
+    tests = [[[0, 0, 12, 11, 10, 0, 0, 0, 0, 5, 4, 3, 0],
+              [{"lh": {"start": 3, "end": 5}, "rh": {"start": 10, "end": 12}}],
+              [[6, 9]], [[1, 2], [13, 13]]],
+             [[14, 13, 0, 11, 10, 0, 0, 0, 0, 5, 4, 0, 2, 1],
+              [{"lh": {"start": 1, "end": 2}, "rh": {"start": 13, "end": 14}},
+               {"lh": {"start": 4, "end": 5}, "rh": {"start": 10, "end": 11}}],
+              [[3, 3], [6, 9], [12, 12]], []],
+             [[0, 0, 0], [], [], [[1, 3]]]]
+
+    def _find_elements(bp, stems, loops, tails):
+        fold = unafold.Fold(0.0, "A" * len(bp), bp)
+        assert unafold.find_elements(fold) == (stems, loops, tails)
+        assert unafold.find_elements(fold.to_dict()) == (stems, loops, tails)
+        assert unafold.find_stems(fold) == stems
+
+    for test in tests:
+        yield _find_elements, test[0], test[1], test[2], test[3]
+
+def bp_of_brackets(brackets):
+    """Return the bp column of a fold written in dot-bracket form"""
+    bp = [0] * len(brackets)
+    opened = []
+    for (index, bracket) in enumerate(brackets):
+        if bracket == "(":
+            opened.append(index)
+        elif bracket == ")":
+            partner = opened.pop()
+            bp[index] = partner + 1
+            bp[partner] = index + 1
+    return bp
+
+def test_structure():
+    # Helices A to F in turn, F outside A:
+    #  A holds B through an internal loop, B holds C and D in a multi
+    #  loop, D is split in two by a bulge, C, D and F close hairpins
+    brackets = ''.join([".", "(((", ".", "((", ".", "((", "...", "))", ".",
+                        "((", ".", "((", "...", "))", "))", ".", "))", "..",
+                        ")))", ".", "((", "...", "))", "."])
+    fold = unafold.Fold(-1.0, "A" * len(brackets), bp_of_brackets(brackets))
+    structure = fold.structure()
+
+    assert structure is fold.structure()
+    assert structure == unafold.Structure.of(fold.to_dict())
+    assert structure.length == 45
+    assert structure.helices == ((2, 4, 34, 36), (6, 7, 30, 31),
+                                 (9, 10, 14, 15), (17, 18, 27, 28),
+                                 (20, 21, 25, 26), (38, 39, 43, 44))
+    assert structure.stems() == unafold.find_stems(fold.to_dict())
+    assert structure.loops == ((5, 5), (8, 8), (11, 13), (16, 16), (19, 19),
+                               (22, 24), (29, 29), (32, 33), (37, 37),
+                               (40, 42))
+    assert structure.tails == ((1, 1), (45, 45))
+    assert structure.hairpins == ((2, ((11, 13),)), (4, ((22, 24),)),
+                                  (5, ((40, 42),)))
+    assert structure.bulges == ((3, ((19, 19),)),)
+    assert structure.internal_loops == ((0, ((5, 5), (32, 33))),)
+    assert structure.multi_loops == ((1, ((8, 8), (16, 16), (29, 29))),)
+    assert structure.exterior == ((37, 37),)
+
+    # Only F is far enough from the rest not to be joined to them
+    assert structure.bound() == structure.helices
+    assert structure.joined() == ((2, 21, 25, 36), (38, 39, 43, 44))
+    assert structure.quencher_distance(10) == 8
+
+    try:
+        structure.helices = ()
+    except AttributeError:
+        pass
+    else:
+        assert False, "Structure.helices could be changed"
+
 def find_stems_make_case(seq, foldnum, comment):
     foldings = unafold.parse_ct(unafold.run_hybrid_ss_min(seq))
 
@@ -301,6 +635,104 @@ def find_stems_make_case(seq, foldnum, comment):
     tosave.close()
 
 
+def test_score_sensors():
+    """score_sensors() gives each fold its share of the Boltzmann
+       weight of its sensor and totals them by type, even where the
+       weights themselves would overflow"""
+    sensor = util.Sensor("GCCG")
+    # Two folds that pair nothing, and two that pair 1 to 10
+    bp = [[0] * 10, [0] * 10,
+          [10, 9, 8, 0, 0, 0, 0, 3, 2, 1], [10, 9, 8, 0, 0, 0, 0, 3, 2, 1]]
+    sequence = str(sensor)[:10]
+    tests = [[-1.0, -2.0, -3.0, -4.0],
+             [-3000.0, -3000.0, -3000.0, -3000.0]]
+
+    def _score(energies):
+        return [unafold.Fold(energy, sequence, fold_bp)
+                for (energy, fold_bp) in zip(energies, bp)]
+
+    folds = [_score(energies) for energies in tests]
+    scores = unafold.score_sensors([sensor, sensor], folds)
+    assert scores[0] == unafold.score_sensor(sensor, _score(tests[0]))
+
+    for (sensor_scores, sensor_folds, energies) in zip(scores, folds, tests):
+        largest = max([math.fabs(energy) for energy in energies])
+        weights = [math.exp((math.fabs(energy) - largest) / unafold.RT)
+                   for energy in energies]
+        for (fold, weight) in zip(sensor_folds, weights):
+            assert abs(fold["percent_in_solution"] - weight / sum(weights)) < 1e-12
+        assert abs(sum([score["percent"] for score in sensor_scores.values()]) -
+                   1.0) < 1e-12
+        assert sum([score["num"] for score in sensor_scores.values()]) == 4
+        for type in unafold.fold_types:
+            assert sensor_scores[type]["num"] == len([fold for fold in sensor_folds
+                                                      if fold.type == type])
+
+def test_validity_settled_generator():
+    # [ binding_on, nonbinding_off, unknown, remaining, settled ]
+    tests = [[.5, .5, 0.0, 0.0, True],
+             # Too much is unknown already
+             [.3, .3, .25, .15, True],
+             # The ratio stays within .9 to 1.1 however the rest goes
+             [.49, .49, 0.0, .02, True],
+             # The rest could take the ratio out of range
+             [.45, .45, 0.0, .1, False],
+             # The ratio cannot come back into range
+             [.8, .1, 0.0, .1, True],
+             # Nothing is nonbinding yet
+             [.0, .0, 0.0, 1.0, False],
+             # In range, but the rest could all be unknown
+             [.45, .45, .05, .001, True],
+             [.40, .40, .05, .16, False]]
+
+    def _run_validity_settled(on, off, unknown, remaining, expected):
+        percents = {"binding_on": on, "nonbinding_off": off,
+                    "binding_unknown": unknown, "nonbinding_unknown": 0.0}
+        result = unafold.validity_settled(percents, remaining, (.9, 1.1), .2)
+        print("validity_settled(%s, %f): expected %s, got %s" %
+              (percents, remaining, expected, result))
+        assert result == expected
+
+    for test in tests:
+        yield (_run_validity_settled, test[0], test[1], test[2], test[3],
+               test[4])
+
+def test_settle_sensor_generator():
+    """settle_sensor() leaves validate_sensor() with the same answer as
+       scoring every fold does"""
+    ranges = [(.9, 1.1), (.6, .7), (.2, .8), (.01, 100.0)]
+    unknowns = [.2, .05, .9]
+
+    def _run_settle_sensor(sensor, folds, bindingratiorange,
+                           maxunknownpercent):
+        scores = unafold.score_sensor(sensor, folds)
+        expected = unafold.validate_sensor(sensor, scores, folds,
+                                           bindingratiorange,
+                                           maxunknownpercent)
+        settled = unafold.settle_sensor(sensor, folds, bindingratiorange,
+                                        maxunknownpercent)
+        result = unafold.validate_sensor(sensor, settled, folds,
+                                         bindingratiorange,
+                                         maxunknownpercent)
+        print("settle_sensor(%s, %s, %f): %d of %d folds unclassified, "
+              "expected %s, got %s" %
+              (sensor, bindingratiorange, maxunknownpercent,
+               settled["unclassified"]["num"], len(folds), expected, result))
+        assert result == expected
+        assert (sum([score["num"] for score in settled.values()]) ==
+                len(folds))
+        assert abs(sum([score["percent"] for score in settled.values()]) -
+                   1.0) < 1e-9
+
+    for test in sorted(os.listdir(test_dir + "validate_sensor/")):
+        expected_file = open(test_dir + "validate_sensor/" + test, "rb")
+        (sensor, scores, folds) = pickle.load(expected_file)[:3]
+        expected_file.close()
+        for bindingratiorange in ranges:
+            for maxunknownpercent in unknowns:
+                yield (_run_settle_sensor, sensor, folds, bindingratiorange,
+                       maxunknownpercent)
+
 @nottest
 def score_sensor_test_generator():
     def _run_score_sensor(sensor, folds, expected_scores):
@@ -378,6 +810,73 @@ def validate_sensor_test_generator():
                expected[3],expected[4], expected[5], expected[6], expected[7])
         
 
+def test_solution_distance_generator():
+    # [ binding_on, nonbinding_off, unknown, unclassified, distance ]
+    tests = [[.5, .5, 0.0, 0.0, 0.0],
+             [.45, .45, .1, 0.0, 0.0],
+             # Twice the highest ratio
+             [.44, .2, .16, 0.0, math.log(2.2 / 1.1)],
+             # Half the lowest, and .1 too much unknown
+             [.2, .5, .3, 0.0, math.log(.9 / .4) + .1],
+             [0.0, .7, .3, 0.0, float("inf")],
+             [.7, 0.0, .3, 0.0, float("inf")],
+             # The ratio is between .4 / .6 and .6 / .4
+             [.4, .4, 0.0, .2, 0.0],
+             # Between 2 and 3.5, and half the unclassified is unknown
+             [.6, .2, .1, .1, math.log(2.75 / 1.1)],
+             # At least 1, and .05 too much unknown
+             [.5, 0.0, 0.0, .5, .05],
+             [0.0, 0.0, 0.0, 1.0, float("inf")]]
+
+    def _run_solution_distance(on, off, unknown, unclassified, expected):
+        scores = {"binding_on": {"percent": on},
+                  "nonbinding_off": {"percent": off},
+                  "binding_unknown": {"percent": unknown},
+                  "nonbinding_unknown": {"percent": 0.0},
+                  "unclassified": {"percent": unclassified}}
+        distance = unafold.solution_distance(scores, (.9, 1.1), .2)
+        print("solution_distance(%s): expected %f, got %f" %
+              (scores, expected, distance))
+        if expected == float("inf"):
+            assert distance == expected
+        else:
+            assert abs(distance - expected) < 1e-9
+
+    for test in tests:
+        yield (_run_solution_distance, test[0], test[1], test[2], test[3],
+               test[4])
+
+def test_evaluate_sensor_generator():
+    """evaluate_sensor() turns down exactly the sensors validate_sensor()
+       does, given every fold"""
+    def _run_evaluate_sensor(sensor, folds, bindingratiorange,
+                             maxunknownpercent, numfoldrange, maxenergy):
+        scores = unafold.score_sensor(sensor, folds)
+        expected = unafold.validate_sensor(sensor, scores, folds,
+                                           bindingratiorange,
+                                           maxunknownpercent,
+                                           numfoldrange, maxenergy)
+        context = util.SearchContext(sensor.Recognition, bindingratiorange,
+                                     maxunknownpercent, numfoldrange,
+                                     maxenergy)
+        result = unafold.evaluate_sensor(sensor, folds, context)
+        print("evaluate_sensor(%s, %s, %s, %s, %s): expected %s, got %s" %
+              (sensor, bindingratiorange, maxunknownpercent, numfoldrange,
+               maxenergy, expected, result))
+        assert (result is not None) == expected
+
+    for test in sorted(os.listdir(test_dir + "validate_sensor/")):
+        expected_file = open(test_dir + "validate_sensor/" + test, "rb")
+        expected = pickle.load(expected_file)
+        expected_file.close()
+        (sensor, folds) = (expected[0], expected[2])
+        for bindingratiorange in [expected[3], (.01, 100.0)]:
+            for numfoldrange in [expected[5], (1, 1), (1, 100)]:
+                for maxenergy in [expected[6], None, 3.0]:
+                    yield (_run_evaluate_sensor, sensor, folds,
+                           bindingratiorange, expected[4], numfoldrange,
+                           maxenergy)
+
 def validate_sensor_make_cases():
     # [ Recog, Stem1, Stem2, binding_ratio, maxunknownpercent, numfoldrange, maxenergy, expected ]
     tests = [["ATTA","CGA","TCC",(.9,1.1),.2,(2,4),-1.3,False],
@@ -491,3 +990,43 @@ if __name__ == '__main__':
     sys.exit(0)
 
 
+
+slow_hybrid_ss_min = """#!%s
+# Never finishes
+import time
+time.sleep(60)
+"""
+
+def test_stop_when():
+    """A run of hybrid-ss-min is killed once the search is over"""
+    bindir = tempfile.mkdtemp()
+    root = tempfile.mkdtemp()
+    saved = (os.environ["PATH"], unafold.scratch_root)
+    try:
+        script = os.path.join(bindir, "hybrid-ss-min")
+        with open(script, "w") as f:
+            f.write(slow_hybrid_ss_min % sys.executable)
+        os.chmod(script, 0o755)
+        os.environ["PATH"] = bindir + os.pathsep + os.environ["PATH"]
+        unafold.scratch_root = root
+        unafold._scratch = (None, None)
+
+        for stop in [(time.time() + 0.5, None),
+                     (None, multiprocessing.Value("i", 0))]:
+            unafold.stop_when(*stop)
+            started = time.time()
+            try:
+                unafold.run_hybrid_ss_min("ACGT")
+            except unafold.UNAFoldCancelled:
+                assert True
+            else:
+                assert False
+            assert time.time() - started < 10
+            assert len(unafold._running) == 0
+            assert os.listdir(unafold.scratch_dir()) == []
+    finally:
+        unafold.stop_when()
+        (os.environ["PATH"], unafold.scratch_root) = saved
+        unafold._scratch = (None, None)
+        shutil.rmtree(bindir)
+        shutil.rmtree(root)
@@ -79,6 +79,64 @@ def guessstems_tests():
 
         assert str(sensor) == test[4]
 
+def PushPopGuess_test_generator():
+    # [ [ recog, stem1, stem2, guesses] ]
+    tests = [ ["ATTACC", "", "", "GATTCAGC"],
+              ["ATTACC", "CGA", "GAC", "ATCG"],
+              ["CGTA", "CGAA", "GAC", "TTGCA"],
+              ["ATTACC", "CGAAT", "G", "ATCGA"],
+              ["ATTACC", "C", "GACTA", "TTG"]]
+
+    def _pushpop_test(recog, stem1, stem2, guesses):
+        sensor = util.Sensor(recog)
+        sensor.SetStem1(stem1)
+        sensor.SetStem2(stem2)
+        original = str(sensor)
+        rebuilt = util.Sensor(recog)
+        rebuilt.SetStem1(stem1)
+        rebuilt.SetStem2(stem2)
+
+        for guess in guesses:
+            sensor.PushGuess(guess)
+            # The stems as GuessStems() used to leave them
+            if len(rebuilt.Stem1) > len(rebuilt.Stem2):
+                rebuilt.SetStem2(rebuilt.Stem2 + [guess])
+            else:
+                rebuilt.SetStem1(rebuilt.Stem1 + [guess])
+            print("util.Sensor.PushPopGuess_test: pushed %s, expected 1 got 2\n1:%s\n2:%s" %
+                  (guess, rebuilt, sensor))
+            assert str(sensor) == str(rebuilt)
+            assert sensor.Stem1R == rebuilt.Stem1R
+            assert sensor.Stem2R == rebuilt.Stem2R
+            assert sensor.StemEnergy() == rebuilt.StemEnergy()
+
+        copied = sensor.Copy()
+        for guess in reversed(guesses):
+            assert sensor.PopGuess() == guess
+        print("util.Sensor.PushPopGuess_test: popped all, expected 1 got 2\n1:%s\n2:%s" %
+              (original, sensor))
+        assert str(sensor) == original
+        assert str(copied) == str(rebuilt)
+        assert copied.StemEnergy() == rebuilt.StemEnergy()
+        unguessed = util.Sensor(recog)
+        unguessed.SetStem1(stem1)
+        unguessed.SetStem2(stem2)
+        assert sensor.StemEnergy() == unguessed.StemEnergy()
+
+    for test in tests:
+        yield _pushpop_test, test[0], test[1], test[2], test[3]
+
+def PopGuess_unpushed_test():
+    sensor = util.Sensor("ATTACC")
+    sensor.PushGuess("A")
+    sensor.SetStem1("CGAAT")
+    try:
+        sensor.PopGuess()
+    except IndexError:
+        assert True
+    else:
+        assert False
+
 def RecognitionEnergy_tests():
     # [ [recognition, free energy] ]
     tests = [ ["CGTA", -2.2],
@@ -453,7 +511,105 @@ def RequestElement_test_generator():
                "maxenergy": -3.4,
                "numsolutions": 1,
                "valid": False,
-               "purpose": "missing request_id"}
+               "purpose": "missing request_id"},
+              {"command": "BACKTRACKING",
+               "request_id": "2345AFG^&%$^",
+               "email": "test@example.com",
+               "output_dir": "/tmp/tmp12",
+               "maxtime": 34,
+               "recognition": "ATTA",
+               "numfolds_lo": 2,
+               "numfolds_hi": 2,
+               "binding_ratio_lo": 0.8,
+               "binding_ratio_hi": 1.2,
+               "maxunknown_percent": .2,
+               "maxenergy": -3.4,
+               "numsolutions": 1,
+               "engine": "native",
+               "valid": True,
+               "purpose": "native folding engine"},
+              {"command": "BACKTRACKING",
+               "request_id": "2345AFG^&%$^",
+               "email": "test@example.com",
+               "output_dir": "/tmp/tmp12",
+               "maxtime": 34,
+               "recognition": "ATTA",
+               "numfolds_lo": 2,
+               "numfolds_hi": 2,
+               "binding_ratio_lo": 0.8,
+               "binding_ratio_hi": 1.2,
+               "maxunknown_percent": .2,
+               "maxenergy": -3.4,
+               "numsolutions": 1,
+               "engine": "mfold",
+               "valid": False,
+               "purpose": "unknown folding engine"},
+              {"command": "BACKTRACKING",
+               "request_id": "2345AFG^&%$^",
+               "email": "test@example.com",
+               "output_dir": "/tmp/tmp12",
+               "maxtime": 34,
+               "recognition": "ATTA",
+               "numfolds_lo": 2,
+               "numfolds_hi": 2,
+               "binding_ratio_lo": 0.8,
+               "binding_ratio_hi": 1.2,
+               "maxunknown_percent": .2,
+               "maxenergy": -3.4,
+               "numsolutions": 1,
+               "engine": "replay",
+               "valid": False,
+               "purpose": "replay is only for tests"},
+              {"command": "BACKTRACKING",
+               "request_id": "2345AFG^&%$^",
+               "email": "test@example.com",
+               "output_dir": "/tmp/tmp12",
+               "maxtime": 34,
+               "recognition": "ATTA",
+               "numfolds_lo": 2,
+               "numfolds_hi": 2,
+               "binding_ratio_lo": 0.8,
+               "binding_ratio_hi": 1.2,
+               "maxunknown_percent": .2,
+               "maxenergy": -3.4,
+               "numsolutions": 1,
+               "strategy": "bestfirst",
+               "beamwidth": 64,
+               "valid": True,
+               "purpose": "best first search with a beam"},
+              {"command": "BACKTRACKING",
+               "request_id": "2345AFG^&%$^",
+               "email": "test@example.com",
+               "output_dir": "/tmp/tmp12",
+               "maxtime": 34,
+               "recognition": "ATTA",
+               "numfolds_lo": 2,
+               "numfolds_hi": 2,
+               "binding_ratio_lo": 0.8,
+               "binding_ratio_hi": 1.2,
+               "maxunknown_percent": .2,
+               "maxenergy": -3.4,
+               "numsolutions": 1,
+               "strategy": "random",
+               "valid": False,
+               "purpose": "unknown search strategy"},
+              {"command": "BACKTRACKING",
+               "request_id": "2345AFG^&%$^",
+               "email": "test@example.com",
+               "output_dir": "/tmp/tmp12",
+               "maxtime": 34,
+               "recognition": "ATTA",
+               "numfolds_lo": 2,
+               "numfolds_hi": 2,
+               "binding_ratio_lo": 0.8,
+               "binding_ratio_hi": 1.2,
+               "maxunknown_percent": .2,
+               "maxenergy": -3.4,
+               "numsolutions": 1,
+               "strategy": "bestfirst",
+               "beamwidth": 0,
+               "valid": False,
+               "purpose": "beam width not positive"}
               )
 
     def tester(testdict):
@@ -472,7 +628,10 @@ def RequestElement_test_generator():
                                      binding_ratio_lo=testdict["binding_ratio_lo"],
                                      binding_ratio_hi=testdict["binding_ratio_hi"],
                                      maxunknown_percent=testdict["maxunknown_percent"],
-                                     maxenergy=testdict["maxenergy"])
+                                     maxenergy=testdict["maxenergy"],
+                                     engine=testdict.get("engine"),
+                                     strategy=testdict.get("strategy"),
+                                     beamwidth=testdict.get("beamwidth"))
 
         if testel.valid() == testdict["valid"]:
             shutil.rmtree(testdict["output_dir"])
@@ -748,3 +907,72 @@ def SolutionElement_test_generator():
 
     for test in tests:
         yield tester, test
+
+def RecognitionMatcher_test_generator():
+    #    [ recognition, stemlh, stemrh, expected ]
+    tests = [ ["GCCG", "TTGCC", "AAA", .75],
+              ["GCCG", "AAA", "GCCGT", 1.0],
+              # Reversed pieces count too
+              ["ATTGC", "CGTTA", "", 1.0],
+              # Taken from the first nucleotide of the recognition in
+              # the stem, not the longest piece anywhere
+              ["ACCCC", "AGCCCC", "", .2],
+              ["GCCG", "TTTT", "AAAA", 0.0],
+              ["", "ACGT", "ACGT", 0.0],
+              ["GCCG", "", "", 0.0] ]
+
+    def _recognition_matcher(recognition, stemlh, stemrh, expected):
+        matcher = util.RecognitionMatcher.get(list(recognition))
+        assert matcher is util.RecognitionMatcher.get(list(recognition))
+        result = matcher.match(list(stemlh), list(stemrh))
+        print("util.RecognitionMatcher(%s).match(%s, %s): expected %s, got %s" %
+              (recognition, stemlh, stemrh, expected, result))
+        assert result == expected
+
+    for test in tests:
+        yield _recognition_matcher, test[0], test[1], test[2], test[3]
+
+def SearchContext_test_generator():
+    # [ [recognition, maxenergy, recognition energy, energy limit] ]
+    tests = [ ["CGTA", None, -2.2, None],
+              ["ATTTATTCG", 3.0, -5.2, -2.2]]
+
+    def _searchcontext_test(recog, maxenergy, energy, limit):
+        context = util.SearchContext(recog, maxenergy=maxenergy)
+        print("util.SearchContext_test: for %s got %s, recognition energy %f" %
+              (recog, context, context.recognition_energy))
+
+        assert context.recognition == util.Sensor(recog).Recognition
+        assert math.fabs(context.recognition_energy - energy) < .01
+        assert math.fabs(context.promising_energy - (energy - 2.0)) < .01
+        assert context.bindingratiorange == (.9, 1.1)
+        assert context.maxunknownpercent == .2
+        if limit is None:
+            assert context.energy_limit is None
+            assert context.within_maxenergy(100.0)
+        else:
+            assert math.fabs(context.energy_limit - limit) < .01
+            assert context.within_maxenergy(limit + 1.0)
+            assert not context.within_maxenergy(limit - 1.0)
+
+    for test in tests:
+        yield _searchcontext_test, test[0], test[1], test[2], test[3]
+
+def SearchContext_within_maxenergy_test_generator():
+    """within_maxenergy() agrees with the maxenergy test in
+       unafold.validate_sensor()"""
+    # RecognitionEnergy() is -5.4
+    tests = [["GCCGAAAA", -10.0, 2.0, False],
+             ["GCCGAAAA", -3.0, 2.0, True],
+             ["GCCGAAAA", -1.0, 2.0, True],
+             ["GCCGAAAA", -10.0, -5.0, True],
+             ["GCCGAAAA", -100.0, None, True]]
+
+    def _within_maxenergy(recog, energy, maxenergy, expected):
+        context = util.SearchContext(recog, maxenergy=maxenergy)
+        print("util.SearchContext.within_maxenergy(%f): %s, expected %s" %
+              (energy, context, expected))
+        assert context.within_maxenergy(energy) == expected
+
+    for test in tests:
+        yield _within_maxenergy, test[0], test[1], test[2], test[3]
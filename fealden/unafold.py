@@ -5,16 +5,25 @@ from __future__ import division
 from types import *
 
 import argparse
+import collections
 import copy
+import errno
+import glob
+import itertools
 import logging
 import math
 import operator
 import os
 import re
+import select
 import shutil
+import signal
 import subprocess
 import sys
 import tempfile
+import time
+
+import numpy as np
 
 from . import util
 
@@ -28,68 +37,404 @@ class UNAFoldError(Exception):
     def __str__(self):
         return repr(self.msg)
 
+class UNAFoldCancelled(UNAFoldError):
+    """Exception raised when folding is stopped because the search it
+       was for has ended, see stop_when()"""
+    pass
+
 logger = logging.getLogger(__name__)
 
 
-def run_hybrid_ss_min(sensor, debug=False):
-    """Given a sequence, run hybrid-ss-min, return the lines from .ct
-       file generated
+# RT in kcal/mol, for the Boltzmann weight of a fold
+RT = 2.47
+
+# The conditions every sensor is folded under, temperature in C, salt
+# concentrations in M and the mfold parameters for suboptimal folds
+# (percent of the minimum free energy, window and maximum number of folds)
+conditions = {"temperature": 25,
+              "sodium": 0.15,
+              "magnesium": 0.005,
+              "percent": 50,
+              "window": -1,
+              "maxfolds": 100}
+
+def hybrid_ss_min_options(folding_conditions=None, mfe=False):
+    """Return the command line options to hybrid-ss-min for
+       folding_conditions, which defaults to conditions. If mfe is True,
+       only the minimum free energy structure is asked for."""
+    if folding_conditions is None:
+        folding_conditions = conditions
+    options = ['-n','DNA',
+               '--tmin=%s' % folding_conditions["temperature"],
+               '--tmax=%s' % folding_conditions["temperature"],
+               '--sodium=%s' % folding_conditions["sodium"],
+               '--magnesium=%s' % folding_conditions["magnesium"]]
+    if not mfe:
+        options.append('--mfold=%s,%s,%s' % (folding_conditions["percent"],
+                                             folding_conditions["window"],
+                                             folding_conditions["maxfolds"]))
+    return options
+
+# Where scratch directories for hybrid-ss-min are made, /dev/shm is
+# memory backed on Linux. If it isn't usable, the system temporary
+# directory is used instead.
+scratch_root = "/dev/shm"
+
+# (pid, path) of this process' scratch directory, the pid is kept so that
+# a forked child does not share its parent's directory.
+_scratch = (None, None)
+_scratch_names = itertools.count()
+
+# Every HybridSSMinRun of this process that has been started and not yet
+# finished or killed
+_running = set()
+
+# (deadline, command) of the search this process is folding for, see
+# stop_when(), and how often in seconds runs check on it
+_stop = (None, None)
+poll_interval = 0.25
+
+def stop_when(deadline=None, command=None):
+    """Stop folding in this process, by raising UNAFoldCancelled, once
+       time.time() passes deadline or command.value is 0 (which is how
+       sensorsearch() tells its workers the search is over). Any run of
+       hybrid-ss-min still going is killed.
 
        Arguments:
-       seq -- a list containing the sequence to be folded
+       deadline -- a time.time(), or None
+       command -- a multiprocessing.Value, or None
+    """
+    global _stop
+    _stop = (deadline, command)
+
+def stopped():
+    """Return True if folding should stop, see stop_when()"""
+    (deadline, command) = _stop
+    return ((deadline is not None and time.time() >= deadline) or
+            (command is not None and command.value == 0))
+
+def kill_running():
+    """Kill every run of hybrid-ss-min this process has going"""
+    for run in list(_running):
+        run.kill()
+
+def scratch_dir():
+    """Return this process' scratch directory, creating it (and removing
+       any left behind by processes that have since died) if needed.
 
        Returns:
-       list -- of lines from the .ct file
+       str -- path to a directory, named fealden-<pid>, that only this
+              process uses
     """
+    global _scratch
+    if _scratch[0] == os.getpid() and os.path.isdir(_scratch[1]):
+        return _scratch[1]
+
+    root = scratch_root
+    if not (os.path.isdir(root) and os.access(root, os.W_OK)):
+        root = tempfile.gettempdir()
 
+    sweep_scratch(root)
 
-    tempdir = tempfile.mkdtemp()
-    try:
+    path = os.path.join(root, "fealden-%d" % os.getpid())
+    if not os.path.isdir(path):
+        try:
+            os.mkdir(path, 0o700)
+        except OSError, err:
+            raise UNAFoldError("scratch_dir(): can't create %s, %s" % (path, err))
+    _scratch = (os.getpid(), path)
+    logger.debug("scratch_dir(): using %s" % path)
+    return path
+
+def sweep_scratch(root):
+    """Remove the scratch directories in root of processes that are no
+       longer running"""
+    for name in os.listdir(root):
+        match = re.match(r'fealden-(\d+)$', name)
+        if not match:
+            continue
+        pid = int(match.group(1))
+        try:
+            os.kill(pid, 0)
+        except OSError, err:
+            if err.errno == errno.ESRCH:
+                logger.debug("sweep_scratch(%s): removing %s, process %d is gone" %
+                             (root, name, pid))
+                shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+class HybridSSMinRun(object):
+    """A run of hybrid-ss-min, as started by start_hybrid_ss_min(), that
+       may still be going.
+
+       Once the process has finished (its output pipe is closed, see
+       fileno()), finish() returns the lines of the .ct file. Only the .ct
+       file is read, so every file the run created is removed then.
+
+       hybrid-ss-min is started in a process group of its own, which
+       kill() kills as a whole.
+    """
+    def __init__(self, names, directory, prefix, command, debug=False):
+        self.names = names
+        self.directory = directory
+        self.prefix = prefix
+        self.command = command
+        self.debug = debug
+        self.process = None
+
+    def start(self):
         # hybrid-ss-min can only read sequences in from a file and
-        # write .ct data to a file, ughh...
+        # write .ct data to a file, ughh... Each sequence is named
+        # after itself, so that is the name in the .ct headers.
         try:
-            if debug:
-                print "Attempting to open sequence file {}".format(os.path.join(tempdir, str(sensor)))
-            seqfile = open(os.path.join(tempdir, str(sensor)),"w")
-            seqfile.write(str(sensor))
+            if self.debug:
+                print "Attempting to open sequence file {}".format(os.path.join(self.directory, self.prefix))
+            seqfile = open(os.path.join(self.directory, self.prefix),"w")
+            for name in self.names:
+                seqfile.write(">%s\n%s\n" % (name, name))
             seqfile.close()
         except IOError:
+            self.cleanup()
             raise UNAFoldError("run_hybrid_ss_min(): can't create sequence file")
 
-        command = ['hybrid-ss-min','-n','DNA','--tmin=25', '--tmax=25',
-                   '--sodium=0.15', '--magnesium=0.005','--mfold=50,-1,100', str(sensor)]
+        # Run hybrid-ss-min, its progress messages go to a pipe (which
+        # we throw away) so that we can tell when it has finished
+        # with select()
+        try:
+            if self.debug:
+                print "Attempting to run command {} with cwd = {}".format(self.command, self.directory)
+            self.process = subprocess.Popen(self.command, cwd=self.directory,
+                                            stdout=subprocess.PIPE,
+                                            close_fds=True,
+                                            preexec_fn=os.setsid)
+        except (IOError, OSError):
+            self.cleanup()
+            raise UNAFoldError("run_hybrid_ss_min(): call %s failed" % ' '.join(self.command))
+        _running.add(self)
+        return self
+
+    def fileno(self):
+        return self.process.stdout.fileno()
+
+    def read(self):
+        """Read whatever output is waiting, return False once there is
+           no more to come"""
+        return len(os.read(self.fileno(), 65536)) > 0
+
+    def wait(self):
+        """Wait for hybrid-ss-min to finish, then finish(). If folding
+           is stopped() first, it is killed and UNAFoldCancelled raised."""
+        while True:
+            (ready, _, _) = select.select([self], [], [], poll_interval)
+            if ready and not self.read():
+                break
+            if stopped():
+                self.kill()
+                raise UNAFoldCancelled("run_hybrid_ss_min(): %s stopped, the "
+                                       "search has ended" % ' '.join(self.command))
+        return self.finish()
+
+    def finish(self):
+        _running.discard(self)
+        try:
+            self.process.stdout.close()
+            if self.process.wait() != 0:
+                raise UNAFoldError("run_hybrid_ss_min(): call %s failed" % ' '.join(self.command))
+
+            # hybrid-ss-min creates a number of files each run, but the $SEQ.ct
+            # which contains secondary structure information for each conformation
+            # The program ct-energy (part of UNAfold) parses the .ct file and
+            # returns an easily parseable secondary structure.
+            ct_filename = os.path.join(self.directory, self.prefix + ".ct")
+            if self.debug: print "run_hybrid_ss_min(): ct_file = %s" % ct_filename
+            try:
+                ct_file = open(ct_filename)
+                lines = ct_file.readlines()
+                ct_file.close()
+            except IOError:
+                raise UNAFoldError("run_hybrid_ss_min(): can't read %s" % ct_filename)
+        finally:
+            self.cleanup()
+        return lines
+
+    def kill(self):
+        """Stop hybrid-ss-min, if it is still running, and clean up"""
+        _running.discard(self)
+        if self.process is not None and self.process.poll() is None:
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except OSError:
+                pass
+            self.process.wait()
+        if self.process is not None:
+            self.process.stdout.close()
+        self.cleanup()
+
+    def cleanup(self):
+        # UNAfold produces copius output in the form of temporary files
+        # (.plot, .ann, .dG, .run ...) that we never read, remove them all.
+        for filename in ([os.path.join(self.directory, self.prefix)] +
+                         glob.glob(os.path.join(self.directory, self.prefix + ".*"))):
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+
+def start_hybrid_ss_min(names, debug=False, folding_conditions=None, mfe=False):
+    """Start folding each sequence in names with one run of hybrid-ss-min
+       in scratch_dir(), see hybrid_ss_min_options() for mfe
+
+       Returns:
+       HybridSSMinRun -- already started
+    """
+    # Each run gets its own prefix, hybrid-ss-min names all of its
+    # output files after the sequence file.
+    prefix = "fold%d" % next(_scratch_names)
+    command = (['hybrid-ss-min'] + hybrid_ss_min_options(folding_conditions, mfe) +
+               [prefix])
+    return HybridSSMinRun(names, scratch_dir(), prefix, command, debug).start()
+
+def _run_hybrid_ss_min(names, debug=False, folding_conditions=None, mfe=False):
+    """Fold each sequence in names with one run of hybrid-ss-min, return
+       the lines of the .ct file"""
+    return start_hybrid_ss_min(names, debug, folding_conditions, mfe).wait()
+
+
+class FoldDispatcher(object):
+    """Keeps up to limit runs of hybrid-ss-min going at once.
+
+       Sequences are submit()ted in groups, each group folded by one run,
+       and as_completed() starts the runs as there is room for them and
+       yields their results in the order they finish:
 
-        #assert os.access(command[0], os.X_OK), "run_hybrid_ss_min(): command {} not found, expected hybrid_ss_min".format(command[0])
+       dispatcher = FoldDispatcher(4)
+       for group in groups:
+           dispatcher.submit(group, tag)
+       for (tag, lines) in dispatcher.as_completed():
+           ...
 
-                # Run hybrid-ss-min
+       Arguments:
+       limit -- the most runs of hybrid-ss-min in flight at once
+       folding_conditions -- optional, defaults to conditions
+    """
+    def __init__(self, limit=1, folding_conditions=None, debug=False):
+        self.limit = max(1, limit)
+        self.folding_conditions = folding_conditions
+        self.debug = debug
+        self.pending = []
+        self.running = {}
+
+    def submit(self, names, tag=None):
+        """Queue the sequences names to be folded by one run, tag is
+           given back with the result"""
+        self.pending.append((tag, list(names)))
+
+    def _start(self):
+        while self.pending and len(self.running) < self.limit:
+            (tag, names) = self.pending.pop(0)
+            run = start_hybrid_ss_min(names, self.debug, self.folding_conditions)
+            self.running[run.fileno()] = (tag, run)
+
+    def as_completed(self):
+        """Yield (tag, lines of the .ct file) for each submitted group as
+           its run finishes. If anything goes wrong, the caller stops
+           early or folding is stopped() (which raises UNAFoldCancelled),
+           every run still going is killed."""
         try:
-            if debug:
-                print "Attempting to run command {} with cwd = {}, stdout to {}".format(command, tempdir, "/dev/null")
-            subprocess.check_call(command,cwd=tempdir, stdout=open("/dev/null", 'w'))
-        except IOError, OSError:
-            raise UNAFoldError("run_hybrid_ss_min(): call %s failed" % ' '.join(command))
-
-        # hybrid-ss-min creates a number of files each run, but the $SEQ.ct
-        # which contains secondary structure information for each conformation
-        # The program ct-energy (part of UNAfold) parses the .ct file and
-        # returns an easily parseable secondary structure.
-
-        # Open .ct file
-        ct_filename = os.path.join(tempdir, str(sensor) + ".ct")
-        ct_file = open(ct_filename)
-        if debug: print "run_hybrid_ss_min(): ct_file = %s" % ct_filename
-
-        # read in lines
-        lines = ct_file.readlines()
-
-        # Close .ct file
-        ct_file.close()
-    finally:
-        # UNAfold produces copius output in the form of temporary files
-        # So, we must remove all temporary files associated with UNAfold run
-        shutil.rmtree(tempdir)
+            self._start()
+            while self.running:
+                (ready, _, _) = select.select(list(self.running), [], [],
+                                              poll_interval)
+                if stopped():
+                    raise UNAFoldCancelled("FoldDispatcher.as_completed(): "
+                                           "stopped, the search has ended")
+                for fd in ready:
+                    (tag, run) = self.running[fd]
+                    if run.read():
+                        continue
+                    del self.running[fd]
+                    lines = run.finish()
+                    self._start()
+                    yield (tag, lines)
+        finally:
+            self.close()
+
+    def close(self):
+        """Kill every run still going and forget anything not started"""
+        for (tag, run) in self.running.values():
+            run.kill()
+        self.running = {}
+        self.pending = []
+
+def run_hybrid_ss_min(sensor, debug=False, folding_conditions=None):
+    """Given a sequence, run hybrid-ss-min, return the lines from .ct
+       file generated
+
+       Arguments:
+       seq -- a list containing the sequence to be folded
+       folding_conditions -- optional, defaults to conditions
+
+       Returns:
+       list -- of lines from the .ct file
+    """
+    return _run_hybrid_ss_min([str(sensor)], debug, folding_conditions)
+
 
-    return lines
+def run_hybrid_ss_min_batch(sensors, debug=False, folding_conditions=None,
+                            mfe=False):
+    """Given a list of sequences, fold them all with a single run of
+       hybrid-ss-min, return the lines from the .ct file for each
+
+       Arguments:
+       sensors -- a list of sequences (or util.Sensors) to be folded
+       folding_conditions -- optional, defaults to conditions
+       mfe -- if True, only fold each into its minimum free energy
+              structure, which is much quicker
+
+       Returns:
+       list -- for each sequence in sensors, the list of lines from the
+               .ct file that belong to it, exactly as run_hybrid_ss_min()
+               would have returned them
+    """
+    if not sensors:
+        return []
+
+    # Duplicates only need to be folded once.
+    names = []
+    for sensor in sensors:
+        if str(sensor) not in names:
+            names.append(str(sensor))
+
+    by_name = split_ct(_run_hybrid_ss_min(names, debug, folding_conditions, mfe))
+
+    missing = [name for name in names if name not in by_name]
+    if missing:
+        raise UNAFoldError("run_hybrid_ss_min_batch(): no structures for %s" %
+                           ', '.join(missing))
+
+    return [by_name[str(sensor)] for sensor in sensors]
+
+
+def split_ct(ct_data):
+    """Split the lines of a .ct file holding the structures of many
+       sequences by the name of the sequence they belong to.
+
+       Arguments:
+       ct_data -- the .ct file represented as a list of lines
+
+       Returns:
+       dict -- {name: [lines of the .ct file for that sequence]}, see
+               parse_ct() for a description of the header lines that
+               carry the name
+    """
+    by_name = {}
+    current = None
+    for line in ct_data:
+        header = re.match(r'\s*\d+\s+dG\s*=\s*\S+\s+(.*\S)', line)
+        if header:
+            current = by_name.setdefault(header.group(1), [])
+        if current is not None:
+            current.append(line)
+    return by_name
 
 
 def parse_ct(ct_data, debug=False):
@@ -104,9 +449,9 @@ def parse_ct(ct_data, debug=False):
        ct_data: the .ct file represented as a list of lines.
 
        Returns:
-       foldings: list of folds
-          each index is a complete fold
-          {'fold': [list of dictionaries],
+       foldings: list of Fold, each a complete fold, which can be
+          indexed as the dictionary
+          {'seq': [list of dictionaries],
            'energy': (free energy of this fold),
            'type': if the folding is binding_on, nonbinding_off,
                    binding_unknown, or nonbinding_unknown}
@@ -173,60 +518,363 @@ def parse_ct(ct_data, debug=False):
        upstream: the 5' base
        downstream: the 3' base
        """
-    foldings = []
-    fold = []
+    return parse_ct_arrays(ct_data, debug).folds()
+
+
+class Fold(object):
+    """A single fold of a sequence, as found by hybrid-ss-min (see
+       parse_ct()) or nativefold.
+
+       energy -- the free energy of the fold
+       sequence -- the sequence folded, as a str (every fold of a
+                   sequence shares the one str)
+       bp, upstream, downstream -- int32 arrays, the 5th, 3rd and 4th
+                                   columns of the .ct file (1-based, 0
+                                   for none)
+       type -- one of the types of fold_type(), "" until it is known
+       percent_in_solution -- set by score_sensor(), None until then
+
+       A Fold can be indexed like the dictionaries folds used to be:
+       fold["energy"], fold["type"], fold["percent_in_solution"], and
+       fold["seq"][i]["bp"] (see FoldSequence). Anything derived from
+       the structure (structure(), classify()) is only worked out
+       when first asked for, then kept.
+    """
+    __slots__ = ("energy", "sequence", "bp", "upstream", "downstream",
+                 "type", "percent_in_solution",
+                 "_structure", "_classified")
+
+    def __init__(self, energy, sequence, bp, upstream=None, downstream=None,
+                 type=""):
+        n = len(sequence)
+        self.energy = energy
+        self.sequence = sequence
+        self.bp = np.asarray(bp, dtype=np.int32)
+        if upstream is None:
+            # A linear sequence
+            upstream = np.arange(n, dtype=np.int32)
+        if downstream is None:
+            downstream = np.arange(2, n + 2, dtype=np.int32)
+            if n:
+                downstream[-1] = 0
+        self.upstream = np.asarray(upstream, dtype=np.int32)
+        self.downstream = np.asarray(downstream, dtype=np.int32)
+        self.type = type
+        self.percent_in_solution = None
+        self._structure = None
+        self._classified = None
+
+    @classmethod
+    def from_dict(cls, fold):
+        """Return a Fold of a fold in the dictionary form"""
+        seq = fold["seq"]
+        made = cls(fold["energy"], ''.join([x["nucl"] for x in seq]),
+                   [x["bp"] for x in seq],
+                   [x["upstream"] for x in seq],
+                   [x["downstream"] for x in seq],
+                   fold.get("type", ""))
+        made.percent_in_solution = fold.get("percent_in_solution")
+        return made
+
+    def to_dict(self):
+        """Return this fold in the dictionary form"""
+        fold = {"energy": self.energy,
+                "seq": list(self["seq"]),
+                "type": self.type}
+        if self.percent_in_solution is not None:
+            fold["percent_in_solution"] = self.percent_in_solution
+        return fold
+
+    def __len__(self):
+        return len(self.sequence)
+
+    def keys(self):
+        keys = ["energy", "seq", "type"]
+        if self.percent_in_solution is not None:
+            keys.append("percent_in_solution")
+        return keys
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def __getitem__(self, key):
+        if key == "seq":
+            return FoldSequence(self)
+        elif key in ("energy", "type"):
+            return getattr(self, key)
+        elif key == "percent_in_solution" and self.percent_in_solution is not None:
+            return self.percent_in_solution
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in ("type", "percent_in_solution"):
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __eq__(self, other):
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        if not isinstance(other, Fold):
+            return NotImplemented
+        return (self.energy == other.energy and
+                self.sequence == other.sequence and
+                self.type == other.type and
+                self.percent_in_solution == other.percent_in_solution and
+                np.array_equal(self.bp, other.bp) and
+                np.array_equal(self.upstream, other.upstream) and
+                np.array_equal(self.downstream, other.downstream))
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    __hash__ = None
+
+    def __getstate__(self):
+        # Folds are sent between processes by the thousand, so keep this
+        # small: the arrays go as raw bytes, upstream and downstream not
+        # at all if they are those of a linear sequence, and the derived
+        # fields are quicker to work out again than to send
+        linear = Fold(0.0, self.sequence, [])
+        upstream = downstream = None
+        if not np.array_equal(self.upstream, linear.upstream):
+            upstream = self.upstream.tobytes()
+        if not np.array_equal(self.downstream, linear.downstream):
+            downstream = self.downstream.tobytes()
+        return (self.energy, self.sequence, self.bp.tobytes(), upstream,
+                downstream, self.type, self.percent_in_solution)
+
+    def __setstate__(self, state):
+        (energy, sequence, bp, upstream, downstream, type,
+         percent_in_solution) = state
+        if upstream is not None:
+            upstream = np.frombuffer(upstream, dtype=np.int32)
+        if downstream is not None:
+            downstream = np.frombuffer(downstream, dtype=np.int32)
+        Fold.__init__(self, energy, sequence, np.frombuffer(bp, dtype=np.int32),
+                      upstream, downstream, type)
+        self.percent_in_solution = percent_in_solution
+
+    def __repr__(self):
+        return "Fold(%r, %r, type=%r)" % (self.energy, self.sequence, self.type)
+
+    def structure(self):
+        """Return the Structure of this fold"""
+        if self._structure is None:
+            self._structure = Structure(self.bp.tolist())
+        return self._structure
+
+    def stems(self):
+        """Return find_stems() of this fold, the caller is free to
+           modify what it is given"""
+        return self.structure().stems()
+
+    def classify(self, recognition, quencher):
+        """Return fold_type() of this fold for recognition and
+           quencher, which is also kept as its type"""
+        key = (tuple(recognition), quencher)
+        if self._classified != key:
+            self.type = fold_type(self, recognition, quencher)
+            self._classified = key
+        return self.type
+
+
+class FoldSequence(object):
+    """The nucleotides of a Fold, each given as a dictionary
+       {"bp", "nucl", "upstream", "downstream", "member"}, made when it is
+       asked for."""
+    __slots__ = ("fold",)
+
+    def __init__(self, fold):
+        self.fold = fold
+
+    def __len__(self):
+        return len(self.fold.sequence)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[index] for index in range(*position.indices(len(self)))]
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError(position)
+        fold = self.fold
+        return {"bp": int(fold.bp[position]),
+                "nucl": fold.sequence[position],
+                "upstream": int(fold.upstream[position]),
+                "downstream": int(fold.downstream[position]),
+                "member": ""}
+
+    def __iter__(self):
+        fold = self.fold
+        for (bp, nucl, upstream, downstream) in zip(fold.bp.tolist(),
+                                                    fold.sequence,
+                                                    fold.upstream.tolist(),
+                                                    fold.downstream.tolist()):
+            yield {"bp": bp,
+                   "nucl": nucl,
+                   "upstream": upstream,
+                   "downstream": downstream,
+                   "member": ""}
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+
+class CtFolds(object):
+    """The folds of a .ct file held in arrays, as returned by
+       parse_ct_arrays(). Each row is a fold, each column a nucleotide.
+
+       energy -- float array, the free energy of each fold
+       nucl -- uint8 array, the nucleotide (as ord()) at each position
+       bp, upstream, downstream -- int32 arrays, the 5th, 3rd and 4th
+                                   columns of the .ct file (1-based, 0
+                                   for none)
+
+       folds[k] is the kth fold as a Fold (whose arrays are rows of
+       these), and folds() all of them.
+    """
+    def __init__(self, energy, nucl, bp, upstream, downstream):
+        self.energy = energy
+        self.nucl = nucl
+        self.bp = bp
+        self.upstream = upstream
+        self.downstream = downstream
+        self._sequence = None
+
+    def __len__(self):
+        return len(self.energy)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return Fold(float(self.energy[index]), self.sequence(),
+                    self.bp[index], self.upstream[index],
+                    self.downstream[index])
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def sequence(self):
+        """Return the sequence that was folded"""
+        if self._sequence is None:
+            if len(self) == 0:
+                self._sequence = ""
+            else:
+                self._sequence = ''.join([chr(c) for c in self.nucl[0]])
+        return self._sequence
+
+    def folds(self):
+        """Return every fold, a list of Fold"""
+        return list(self)
 
-    for line in ct_data:
-        if debug: print "line: %s" % line
-        line = line.strip()
-        dG_match = re.search(r'(\d*) .* (\W*\S*)', line)
-        if dG_match:
-            if debug: print "dg_match.group(1): %s, dg_match.group(2):%s" % (dG_match.group(1), dG_match.group(2))
-            # We are at a line that starts a folding
-            if fold:
-                # push the last fold onto folding
-                foldings.append({"energy":energy,
-                                 "seq":fold})
-
-            # initilize new folding.
-            fold = []
-            energy = float(dG_match.group(2))
-
-            # Number of nucleotides in this fold
-            # (this should be constant, but wtf)
-            n = dG_match.group(1)
-            
-            # Reset structure to be empty
-            structure = []
-            
-        elif line != "":
-            # Non-empty lines are part of this folding
-            cols = line.split()
 
-            fold.append({"bp": int(cols[4]),
-                         "nucl": cols[1],
-                         "upstream": int(cols[2]),
-                         "downstream": int(cols[3]),
-                         "member": ""})
+def parse_ct_arrays(ct_data, debug=False):
+    """Parse the folds in a .ct file from hybrid-ss-min into arrays
 
-    # Catch the tail end case: if we have a non-empty fold,
-    # append it to foldings.
-    if fold:
-        foldings.append({"energy":energy,
-                         "seq":fold,
-                         "type":""})
-    return foldings
+       The .ct file is as described in parse_ct(), every fold in it
+       must be of the same sequence (as for run_hybrid_ss_min(), or one
+       sequence of split_ct()).
+
+       Arguments:
+       ct_data -- the .ct file as a list of lines, or an open file
 
+       Returns:
+       CtFolds
+    """
+    headers = []
+    rows = []
+    for line in ct_data:
+        if "dG" in line:
+            headers.append(line)
+        elif line.strip():
+            rows.append(line)
+
+    if not headers:
+        empty = np.zeros((0, 0), dtype=np.int32)
+        return CtFolds(np.zeros(0), np.zeros((0, 0), dtype=np.uint8),
+                       empty, empty, empty)
+
+    energy = np.zeros(len(headers))
+    for (index, header) in enumerate(headers):
+        energy[index] = float(header.split("=", 1)[1].split()[0])
+
+    if len(rows) % len(headers) != 0:
+        raise UNAFoldError("parse_ct_arrays(): %d lines for %d folds, expected "
+                           "the same number for each fold" %
+                           (len(rows), len(headers)))
+    n = len(rows) // len(headers)
+    if debug: print "parse_ct_arrays(): %d folds of %d nucleotides" % (len(headers), n)
+
+    # Split every line at once, rather than line by line, then take
+    # each column as a slice
+    columns = len(rows[0].split())
+    fields = " ".join(rows).split()
+    if len(fields) != len(rows) * columns:
+        raise UNAFoldError("parse_ct_arrays(): lines do not all have %d columns" %
+                           columns)
+    shape = (len(headers), n)
+
+    def _column(index):
+        return np.array(fields[index::columns], dtype=np.int32).reshape(shape)
+
+    nucl = np.frombuffer(''.join(fields[1::columns]).encode("ascii"),
+                         dtype=np.uint8).reshape(shape)
+    return CtFolds(energy, nucl, _column(4), _column(2), _column(3))
+
+
+def fold_bp(fold):
+    """Return the bp column of a fold (a Fold, or a fold in the older
+       dictionary form) as an int array"""
+    if isinstance(fold, Fold):
+        return fold.bp
+    return np.array([element["bp"] for element in fold["seq"]], dtype=np.int32)
+
+def find_elements(fold, debug=False):
+    """Given a fold, find its stems, loops and tails
+
+       A stem is a run of nucleotides each paired to the one before
+       its predecessor's partner, that is a helix without bulges, and
+       is given once, from its 5' side (see find_stems()). Loops and
+       tails are runs of unpaired nucleotides, [start, end] (1-based,
+       inclusive), tails being those at either end of the sequence.
+
+       Arguments:
+       fold -- the fold to search
+
+       Returns:
+       (stems, loops, tails)
+       """
+    structure = Structure.of(fold)
+    (stems, loops, tails) = (structure.stems(),
+                             [list(run) for run in structure.loops],
+                             [list(run) for run in structure.tails])
+    if debug:
+        print("find_elements(): stems %s, loops %s, tails %s" %
+              (stems, loops, tails))
+    return (stems, loops, tails)
 
 def find_stems(fold, debug=False):
-    """Given a fold, look at each nucleotide and determine what
-       part of the structure it is a member of: Loop1, Loop2, Stem1,
-       etc.
+    """Given a fold, return its stems, see find_elements()
 
        Arguments:
        fold -- the fold to search for stems in
-       ignore_bulge -- boolean to select wether bulge loops are
-                       ignored in stems
 
        Returns: a list of stem dicts
        [
@@ -249,170 +897,41 @@ def find_stems(fold, debug=False):
        ]
 
        """
+    return find_elements(fold, debug)[0]
 
-    stems = []
-    loops = []
-    tails = []
 
-    n = 1
+def _helix(stem):
+    """Return a stem dict as a helix, (lh_start, lh_end, rh_start, rh_end)"""
+    return (stem["lh"]["start"], stem["lh"]["end"],
+            stem["rh"]["start"], stem["rh"]["end"])
 
-    lhstempointer_s = 0
-    rhstempointer_s = 0
-    lhstempointer_e = 0
-    rhstempointer_e = 0
-    loop_pointer_s = 0
-    loop_pointer_e = 0
-    counted = []
+def _stem(helix):
+    """Return a helix as a stem dict, see find_stems()"""
+    return {"lh": {"start": helix[0], "end": helix[1]},
+            "rh": {"start": helix[2], "end": helix[3]}}
 
-    for element in fold["seq"]:
-        if debug:
-            print("find_members(): looking at index %d the middle bp: %d and "
-                  "nucl: %s" % (n,element["bp"], element["nucl"]))
-
-        if element["bp"] != 0:
-            # members with bp that are non-zero are parts of a stack
-            if debug: print " find_members(): bp = %d != 0" % element["bp"]
-            if not lhstempointer_s:
-                # If lhstem
-                if debug:
-                    print("  find_members(): Found start of stem, but not "
-                          "currently in stem")
-
-                # If we were in a loop, then store it
-                if loop_pointer_s:
-                    if debug:
-                        print("   find_members(): We were in a loop, storing that "
-                              "loop, loop_s: %d, loop_e: %d" %
-                              (loop_pointer_s, loop_pointer_e))
-
-                    loops.append([loop_pointer_s, loop_pointer_e])
-                    loop_pointer_s = 0
-                    loop_pointer_e = 0
-                # If we have a loop end pointer, but no start pointer,
-                # then this was actually a tail, store it.
-                if loop_pointer_e and not loop_pointer_s:
-                    if debug:
-                        print("   find_members(): We have a loop end, but no "
-                              "start, storing as a tail")
-                    tails.append([loop_pointer_s, loop_pointer_e])
-                    loop_pointer_s = 0
-                    loop_pointer_e = 0
-
-                # Then start a new stem.
-                lhstempointer_s = n
-                lhstempointer_e = n
-                rhstempointer_s = element["bp"]
-                rhstempointer_e = element["bp"]
-
-                # Include n and the bp in counted so we don't double count
-                counted.append(n)
-                counted.append(element["bp"])
-            
-            elif lhstempointer_s and element["bp"] == prev - 1:
-                # We are currently in a stem *and* the bp is part of
-                # decrementing sequence with the previous stem element
-                if debug:
-                    print("  find_members(): Currently in stem, bp part "
-                          "of series")
-                lhstempointer_e = n
-                rhstempointer_e = element["bp"]
-                
-                counted.append(n)
-                counted.append(element["bp"])
-            else:
-                # Otherwise this must actually be a new stem
-                if debug:
-                    print("  find_members(): Part of a stem, but"
-                          "  bp != prev - 1. This is a new stem")
-                # Store the stem we were working on
-                stems.append({"lh":
-                              {"start":lhstempointer_s,
-                               "end":lhstempointer_e},
-                              "rh":
-                              {"start":rhstempointer_e,
-                               "end":rhstempointer_s}})
-                
-                # Start a new stem
-                lhstempointer_s = n 
-                rhstempointer_s = element["bp"]
-                lhstempointer_e = n 
-                rhstempointer_e = element["bp"]
-                counted.append(n)
-                counted.append(element["bp"])
-
-                if debug:
-                    print("  find_members(): lh_s %d, lh_e %d, "
-                          "rh_s %d, lh_s %d" %
-                          (lhstempointer_s,
-                           lhstempointer_e,
-                           rhstempointer_s,
-                           rhstempointer_e))
-        elif element["bp"] == 0:
-                if debug: print " find_members(): bp == 0, in a loop"
-                if lhstempointer_s:
-                    if debug:
-                        print("  find_members(): we were in a stem, "
-                              "now in a loop")
-                    # We were in a stem, but now we are in a loop, store the
-                    # stem
-                    stems.append({"lh":
-                                  {"start":lhstempointer_s,
-                                   "end":lhstempointer_e},
-                                  "rh":
-                                  {"start":rhstempointer_e,
-                                   "end":rhstempointer_s}})
-                    lhstempointer_s = 0
-                    rhstempointer_s = 0
-                    lhstempointer_e = 0
-                    rhstempointer_e = 0
-                    # And start a loop at this index
-                    if debug:
-                        print("  find_members(): appending empty list to "
-                              "new loop here")
-                    loop_pointer_s = n
-                    loop_pointer_e = n
-                    counted.append(n)
-                elif not lhstempointer_s:
-                    if debug:
-                        print("  find_members(): we were not in a stem, thus we were"
-                              " in a loop, still in the loop")
-                    # We were not in a stem, therefore we were in a loop,
-                    # count this as part of the existing loop
-                    loop_pointer_e = n
-                    counted.append(n)
-
-                    if debug:
-                        print("  find_members(): loop_s: %d loop_e: %d" %
-                              (loop_pointer_s, loop_pointer_e))
+def join_helices(helices, seq_length):
+    """Join each helix to the one before it wherever the two are
+       seperated by a bulge loop, see combine_stems()
 
-        if debug:
-            print(" find_members(): lh_s %d, lh_e %d, rh_s %d, rh_e %d, "
-                  "loop_s %d, loop_e %d" %
-                  (lhstempointer_s,
-                   lhstempointer_e,
-                   rhstempointer_s,
-                   rhstempointer_e,
-                   loop_pointer_s,
-                   loop_pointer_e))
-        counted.sort()
-        if debug: print " find_members(): counted %s" % str(counted)
-        if debug: print " find_members(): stems %s" % str(stems)
-        prev = element["bp"]
-        n += 1
-        if debug: print " find_members(): prev: %d" % prev
-    # If we were in a loop when we finished, then the loop was
-    # actually a tail
-    if loop_pointer_s:
-        tails.append([loop_pointer_s, loop_pointer_e])
-
-    # Sometimes a stem is inserted twice, remove these
-    seen = []
-    for stem in stems:
-        if (stem not in seen and
-            {"lh": stem["rh"],"rh": stem["lh"]} not in seen):
-            seen.append(stem)
-    return seen
+       Arguments:
+       helices -- (lh_start, lh_end, rh_start, rh_end) tuples, 5' to 3'
+       seq_length -- int containing the total length of the sequence
+
+       Returns:
+       A tuple of the helices once joined
+       """
+    # Bulge loops can contain no more than 20% of the total sequence
+    # lenght, if they do, then they aren't bulge loops.
+    max_bulge_length = seq_length * .20
 
+    joined = []
+    for helix in helices:
+        if joined and math.fabs(joined[-1][1] - helix[0]) < max_bulge_length:
+            joined[-1] = (joined[-1][0], helix[1], helix[2], joined[-1][3])
+        else:
+            joined.append(helix)
+    return tuple(joined)
 
 def combine_stems(left_stems, right_stems, seq_length, depth=0, debug=False):
     """If the folding has bulge loops, merge the stems seperated by bulge
@@ -420,58 +939,270 @@ def combine_stems(left_stems, right_stems, seq_length, depth=0, debug=False):
 
        Arguments:
        left_stems -- a list of stems, as described in find stems, that contains
-                     all of the lefmost stems (5' side). This is a recursive
-                     function, so it is first called with the first stem in
-                     left_stems 
+                     all of the lefmost stems (5' side). Only the last of
+                     these may be joined to right_stems.
        right_stems -- a list of stems, as described in find stems, that contains
-                     all of the rightmost stems (3' side). This is a recursive
-                     function, so it is first called with all the stems *except*
-                     the first one.
+                     all of the rightmost stems (3' side), each of which is
+                     joined to the stem before it if the two are seperated by
+                     less than 20% of the sequence.
        seq_length -- int containing the total length of the sequence.
-       
+
+       Returns:
+       A new list of stems, see join_helices()
        """
     if debug:
         print("combine_stems(%s, %s, %d, %d):" %
               (left_stems, right_stems, seq_length, depth))
 
-    # Bulge loops can contain no more than 20% of the total sequence
-    # lenght, if they do, then they aren't bulge loops.
-    max_bulge_length = seq_length * .20
-
     assert len(left_stems) > 0
 
-    if len(right_stems) > 0:
-        assert left_stems[-1]["lh"]["end"] < right_stems[0]["lh"]["start"]
+    stems = left_stems[-1:] + right_stems
+    for (stem, following) in zip(stems, stems[1:]):
+        assert stem["lh"]["end"] < following["lh"]["start"]
 
-    if len(right_stems) < 1:
-        # If we have no right_stems, then return left_stems, since there is
-        # nothing to join
-        if debug:
-            print " combine_stems(): %d depth, no more right stems" % depth
-        return left_stems
-    elif (math.fabs(left_stems[-1]["lh"]["end"] - right_stems[0]["lh"]["start"]) <
-          max_bulge_length):
-        # The length of this non-bound portion implies that this is a bulge loop
-        if debug:
-            print(" combine_stems(): %d depth, bulge loop, joining these stems\n"
-                  "                : 1st stem end of lh side %d, 2nd stem start of"
-                  " lh side %d" % (depth,
-                                   left_stems[-1]["lh"]["end"],
-                                   right_stems[0]["lh"]["start"]))
-        # Join across this non-bound portion
-        left_stems[-1]["lh"]["end"] = right_stems[0]["lh"]["end"]
-        left_stems[-1]["rh"]["start"] = right_stems[0]["rh"]["start"]
-        # Consider the next non-bound portion.
-        del right_stems[0]
-        return combine_stems(left_stems, right_stems, seq_length, depth + 1, debug)
-    else:
-        # This is a hairpin, don't join the two stems, but recursively
-        # consider the next unbound portion.
-        left_stems.append(right_stems[0])
-        del right_stems[0]
-        if debug:
-            print " combine_stems(): %d depth, not a bulge loop, not joining" % depth
-        return combine_stems(left_stems, right_stems, seq_length, depth + 1, debug)
+    joined = join_helices([_helix(stem) for stem in stems], seq_length)
+    if debug:
+        print(" combine_stems(): %d stems joined to %d" %
+              (len(stems), len(joined)))
+    return left_stems[:-1] + [_stem(helix) for helix in joined]
+
+
+class Structure(object):
+    """The secondary structure of a fold, broken down in one pass over
+       its base pairs
+
+       length -- the number of nucleotides
+       helices -- the stems of find_stems(), 5' to 3', each a tuple
+                  (lh_start, lh_end, rh_start, rh_end)
+       loops, tails -- the runs of unpaired nucleotides, each a tuple
+                       (start, end), tails being those at either end
+       hairpins, bulges, internal_loops, multi_loops -- the loops closed
+                       by each helix, as tuples (helix, runs) of the
+                       index of that helix and the unpaired runs in the
+                       loop
+       exterior -- the runs in no loop, other than the tails
+
+       All positions are 1-based and inclusive, as in a .ct file. A
+       Structure never changes, so what is derived from it (the helices
+       as fold_type() joins them, the fluorophore to quencher distance)
+       is kept once worked out.
+    """
+    __slots__ = ("_bp", "_helices", "_runs", "_kinds", "_bound", "_joined",
+                 "_distances")
+
+    def __init__(self, bp, helices=None):
+        """Arguments:
+           bp -- the bp column of a fold, see fold_bp()
+           helices -- the helices, if they are already known (see
+                      batch_structures())
+        """
+        self._bp = tuple(bp)
+        self._helices = None
+        self._runs = None
+        self._kinds = None
+        self._bound = None
+        self._joined = None
+        self._distances = {}
+        if helices is None:
+            self._walk()
+        else:
+            self._helices = tuple(helices)
+
+    @classmethod
+    def of(cls, fold):
+        """Return the Structure of a fold (a Fold, or a fold in the
+           older dictionary form)"""
+        if isinstance(fold, Fold):
+            return fold.structure()
+        return cls(fold_bp(fold).tolist())
+
+    def _walk(self):
+        bp = self._bp
+        n = len(bp)
+
+        # Walk the runs of paired and of unpaired nucleotides in one
+        # pass, a paired run is broken wherever a nucleotide doesn't
+        # stack on the one before it
+        helices = []
+        loops = []
+        tails = []
+        start = 0
+        for k in range(1, n + 1):
+            if not (k == n or (bp[k] == 0) != (bp[k - 1] == 0) or
+                    (bp[k] != 0 and bp[k] != bp[k - 1] - 1)):
+                continue
+            end = k - 1
+            if bp[start] == 0:
+                if start == 0 or end == n - 1:
+                    tails.append((start + 1, end + 1))
+                else:
+                    loops.append((start + 1, end + 1))
+            # Each helix is seen once from each side, keep the 5' one
+            elif bp[start] > start + 1 and end != n - 1:
+                helices.append((start + 1, end + 1, bp[end], bp[start]))
+            start = k
+
+        if self._helices is None:
+            self._helices = tuple(helices)
+        self._runs = (tuple(loops), tuple(tails))
+
+    def _inside(self, first, last):
+        """Return the unpaired runs and the number of helices branching
+           off between first and last"""
+        bp = self._bp
+        runs = []
+        branches = 0
+        k = first
+        while k <= last:
+            partner = bp[k - 1]
+            if partner == 0:
+                start = k
+                while k <= last and bp[k - 1] == 0:
+                    k += 1
+                runs.append((start, k - 1))
+            elif k < partner <= last:
+                branches += 1
+                k = partner + 1
+            else:
+                k += 1
+        return (tuple(runs), branches)
+
+    def _classify_loops(self):
+        if self._kinds is None:
+            kinds = {"hairpins": [], "bulges": [], "internal_loops": [],
+                     "multi_loops": []}
+            for (index, helix) in enumerate(self._helices):
+                (runs, branches) = self._inside(helix[1] + 1, helix[2] - 1)
+                if branches == 0:
+                    kind = "hairpins"
+                elif branches == 1 and len(runs) == 1:
+                    kind = "bulges"
+                elif branches == 1:
+                    kind = "internal_loops"
+                else:
+                    kind = "multi_loops"
+                kinds[kind].append((index, runs))
+            exterior = [run for run in self._inside(1, self.length)[0]
+                        if run not in self.tails]
+            self._kinds = dict([(kind, tuple(loops))
+                                for (kind, loops) in kinds.items()])
+            self._kinds["exterior"] = tuple(exterior)
+        return self._kinds
+
+    @property
+    def length(self):
+        return len(self._bp)
+
+    @property
+    def bp(self):
+        return self._bp
+
+    @property
+    def helices(self):
+        return self._helices
+
+    @property
+    def loops(self):
+        if self._runs is None:
+            self._walk()
+        return self._runs[0]
+
+    @property
+    def tails(self):
+        if self._runs is None:
+            self._walk()
+        return self._runs[1]
+
+    @property
+    def hairpins(self):
+        return self._classify_loops()["hairpins"]
+
+    @property
+    def bulges(self):
+        return self._classify_loops()["bulges"]
+
+    @property
+    def internal_loops(self):
+        return self._classify_loops()["internal_loops"]
+
+    @property
+    def multi_loops(self):
+        return self._classify_loops()["multi_loops"]
+
+    @property
+    def exterior(self):
+        return self._classify_loops()["exterior"]
+
+    def __eq__(self, other):
+        if not isinstance(other, Structure):
+            return NotImplemented
+        return self._bp == other._bp
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    def __hash__(self):
+        return hash(self._bp)
+
+    def __repr__(self):
+        return "Structure(%r)" % (self._helices,)
+
+    def stems(self):
+        """Return the helices as a new list of stem dicts, see
+           find_stems()"""
+        return [_stem(helix) for helix in self._helices]
+
+    def bound(self):
+        """Return the helices, with the first two joined if the tails
+           are bound in a stack, that is if there are two and the first
+           starts at the beginning with a bulge loop between the two"""
+        if self._bound is None:
+            helices = self._helices
+            if (len(helices) == 2 and helices[0][0] < 5 and
+                math.fabs(helices[0][1] - helices[1][0]) < 5):
+                helices = join_helices(helices, self.length)
+            self._bound = helices
+        return self._bound
+
+    def joined(self):
+        """Return bound() with every bulge loop joined, see
+           join_helices()"""
+        if self._joined is None:
+            self._joined = join_helices(self.bound(), self.length)
+        return self._joined
+
+    def signature(self, nucls):
+        """Return what the type of this fold, of the sequence nucls,
+           goes by past bound() as a tuple: the length of the sequence
+           and, for each helix of bound(), where its sides are and what
+           they are made of. Folds, of any sequence, with the same
+           signature are of the same type.
+           """
+        return (self.length,
+                tuple([helix + (nucls[helix[0] - 1:helix[1]],
+                                nucls[helix[2] - 1:helix[3]])
+                       for helix in self.bound()]))
+
+    def quencher_distance(self, quencher):
+        """Return the distance from the fluorophore to the quencher, if
+           bound() (or if there are more, joined()) has two helices,
+           otherwise None. See quencher_distance() and
+           fluorophore_distance()."""
+        if quencher not in self._distances:
+            helices = self.bound()
+            if len(helices) > 2:
+                helices = self.joined()
+            if len(helices) == 2:
+                stems = [_stem(helix) for helix in helices]
+                distance = (quencher_distance(stems[0], stems[1], quencher) +
+                            fluorophore_distance(stems[0]))
+            else:
+                distance = None
+            self._distances[quencher] = distance
+        return self._distances[quencher]
 
 
 def check_recognition_stem(stemlh, stemrh, recognition, debug=False):
@@ -487,47 +1218,21 @@ def check_recognition_stem(stemlh, stemrh, recognition, debug=False):
        Returns:
        float -- 0.0 - 1.0 that represents the percentage of the recognition
                 expressed as largest match divided by length of recognition
+                (taken from the first nucleotide of the recognition in the
+                stem)
        """
     if debug:
         print("check_recognition_stem(): looking for %s with len %d in %s and %s" %
               (''.join(recognition), len(recognition),''.join(stemlh), ''.join(stemrh)))
 
-    # Consider every possible subsequence in recognition by iterating
-    # combinatorically through every start index and then for each
-    # start index consider each possible length of subsequence from
-    # that start for a match in either the lefthand (5') side or
-    # righthand (3') side of the stem.
-    for start in range(len(recognition)):
-        endrng = range(start + 1, len(recognition) + 1)
-        endrng.reverse()
-        for end in endrng:
-            tomatch = recognition[start:end]
-            
-            if debug:
-                print(" check_recognition_stem(): tomatch = %s\n"
-                      "                         : lh %s, rh %s" %
-                      (''.join(tomatch), ''.join(stemlh), ''.join(stemrh)))
-                
-                print(" check_recognition_stem(): start %d , end %d" %
-                      (start, end))
-                print(" check_recognition_stem(): lh match %s" %
-                      util.match(stemlh, tomatch))
-                print(" check_recognition_stem(): rh match %s" %
-                      util.match(stemrh, tomatch))
-                
-            if(util.match(tuple(stemlh), tuple(tomatch)) or util.match(tuple(stemlh), tuple(tomatch[::-1])) or
-               util.match(tuple(stemrh), tuple(tomatch)) or util.match(tuple(stemrh), tuple(tomatch[::-1]))):
-                maxlength = float(len(recognition))
-                percent = float(end - start) / maxlength
-                if debug:
-                    print("check_recognition_stem(): found match at len %d,"
-                          "start %d, end %d, percent %f" %
-                          (len(recognition),start, end, percent))
-                return percent
-    else:
-        # No matches were found
-        if debug: print "check_recognition_stem(): no matches found"
-        return 0.0
+    # The first nucleotide of the recognition found in either side, then
+    # the longest piece of the recognition from there found forwards or
+    # reversed in either side, see util.RecognitionMatcher
+    percent = util.RecognitionMatcher.get(recognition).match(list(stemlh),
+                                                             list(stemrh))
+    if debug:
+        print("check_recognition_stem(): found %f of the recognition" % percent)
+    return percent
 
 def fluorophore_distance(stem1):
     """Returns distance from the fluorophore to the base
@@ -673,90 +1378,113 @@ def fold_type(fold, recognition, quencher, debug=False):
          2. None of the stems contain less than 50% of the recognition
             sequence expressed sequentially
     """
+    return structure_type(Structure.of(fold), fold_sequence(fold),
+                          recognition, quencher, debug=debug)
+
+
+def fold_sequence(fold):
+    """Return the sequence of a fold (a Fold, or a fold in the older
+       dictionary form) as a str"""
+    if isinstance(fold, Fold):
+        return fold.sequence
+    return ''.join([element["nucl"] for element in fold["seq"]])
+
+def structure_type(structure, nucls, recognition, quencher, matches=None,
+                   debug=False):
+    """Given the Structure of a fold, return its type as described in
+       fold_type()
+
+       Arguments:
+       structure -- a Structure
+       nucls -- a str of the sequence folded
+       recognition -- a list containing the recognition sequence
+       quencher -- an index to the location of the quencher
+       matches -- a dictionary {(stemlh, stemrh): percent} of
+                  check_recognition_stem() of the stems seen so far for
+                  this recognition, the sides of the stem given as str.
+                  Folds of a sequence share most of their stems, so
+                  classify_folds() passes the same one for all of them.
+
+       Returns:
+       str -- One of binding_on/nonbinding_off/binding_unknown/
+              nonbinding_unknown
+       """
+    if matches is None:
+        matches = {}
+
     if debug:
         # Define a pretty printer for the stems, if needed
-        def pretty_format_stems(stems):
+        def pretty_format_stems(helices):
             pretty = ""
-            for index,stem in enumerate(stems):
+            for index,helix in enumerate(helices):
                 pretty += (" Stem %d lh: %d,%d rh: %d,%d\n" %
-                           (index, stem["lh"]["start"], stem["lh"]["end"],
-                            stem["rh"]["start"], stem["rh"]["end"]))
+                           ((index,) + helix))
             return pretty
 
-    stems = find_stems(fold, False)
-
-    if (len(stems) == 2 and
-        stems[0]["lh"]["start"] < 5 and
-        math.fabs(stems[0]["lh"]["end"] -
-                  stems[1]["lh"]["start"]) < 5) :
-        # If there are two stems and the first stem starts
-        # at the beginning of the loop AND there is a bulge
-        # loop between stem1 and stem2, then the tails are
-        # bound in a stack. Join the two stems, prior to
-        # looking for recognition.
-        if debug:
-            print "fold_type(): tails are bound, combining"
-        stems = combine_stems(stems[:1], stems[1:],
-                              len(fold["seq"]), 0, debug)
+    # If there are two stems and the first stem starts at the
+    # beginning of the loop AND there is a bulge loop between stem1
+    # and stem2, then the tails are bound in a stack. The two stems are
+    # joined, prior to looking for recognition.
+    helices = structure.bound()
+    if debug and helices != structure.helices:
+        print "fold_type(): tails are bound, combining"
+
+    # Everything from here on depends only on these stems and what
+    # they are made of, so folds that look alike here are of one type
+    if type_cache is not None:
+        signature = structure.signature(nucls)
+        type = type_cache.get(signature, recognition, quencher)
+        if type is not None:
+            if debug:
+                print "fold_type(): %s from %s" % (type, type_cache)
+            return type
 
     # Find maximum percentage match for the recognition in all stems
     max_percent_match = 0.0
-    for stem in stems:
-        match_percent = check_recognition_stem([fold["seq"][n]["nucl"] for
-                                               n in range(stem["lh"]["start"] - 1,
-                                                          stem["lh"]["end"])],
-                                              [fold["seq"][n]["nucl"] for n in
-                                               range(stem["rh"]["start"] - 1,
-                                                     stem["rh"]["end"])],
-                                               recognition, debug)
+    for helix in helices:
+        stemlh = nucls[helix[0] - 1:helix[1]]
+        stemrh = nucls[helix[2] - 1:helix[3]]
+        if (stemlh, stemrh) in matches:
+            match_percent = matches[(stemlh, stemrh)]
+        else:
+            match_percent = check_recognition_stem(list(stemlh), list(stemrh),
+                                                   recognition, debug)
+            matches[(stemlh, stemrh)] = match_percent
         if match_percent >  max_percent_match:
             max_percent_match = match_percent
 
     if debug:
-        print("fold_type(): stems\n%s" % pretty_format_stems(stems))
+        print("fold_type(): stems\n%s" % pretty_format_stems(helices))
         print("fold_type(): max_percent_match %f , len(stems) %d" %
-              (max_percent_match, len(stems)))
+              (max_percent_match, len(helices)))
 
     if max_percent_match <= .5:
-        # Doesn't look like this will bind to the recognition
-        if len(stems) > 2:
-            # Attempt to remove bulge loops if we have more than
-            # two stems
-            if debug:
-                print("fold_type(): before joining\n%s" %
-                      pretty_format_stems(stems))
-            
-            stems = combine_stems(stems[:1], stems[1:],
-                                  len(fold["seq"]), 0, debug)
-            if debug:
-                print("fold_type(): after joining\n%s" %
-                      pretty_format_stems(stems))
-            
-        if len(stems) == 2:
-            # Now, if we have two stems, find distance between
-            # fluorophore and quencher, if possible
-            distance = (quencher_distance(stems[0], stems[1],
-                                          quencher, debug) +
-                        fluorophore_distance(stems[0]))
-
-            if distance < 4:
-                if debug:
-                    print("fold_type(): distance %d <4, valid nonbinding_off" % distance)
-                type = "nonbinding_off"
-            else:
-                if debug:
-                    print "fold_type(): distance %d, nonbinding_unknown" % distance
-                type = "nonbinding_unknown"
-        else:
+        # Doesn't look like this will bind to the recognition. If
+        # there are two stems (once any bulge loops are removed, when
+        # there are more than two) find the distance between
+        # fluorophore and quencher
+        if debug and len(helices) > 2:
+            print("fold_type(): before joining\n%s\n"
+                  "fold_type(): after joining\n%s" %
+                  (pretty_format_stems(helices),
+                   pretty_format_stems(structure.joined())))
+        distance = structure.quencher_distance(quencher)
+        if distance is None:
             # Not the right number of folds
             if debug: print "fold_type(): too many stems, nonbinding_unknown"
             type = "nonbinding_unknown"
+        elif distance < 4:
+            if debug:
+                print("fold_type(): distance %d <4, valid nonbinding_off" % distance)
+            type = "nonbinding_off"
+        else:
+            if debug:
+                print "fold_type(): distance %d, nonbinding_unknown" % distance
+            type = "nonbinding_unknown"
     elif max_percent_match == 1.0:
         # some sort of binding structure
         # Attempt to remove any bulge loops
-        stems = combine_stems(stems[:1], stems[1:],
-                              len(fold["seq"]), 0, debug)
-        if len(stems) == 1:
+        if len(structure.joined()) == 1:
             type = "binding_on"
         else:
             type = "binding_unknown"
@@ -764,62 +1492,390 @@ def fold_type(fold, recognition, quencher, debug=False):
         # Structures with between 50% and 100% of the recognition
         # may or may not bind to the TF.
         type = "binding_unknown"
+
+    if type_cache is not None:
+        type_cache.put(signature, recognition, quencher, type)
     return type
 
 
-def score_sensor(sensor, folds):
+class TypeCache(object):
+    def __init__(self, recognition, maxsize=4096):
+        """An in memory cache of the types of folds, by the
+           Structure.signature() of each, for searches of recognition
+           The same suboptimal structures turn up again and again in a
+           search, in the folds of one sensor after another. Only the
+           maxsize most recently used types are kept.
+
+           Arguments:
+           recognition -- the recognition sequence searched for
+           maxsize -- the most types to keep
+        """
+        self.recognition = tuple(recognition)
+        self.maxsize = maxsize
+        self.types = collections.OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, signature, recognition, quencher):
+        """Return the type of folds with signature, or None if it is
+           not in the cache"""
+        key = (signature, tuple(recognition), quencher)
+        if key not in self.types:
+            self.misses += 1
+            return None
+        type = self.types.pop(key)
+        self.types[key] = type
+        self.hits += 1
+        return type
+
+    def put(self, signature, recognition, quencher, type):
+        """Store the type of folds with signature"""
+        self.types[(signature, tuple(recognition), quencher)] = type
+        while len(self.types) > self.maxsize:
+            self.types.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        """Return a dictionary of hits, misses, evictions, size and
+           hit_rate"""
+        lookups = self.hits + self.misses
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self.types),
+                "hit_rate": float(self.hits) / lookups if lookups else 0.0}
+
+    def __str__(self):
+        return ("TypeCache(%s): %d hits, %d misses (%.1f%% hit), "
+                "%d evictions, %d types" %
+                (''.join(self.recognition), self.hits, self.misses,
+                 100 * self.stats()["hit_rate"], self.evictions,
+                 len(self.types)))
+
+
+# An optional TypeCache that fold_type() and classify_folds() read
+# through, see use_type_cache()
+type_cache = None
+type_cache_size = 4096
+
+def use_type_cache(recognition, keep=True):
+    """Set type_cache to a TypeCache for searches of recognition and
+       return it
+
+       Arguments:
+       recognition -- the recognition sequence searched for
+       keep -- if True, and type_cache is already for recognition, it is
+               kept, so that one search reuses what the last found.
+               Otherwise a new one is started.
+       """
+    global type_cache
+    if (not keep or type_cache is None or
+        type_cache.recognition != tuple(recognition)):
+        type_cache = TypeCache(recognition, type_cache_size)
+    return type_cache
+
+
+def batch_structures(bp):
+    """Find the Structure of many folds of the same length at once
+
+       Arguments:
+       bp -- an int array, one row for each fold, holding the bp column
+             of that fold (see fold_bp())
+
+       Returns:
+       A list with the Structure of each fold
+       """
+    folds, n = bp.shape
+    helices = [[] for fold in range(folds)]
+    if n > 0:
+        paired = bp != 0
+
+        # A helix is a run of paired nucleotides, each stacking on the
+        # one before it (see Structure). Runs start and end in the same
+        # order, so the kth start of a fold goes with its kth end.
+        stacks = paired[:, 1:] & paired[:, :-1] & (np.diff(bp, axis=1) == -1)
+        starts = paired.copy()
+        starts[:, 1:] &= ~stacks
+        ends = paired.copy()
+        ends[:, :-1] &= ~stacks
+        (start_fold, start) = np.nonzero(starts)
+        (end_fold, end) = np.nonzero(ends)
+
+        # Keep each helix once, from its 5' side
+        lh_start = start + 1
+        rh_end = bp[start_fold, start]
+        rh_start = bp[end_fold, end]
+        keep = (rh_end > lh_start) & (end != n - 1)
+
+        for (fold, helix) in zip(start_fold[keep].tolist(),
+                                 zip(lh_start[keep].tolist(),
+                                     (end + 1)[keep].tolist(),
+                                     rh_start[keep].tolist(),
+                                     rh_end[keep].tolist())):
+            helices[fold].append(helix)
+
+    return [Structure(row, fold_helices)
+            for (row, fold_helices) in zip(bp.tolist(), helices)]
+
+def classify_folds(folds, recognition, quencher, debug=False):
+    """Return fold_type() of every fold of a sensor, each of which is
+       also kept as the type of that fold
+
+       Rather than going fold by fold, the structures of all the folds
+       are found at once (see batch_structures()), and the recognition
+       is only looked for once in each distinct stem.
+
+       Arguments:
+       folds -- a list of Fold as returned by parse_ct (or of folds in
+                the older dictionary form)
+       recognition -- a list containing the recognition sequence
+       quencher -- an index to the location of the quencher
+
+       Returns:
+       A list with the type of each fold
+       """
+    key = (tuple(recognition), quencher)
+    types = [None] * len(folds)
+
+    # Folds already classified for this recognition and quencher are
+    # left as they are, as are the structures already found. The rest
+    # are grouped by length to be stacked.
+    structures = [None] * len(folds)
+    lengths = {}
+    for (index, fold) in enumerate(folds):
+        if isinstance(fold, Fold) and fold._classified == key:
+            types[index] = fold.type
+        elif isinstance(fold, Fold) and fold._structure is not None:
+            structures[index] = fold._structure
+        else:
+            lengths.setdefault(len(fold["seq"]), []).append(index)
+
+    for indexes in lengths.values():
+        bp = np.vstack([fold_bp(folds[index]) for index in indexes])
+        for (index, structure) in zip(indexes, batch_structures(bp)):
+            structures[index] = structure
+            if isinstance(folds[index], Fold):
+                folds[index]._structure = structure
+
+    matches = {}
+    for (index, fold) in enumerate(folds):
+        if types[index] is not None:
+            continue
+        types[index] = structure_type(structures[index], fold_sequence(fold),
+                                      recognition, quencher, matches, debug)
+        fold["type"] = types[index]
+        if isinstance(fold, Fold):
+            fold._classified = key
+
+    if debug:
+        print("classify_folds(): %d folds, %d distinct stems" %
+              (len(folds), len(matches)))
+    return types
+
+
+# The types of fold_type(), in the order score_sensors() works through
+# them
+fold_types = ["binding_on", "nonbinding_off", "binding_unknown",
+              "nonbinding_unknown"]
+
+def score_sensor(sensor, folds, context=None):
     """Return the scores for a folded sensor
 
        Arguments:
        sensor -- util.Sensor
-       folds -- a folds dict as returned by parse_ct
+       folds -- a list of Fold as returned by parse_ct (or of folds
+                in the older dictionary form)
+       context -- a util.SearchContext, if given folds are only
+                  classified until the rest cannot change whether the
+                  sensor is valid, see settle_sensor()
        
        Returns:
        dictionary = { fold_type: 'percent', ... }
        """
+    if context is not None:
+        return settle_sensor(sensor, folds, context.bindingratiorange,
+                             context.maxunknownpercent)
+    return score_sensors([sensor], [folds])[0]
+
+def score_sensors(sensors, folds):
+    """Return the scores of many folded sensors, see score_sensor()
+
+       Every fold is classified (see classify_folds()) and given its
+       percent_in_solution, its Boltzmann weight, e^(|dG|/RT), over
+       that of all the folds of its sensor. The weights are worked out
+       relative to the largest of each sensor, so that they cannot
+       overflow, and the folds of every sensor are then totalled by
+       type in one go.
+
+       Arguments:
+       sensors -- a list of util.Sensor
+       folds -- for each sensor, its list of folds
+
+       Returns:
+       A list with the scores of each sensor
+       """
+    sensor_of = []
+    type_of = []
+    energies = []
+    for (index, (sensor, sensor_folds)) in enumerate(zip(sensors, folds)):
+        types = classify_folds(sensor_folds, sensor.Recognition,
+                               sensor.QuencherIndex())
+        sensor_of.extend([index] * len(sensor_folds))
+        type_of.extend([fold_types.index(type) for type in types])
+        energies.extend([fold["energy"] for fold in sensor_folds])
+
+    sensor_of = np.array(sensor_of, dtype=np.intp)
+    type_of = np.array(type_of, dtype=np.intp)
+    log_weights = np.abs(np.array(energies, dtype=float)) / RT
+
+    # log-sum-exp: e^(w - max) / sum(e^(w - max)) for each sensor
+    largest = np.full(len(sensors), -np.inf)
+    np.maximum.at(largest, sensor_of, log_weights)
+    weights = np.exp(log_weights - largest[sensor_of])
+    totals = np.bincount(sensor_of, weights=weights, minlength=len(sensors))
+    percents = weights / totals[sensor_of]
+
+    percent_in_solution = iter(percents.tolist())
+    for sensor_folds in folds:
+        for fold in sensor_folds:
+            fold["percent_in_solution"] = next(percent_in_solution)
+
+    # Total and count the folds of each sensor by type at once
+    group = sensor_of * len(fold_types) + type_of
+    size = len(sensors) * len(fold_types)
+    percent = np.bincount(group, weights=percents,
+                          minlength=size).reshape(len(sensors), -1).tolist()
+    num = np.bincount(group, minlength=size).reshape(len(sensors), -1).tolist()
+
+    return [dict([(type, {"percent": percent[index][column],
+                          "num": num[index][column]})
+                  for (column, type) in enumerate(fold_types)])
+            for index in range(len(sensors))]
+
+# settle_sensor() classifies folds one at first, then twice as many
+# each time, up to this many at a time
+classify_batch = 16
+
+# The share of the Boltzmann weight of a sensor settle_sensor() classifies
+# at most, the rest being negligible. At 1.0 it only stops once the folds
+# left cannot change whether the sensor is valid.
+classified_weight = 1.0
+
+def validity_settled(percents, remaining, bindingratiorange,
+                     maxunknownpercent):
+    """Return True if the folds of a sensor not yet classified cannot
+       change whether validate_sensor() finds it valid, whatever their
+       types
+
+       Arguments:
+       percents -- a dictionary of the percent in solution of the folds
+                   classified so far, by type
+       remaining -- the percent in solution of the rest
+       bindingratiorange, maxunknownpercent -- see validate_sensor()
+       """
+    if remaining <= 0:
+        return True
 
-    # e^(|dG|/RT)
-    total = sum([ math.exp(math.fabs(fold["energy"])/2.47) for fold in folds])
-
-    for fold in folds:
-        fold["type"] = fold_type(fold, sensor.Recognition, sensor.QuencherIndex())
-        fold["percent_in_solution"] = math.exp(math.fabs(fold["energy"])/2.47) / total
-
-    scores = { "binding_on": { "percent": sum([fold["percent_in_solution"]
-                                               for fold in folds
-                                               if fold["type"] == 'binding_on']),
-                               "num": len([fold for fold in folds
-                                           if fold["type"] == 'binding_on'])},
-               "nonbinding_off": {"percent": sum([fold["percent_in_solution"]
-                                               for fold in folds
-                                               if fold["type"] == 'nonbinding_off']),
-                               "num": len([fold["percent_in_solution"]
-                                           for fold in folds
-                                           if fold["type"] == 'nonbinding_off'])},
-               "binding_unknown": {"percent": sum([fold["percent_in_solution"]
-                                                   for fold in folds
-                                                   if fold["type"] == 'binding_unknown']),
-                                   "num":len([fold["percent_in_solution"]
-                                              for fold in folds
-                                              if fold["type"] == 'binding_unknown'])},
-               "nonbinding_unknown": {"percent": sum([fold["percent_in_solution"]
-                                                      for fold in folds
-                                                      if fold["type"] == 'nonbinding_unknown']),
-                                      "num": len([fold["percent_in_solution"]
-                                                  for fold in folds
-                                                  if fold["type"] == 'badnonbind'])}
-               }
+    unknown = percents["binding_unknown"] + percents["nonbinding_unknown"]
+    if unknown >= maxunknownpercent:
+        return True
+    unknown_passes = unknown + remaining < maxunknownpercent
+
+    # The rest could all go to either side of the ratio
+    (on, off) = (percents["binding_on"], percents["nonbinding_off"])
+    lowest = on / (off + remaining)
+    if off > 0:
+        highest = (on + remaining) / off
+    else:
+        highest = float("inf")
+    (lo, hi) = bindingratiorange
+    if highest <= lo or lowest >= hi:
+        return True
+    return unknown_passes and lo < lowest and highest < hi
+
+def settle_sensor(sensor, folds, bindingratiorange=(.9,1.1),
+                  maxunknownpercent=.2, cutoff=None):
+    """Return the scores of a folded sensor, see score_sensor(),
+       classifying its folds only as far as needed to tell whether it
+       is valid
+
+       Every fold is given its percent_in_solution, but folds are
+       classified from the heaviest down, in batches growing up to
+       classify_batch, and only until the rest cannot change whether the sensor is valid
+       (see validity_settled()) or until cutoff of the weight has been
+       classified. What is left is scored as "unclassified", and those
+       folds are not given a type. validate_sensor() finds the scores
+       valid only if the sensor, with all its folds classified, is.
 
+       Arguments:
+       sensor -- util.Sensor
+       folds -- a list of Fold as returned by parse_ct (or of folds
+                in the older dictionary form)
+       bindingratiorange, maxunknownpercent -- see validate_sensor()
+       cutoff -- the share of the weight to classify at most, by
+                 default classified_weight
+
+       Returns:
+       the scores of score_sensor(), and under "unclassified" the
+       percent and number of the folds left unclassified
+       """
+    if cutoff is None:
+        cutoff = classified_weight
+
+    scores = dict([(type, {"percent": 0.0, "num": 0})
+                   for type in fold_types + ["unclassified"]])
+    if not folds:
+        return scores
+
+    log_weights = np.abs(np.array([fold["energy"] for fold in folds],
+                                  dtype=float)) / RT
+    weights = np.exp(log_weights - log_weights.max())
+    percents = weights / weights.sum()
+    for (fold, percent) in zip(folds, percents.tolist()):
+        fold["percent_in_solution"] = percent
+
+    # Heaviest first; remaining[k] is the percent of all but the first
+    # k of them
+    order = np.argsort(-percents, kind="mergesort")
+    remaining = np.append(np.cumsum(percents[order][::-1])[::-1], 0.0).tolist()
+    order = order.tolist()
+    percents = percents.tolist()
+
+    classified = dict([(type, 0.0) for type in fold_types])
+    done = 0
+    batch = 1
+    while done < len(folds):
+        if ((cutoff < 1.0 and 1.0 - remaining[done] >= cutoff) or
+            validity_settled(classified, remaining[done], bindingratiorange,
+                             maxunknownpercent)):
+            break
+        indexes = order[done:done + batch]
+        types = classify_folds([folds[index] for index in indexes],
+                               sensor.Recognition, sensor.QuencherIndex())
+        for (index, type) in zip(indexes, types):
+            classified[type] += percents[index]
+            scores[type]["num"] += 1
+        done += len(indexes)
+        batch = min(batch * 2, classify_batch)
+
+    for type in fold_types:
+        scores[type]["percent"] = classified[type]
+    scores["unclassified"] = {"percent": remaining[done],
+                              "num": len(folds) - done}
     return scores
 
 def validate_sensor(sensor, scores, folds, bindingratiorange=(.9,1.1),
-                    maxunknownpercent=.2, numfoldrange=None, maxenergy=None):
+                    maxunknownpercent=.2, numfoldrange=None, maxenergy=None,
+                    context=None):
     """
     Determines if a given sensor is a valid solution
 
     Arguments:
     sensor -- a util.Sensor
-    scores -- as returned by unafold.score_sensor
+    scores -- as returned by unafold.score_sensor, or None to score the
+              folds here
     folds -- as returned by unafold.parse_ct
     bindingratiorange  -- A tuple containing the min and max of the ratio of
                           binding folds to non-binding folds as determined by
@@ -836,10 +1892,24 @@ def validate_sensor(sensor, scores, folds, bindingratiorange=(.9,1.1),
                  minimal energy by the quantity maxenergy, then it is not
                  a valid solution. A Value of None implies that there is no
                  upper limit.
+    context -- a util.SearchContext for the search sensor was found in,
+               if given its thresholds (and recognition energy) are used
+               in place of the ones above
 
     Returns:
     boolean -- True if sensor is valid"""
 
+    if context is not None:
+        bindingratiorange = context.bindingratiorange
+        maxunknownpercent = context.maxunknownpercent
+        numfoldrange = context.numfoldrange
+        maxenergy = context.maxenergy
+
+    if scores is None:
+        scores = score_sensor(sensor, folds, context)
+
+    # Only build the messages below if they will be logged
+    debug = logger.isEnabledFor(logging.DEBUG)
 
     # Set reasonable default if none are specified
     if not bindingratiorange[0] or not bindingratiorange[1]:
@@ -848,45 +1918,50 @@ def validate_sensor(sensor, scores, folds, bindingratiorange=(.9,1.1),
     # Verify that the number of folds is within the range specified
     if numfoldrange and numfoldrange[0] and numfoldrange[1]:
         if numfoldrange[0] <= len(folds) <= numfoldrange[1]:
-            logger.debug("unafold.validate_sensor(%s): GOOD -- %d folds within %d to %d" %
-                         (str(sensor), len(folds), numfoldrange[0], numfoldrange[1]))
+            if debug:
+                logger.debug("unafold.validate_sensor(%s): GOOD -- %d folds within %d to %d" %
+                             (str(sensor), len(folds), numfoldrange[0], numfoldrange[1]))
             numfoldtest = True
         else:
-            logger.debug("unafold.validate_sensor(%s): BAD -- %d folds not within %d to %d" %
-                         (str(sensor), len(folds), numfoldrange[0], numfoldrange[1]))
+            if debug:
+                logger.debug("unafold.validate_sensor(%s): BAD -- %d folds not within %d to %d" %
+                             (str(sensor), len(folds), numfoldrange[0], numfoldrange[1]))
             numfoldtest = False
     else:
-        logger.debug("unafold.validate_sensor(%s): NA -- num folds not specified" %
-                     str(sensor))
+        if debug:
+            logger.debug("unafold.validate_sensor(%s): NA -- num folds not specified" %
+                         str(sensor))
         numfoldtest = True
         
     # Verify that the fold with the highest free energy does not exceed the
     # free energy released by the binding of the recognition by the quantity
     # maxenergy.
-    #
-    # Recall that energies are thermodynamic flows, thus energy out of the
-    # system is negative, hence the reversal of less/more than
     highest_energy = min([fold["energy"] for fold in folds])
 
     if maxenergy:
-        if sensor.RecognitionEnergy() + maxenergy <= highest_energy:
-            logger.debug("unafold.validate_sensor(%s): GOOD -- highest fold "
-                         "free energy, %f does not exceed max of %f" %
-                         (str(sensor),
-                          highest_energy,
-                          sensor.RecognitionEnergy() + maxenergy))
+        if context is not None:
+            limit = context.energy_limit
+        else:
+            limit = sensor.RecognitionEnergy() + maxenergy
+        # Recall that energies are thermodynamic flows, thus energy out
+        # of the system is negative, hence the reversal of less/more than
+        if limit <= highest_energy:
+            if debug:
+                logger.debug("unafold.validate_sensor(%s): GOOD -- highest fold "
+                             "free energy, %f does not exceed max of %f" %
+                             (str(sensor), highest_energy, limit))
             maxenergytest = True
         else:
-            logger.debug("unafold.validate_sensor(%s): BAD -- highest fold "
-                         "free energy,%f exceeds max of %f" %
-                         (str(sensor),
-                          highest_energy,
-                          sensor.RecognitionEnergy() + maxenergy))
+            if debug:
+                logger.debug("unafold.validate_sensor(%s): BAD -- highest fold "
+                             "free energy,%f exceeds max of %f" %
+                             (str(sensor), highest_energy, limit))
             maxenergytest = False
     else:
-        logger.debug("unafold.validate_sensor(%s): NA -- highest fold free "
-                     "energy not specified." %
-                     (str(sensor)))
+        if debug:
+            logger.debug("unafold.validate_sensor(%s): NA -- highest fold free "
+                         "energy not specified." %
+                         (str(sensor)))
         maxenergytest = True
 
     # Verify that the ratio of binding_on and nonbinding_off sensors
@@ -897,18 +1972,20 @@ def validate_sensor(sensor, scores, folds, bindingratiorange=(.9,1.1),
     else:
         ratio = 0
     if(bindingratiorange[0] < ratio < bindingratiorange[1]):
-        logger.debug("unafold.validate_sensor(%s): GOOD -- binding ratio"
-                     "(%f vs %f) in range %f < %f < %f" %
-                     (str(sensor), scores["binding_on"]["percent"],
-                      scores["nonbinding_off"]["percent"],
-                      bindingratiorange[0], ratio, bindingratiorange[1]))
+        if debug:
+            logger.debug("unafold.validate_sensor(%s): GOOD -- binding ratio"
+                         "(%f vs %f) in range %f < %f < %f" %
+                         (str(sensor), scores["binding_on"]["percent"],
+                          scores["nonbinding_off"]["percent"],
+                          bindingratiorange[0], ratio, bindingratiorange[1]))
         bindingtest = True
     else:
-        logger.debug("unafold.validate_sensor(%s): BAD -- binding ratio "
-                    "(%f vs %f) out of range %f < %f < %f" %
-                     (str(sensor), scores["binding_on"]["percent"],
-                      scores["nonbinding_off"]["percent"],
-                      bindingratiorange[0], ratio, bindingratiorange[1]))
+        if debug:
+            logger.debug("unafold.validate_sensor(%s): BAD -- binding ratio "
+                         "(%f vs %f) out of range %f < %f < %f" %
+                         (str(sensor), scores["binding_on"]["percent"],
+                          scores["nonbinding_off"]["percent"],
+                          bindingratiorange[0], ratio, bindingratiorange[1]))
         bindingtest = False
 
     # Verify that the percentage of folds that the signaling behavior is
@@ -916,12 +1993,14 @@ def validate_sensor(sensor, scores, folds, bindingratiorange=(.9,1.1),
     unknown = (scores["binding_unknown"]["percent"] +
                scores["nonbinding_unknown"]["percent"])
     if (unknown < maxunknownpercent):
-        logger.debug("unafold.validate_sensor(%s): GOOD -- unknown percentage, %f, below max %f" %
-                     (str(sensor), unknown, maxunknownpercent))
+        if debug:
+            logger.debug("unafold.validate_sensor(%s): GOOD -- unknown percentage, %f, below max %f" %
+                         (str(sensor), unknown, maxunknownpercent))
         unknowntest = True
     else:
-        logger.debug("unafold.validate_sensor(%s): BAD-- unknown percentage, %f, exceeds max %f" %
-                     (str(sensor), unknown, maxunknownpercent))
+        if debug:
+            logger.debug("unafold.validate_sensor(%s): BAD-- unknown percentage, %f, exceeds max %f" %
+                         (str(sensor), unknown, maxunknownpercent))
         unknowntest = False
         
 
@@ -929,10 +2008,89 @@ def validate_sensor(sensor, scores, folds, bindingratiorange=(.9,1.1),
        unknowntest and
        numfoldtest and
        maxenergytest):
-        logger.debug("unafold.validate_sensor(%s): found valid solution" %
-                     (sensor))
+        if debug:
+            logger.debug("unafold.validate_sensor(%s): found valid solution" %
+                         (sensor))
         return True
     else:
-        logger.debug("unafold.validate_sensor(%s): found invalid solution" %
-                     (sensor))
+        if debug:
+            logger.debug("unafold.validate_sensor(%s): found invalid solution" %
+                         (sensor))
         return False
+
+def solution_distance(scores, bindingratiorange=(.9,1.1),
+                      maxunknownpercent=.2):
+    """Return how far scores are from those of a valid solution (see
+       validate_sensor()), 0.0 if their binding ratio is within range
+       and their unknown percentage below the maximum
+
+       The distance is the factor, as a natural log, by which the
+       binding ratio is out of range plus the percentage by which the
+       unknown folds exceed their maximum. Scores from settle_sensor()
+       only bound these, the folds left unclassified could be of any
+       type, so the middle of each bound is taken.
+
+       Arguments:
+       scores -- as returned by unafold.score_sensor or settle_sensor
+       bindingratiorange, maxunknownpercent -- see validate_sensor()
+
+       Returns:
+       float -- the distance, inf if there are no binding_on or
+                nonbinding_off folds at all
+       """
+    (on, off) = (scores["binding_on"]["percent"],
+                 scores["nonbinding_off"]["percent"])
+    unclassified = scores.get("unclassified", {"percent": 0.0})["percent"]
+    (lo, hi) = bindingratiorange
+    if off > 0:
+        ratio = (on / (off + unclassified) + (on + unclassified) / off) / 2
+    elif on > 0 and unclassified > 0:
+        # The ratio is only bounded from below
+        ratio = on / unclassified
+    else:
+        return float("inf")
+    if ratio <= 0:
+        return float("inf")
+    if ratio <= lo:
+        distance = math.log(lo / ratio)
+    elif ratio >= hi:
+        distance = math.log(ratio / hi)
+    else:
+        distance = 0.0
+
+    unknown = (scores["binding_unknown"]["percent"] +
+               scores["nonbinding_unknown"]["percent"] + unclassified / 2)
+    return distance + max(0.0, unknown - maxunknownpercent)
+
+def evaluate_sensor(sensor, folds, context):
+    """Return the scores of a folded sensor if it is a valid solution
+       (see validate_sensor()), or None, checking the cheapest
+       constraints first
+
+       The number of folds and the highest free energy of any fold need
+       nothing but the folds, so a sensor failing either is turned down
+       before any fold is classified. Only then are the folds scored,
+       as far as it takes to settle the binding ratio and the unknown
+       percentage (see settle_sensor()).
+
+       Arguments:
+       sensor -- a util.Sensor
+       folds -- as returned by unafold.parse_ct
+       context -- the util.SearchContext of the search
+
+       Returns:
+       the scores of sensor, see score_sensor(), or None
+       """
+    numfoldrange = context.numfoldrange
+    if (numfoldrange and numfoldrange[0] and numfoldrange[1] and
+        not numfoldrange[0] <= len(folds) <= numfoldrange[1]):
+        return None
+
+    if (context.energy_limit is not None and
+        not context.within_maxenergy(min([fold["energy"] for fold in folds]))):
+        return None
+
+    scores = score_sensor(sensor, folds, context)
+    if not validate_sensor(sensor, scores, folds, context=context):
+        return None
+    return scores
@@ -1,3 +1,4 @@
+import copy
 import logging
 import multiprocessing
 import os
@@ -23,8 +24,9 @@ def complement(seq):
     Returns:
     list of nucleotides"""
 
-    pair = {'G': 'C', 'C': 'G','A': 'T','T': 'A'}
-    return [pair[nucl] for nucl in seq]
+    return [pairs[nucl] for nucl in seq]
+
+pairs = {'G': 'C', 'C': 'G','A': 'T','T': 'A'}
 
 def match(seql, tomatch):
     """Given a sequence and subsequence, return a list of indexes, where
@@ -50,11 +52,109 @@ def match(seql, tomatch):
     matches = [x for x in range(len(seql)) if seql[x:(x + len(tomatch))] == tomatch]
     return matches
 
+class RecognitionMatcher(object):
+    """Finds how much of a recognition sequence a stem holds, as
+       unafold.check_recognition_stem() does, in time linear in the
+       length of the stem.
+
+       check_recognition_stem() takes the first nucleotide of the
+       recognition that appears in either side of the stem at all, and
+       then the longest piece of the recognition starting there that
+       appears, forwards or reversed, in either side. The KMP failure
+       function of every suffix of the recognition is worked out once
+       here, so that piece is found with one scan of each side.
+
+       Arguments:
+       recognition -- list (or str) of nucleotides
+
+       Example
+
+       >>> RecognitionMatcher('GCCG').match(list('TTGCC'), list('AAA'))
+       0.75
+    """
+    def __init__(self, recognition):
+        self.recognition = list(recognition)
+        self.failures = [self._failure(self.recognition[start:])
+                         for start in range(len(self.recognition))]
+
+    @staticmethod
+    def _failure(pattern):
+        failure = [0] * len(pattern)
+        k = 0
+        for q in range(1, len(pattern)):
+            while k > 0 and pattern[k] != pattern[q]:
+                k = failure[k - 1]
+            if pattern[k] == pattern[q]:
+                k += 1
+            failure[q] = k
+        return failure
+
+    def _longest(self, start, text):
+        """Return the length of the longest prefix of recognition[start:]
+           that is a substring of text"""
+        pattern = self.recognition[start:]
+        failure = self.failures[start]
+        longest = 0
+        q = 0
+        for nucl in text:
+            while q > 0 and (q == len(pattern) or pattern[q] != nucl):
+                q = failure[q - 1]
+            if pattern[q] == nucl:
+                q += 1
+            if q > longest:
+                longest = q
+                if longest == len(pattern):
+                    break
+        return longest
+
+    def match(self, stemlh, stemrh):
+        """Return the fraction of the recognition found in the stem,
+           exactly as unafold.check_recognition_stem()
+
+           Arguments:
+           stemlh, stemrh -- the nucleotides of the two sides of the stem
+        """
+        present = set(stemlh) | set(stemrh)
+        for start in range(len(self.recognition)):
+            if self.recognition[start] in present:
+                break
+        else:
+            return 0.0
+
+        # A reversed piece of the recognition in a side is a forward
+        # piece of it in that side reversed
+        longest = max([self._longest(start, text) for text in
+                       [stemlh, stemlh[::-1], stemrh, stemrh[::-1]]])
+        return float(longest) / float(len(self.recognition))
+
+    _matchers = {}
+
+    @classmethod
+    def get(cls, recognition):
+        """Return the (shared) RecognitionMatcher of recognition"""
+        key = tuple(recognition)
+        matcher = cls._matchers.get(key)
+        if matcher is None:
+            if len(cls._matchers) >= 64:
+                cls._matchers.clear()
+            matcher = cls._matchers[key] = cls(recognition)
+        return matcher
+
 class Sensor:
     """Contains the DNA string for a sensor, as well as all
     structural elements associated with it, e.g. the location of
     stems, loops, flurophore, etc."""
 
+    # The running sums of _FreeEnergy() over each stem as PushGuess()
+    # grows it, [0, first term, first two terms, ...], None until then
+    _partials = None
+
+    # The stem each guess PushGuess() has inserted went in to, 0 for
+    # Stem1 or 1 for Stem2, in order, so that PopGuess() takes it back
+    # out of the same one. None until the first, and again once a stem
+    # is set.
+    _pushed = None
+
     def __init__(self, recog):
         # Internally, this will be stored as a list
         # Initialize with recognition and set recognition response
@@ -70,13 +170,56 @@ class Sensor:
     def SetStem1(self, stem1):
         self.Stem1 = list(stem1)
         self.Stem1R = complement(self.Stem1)[::-1]
+        self._partials = None
+        self._pushed = None
         return True
 
     def SetStem2(self, stem2):
         self.Stem2 = list(stem2)
         self.Stem2R = complement(self.Stem2)[::-1]
+        self._partials = None
+        self._pushed = None
         return True
 
+    def Copy(self):
+        """Return a copy of this sensor, much quicker than
+           copy.deepcopy()"""
+        other = copy.copy(self)
+        for name in ["Recognition", "RecognitionR", "Stem1", "Stem1R",
+                     "Stem2", "Stem2R", "Quencher", "Antitail"]:
+            setattr(other, name, list(getattr(self, name)))
+        if self._partials is not None:
+            other._partials = (list(self._partials[0]),
+                               list(self._partials[1]))
+        if self._pushed is not None:
+            other._pushed = list(self._pushed)
+        return other
+
+    @staticmethod
+    def _Term(nucl, end):
+        """The free energy _FreeEnergy() adds for nucl, at either end of
+           the sequence or not"""
+        if nucl == 'A' or nucl == 'T':
+            return .1 if end else .6
+        elif nucl == 'G' or nucl == 'C':
+            return .5 if end else 1
+        return 0
+
+    def _Partials(self, stem):
+        """Return the running sums of _FreeEnergy() over stem, see
+           _partials"""
+        partials = [0]
+        for (i, nucl) in enumerate(stem):
+            partials.append(partials[-1] + self._Term(nucl, i == 0))
+        return partials
+
+    def _StemFreeEnergy(self, stem, partials):
+        """Return _FreeEnergy(stem) from its running sums, adding the
+           same terms in the same order, so that it is exactly equal"""
+        if not stem:
+            return -0
+        return -(partials[-2] + self._Term(stem[-1], True))
+
     def _FreeEnergy(self, seq):
         """Consider a single DNA list. Then suppose that it was
            bound perfectly to its recognition, then return the
@@ -124,8 +267,9 @@ class Sensor:
            free energy in kJ/mol
            """
         recogenergy = self._FreeEnergy(self.Recognition)
-        logger.debug("util.Sensor.RecognitionEnergy(): calculated %f for recognition stems" %
-                      recogenergy)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("util.Sensor.RecognitionEnergy(): calculated %f for recognition stems" %
+                         recogenergy)
         return recogenergy
 
     def StemEnergy(self):
@@ -140,9 +284,16 @@ class Sensor:
            free energy in kJ/mol
            """
 
-        stemenergy = sum([self._FreeEnergy(stem) for stem in [self.Stem1, self.Stem2]])
-        logger.debug("util.Sensor.StemEnergy(): calculated sum of %f for both stems" %
-                      stemenergy)
+        partials = self._partials
+        if (partials is not None and len(partials[0]) == len(self.Stem1) + 1 and
+            len(partials[1]) == len(self.Stem2) + 1):
+            stemenergy = sum([self._StemFreeEnergy(stem, partial) for (stem, partial)
+                              in zip([self.Stem1, self.Stem2], partials)])
+        else:
+            stemenergy = sum([self._FreeEnergy(stem) for stem in [self.Stem1, self.Stem2]])
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("util.Sensor.StemEnergy(): calculated sum of %f for both stems" %
+                         stemenergy)
         return stemenergy
 
     def GetRecognition(self):
@@ -167,17 +318,63 @@ class Sensor:
         G       GAC ATGTCTAAT   GTC        GC ATTAGACAT     CG
         """
 
+        return self.PushGuess(guess)
+
+    def PushGuess(self, guess):
+        """Insert guess in to the stems, exactly as GuessStems(), in place,
+           see PopGuess(). The stem energy is updated in constant time,
+           the reversed complement of the stem in time linear in its
+           length, stems being only a few bases long.
+
+           Arguments:
+           guess -- a single character guess to be inserted
+           """
+        partials = self._partials
+        if (partials is None or len(partials[0]) != len(self.Stem1) + 1 or
+            len(partials[1]) != len(self.Stem2) + 1):
+            partials = self._partials = (self._Partials(self.Stem1),
+                                         self._Partials(self.Stem2))
+
         # Consider the length of both stems. If one is less than the other,
         # then insert the guess into the shortest length stem. If they are
         # the same length insert into Stem1
         if len(self.Stem1) > len(self.Stem2):
-            self.Stem2.append(guess)
-            self.Stem2R = complement(self.Stem2[::-1])
+            (stem, stemr, index) = (self.Stem2, self.Stem2R, 1)
         else:
-            self.Stem1.append(guess)
-            self.Stem1R = complement(self.Stem1[::-1])
+            (stem, stemr, index) = (self.Stem1, self.Stem1R, 0)
+        partial = partials[index]
+        if self._pushed is None:
+            self._pushed = []
+        self._pushed.append(index)
+        stem.append(guess)
+        stemr.insert(0, pairs[guess])
+        partial.append(partial[-1] + self._Term(guess, len(stem) == 1))
         return True
 
+    def PopGuess(self):
+        """Take the last guess inserted by PushGuess() (or GuessStems())
+           back out of the stem it went in to, and return it
+
+           Raises IndexError if no guess has been inserted since the
+           stems were last set.
+           """
+        if not self._pushed:
+            raise IndexError("Sensor.PopGuess(): no guess to take out of %s" %
+                             self)
+        index = self._pushed.pop()
+        if index == 0:
+            (stem, stemr) = (self.Stem1, self.Stem1R)
+        else:
+            (stem, stemr) = (self.Stem2, self.Stem2R)
+        guess = stem.pop()
+        del stemr[0]
+        partials = self._partials
+        if partials is not None and len(partials[index]) == len(stem) + 2:
+            partials[index].pop()
+        else:
+            self._partials = None
+        return guess
+
     def pprint(self):
         """Return something easier to read"""
         return ''.join(self.Stem1 + [" "] + self.Recognition + [" "] +
@@ -196,6 +393,67 @@ class Sensor:
         return True
         
     
+class SearchContext(object):
+    """What a search works out once, from its request, and hands to
+       every node it checks, so that checking a node only does the work
+       that depends on that node"""
+    def __init__(self, recognition, bindingratiorange=None,
+                 maxunknownpercent=None, numfoldrange=None, maxenergy=None,
+                 engine=None, deadline=None):
+        """Arguments:
+           recognition -- the recognition sequence searched for
+           bindingratiorange, maxunknownpercent, numfoldrange, maxenergy --
+                          what a solution must meet, see
+                          unafold.validate_sensor()
+           engine -- the folding backend, see folding.get_backend()
+           deadline -- when the search ends, as a time.time()
+        """
+        sensor = Sensor(recognition)
+        self.recognition = sensor.Recognition
+        self.recognition_r = sensor.RecognitionR
+        self.recognition_energy = sensor.RecognitionEnergy()
+        self.matcher = RecognitionMatcher.get(self.recognition)
+
+        # Set reasonable defaults if none are specified
+        if (not bindingratiorange or not bindingratiorange[0] or
+            not bindingratiorange[1]):
+            bindingratiorange = (.9, 1.1)
+        if not maxunknownpercent:
+            maxunknownpercent = .2
+        self.bindingratiorange = bindingratiorange
+        self.maxunknownpercent = maxunknownpercent
+        self.numfoldrange = numfoldrange
+        self.maxenergy = maxenergy
+        self.engine = engine
+        self.deadline = deadline
+
+        # A node is promising while its stems release less than this
+        self.promising_energy = self.recognition_energy - 2.0
+
+        # The lowest free energy the minimum free energy fold of a
+        # solution may have, that released by the binding of the
+        # recognition plus maxenergy (energy out of the system being
+        # negative), or None if there is no maxenergy. Only that fold
+        # decides it, so a sensor can be ruled out before its
+        # suboptimal folds are known.
+        if maxenergy:
+            self.energy_limit = self.recognition_energy + maxenergy
+        else:
+            self.energy_limit = None
+
+    def within_maxenergy(self, energy):
+        """Return True if energy, the minimum free energy of a sensor,
+           does not rule it out (always, if there is no maxenergy)"""
+        return self.energy_limit is None or self.energy_limit <= energy
+
+    def __str__(self):
+        return ("SearchContext(%s): binding ratio %s, max unknown %s, "
+                "folds %s, max energy %s, engine %s" %
+                (''.join(self.recognition), self.bindingratiorange,
+                 self.maxunknownpercent, self.numfoldrange, self.maxenergy,
+                 self.engine))
+
+
 class Counter(object):
     """Simple class to implement a shared counter on top of multiprocessing"""
     def __init__(self, initval=0):
@@ -351,10 +609,11 @@ class OutputElement():
     scores -- Required for (WEBOUTPUT:FOUND), the scores for that sensor
     folds -- Required for (WEBOUTPUT:FOUND), the sensor's foldings
     email -- Optional
+    engine -- Optional, the folding backend the sensor was folded with
     """
     def __init__(self, command, request_id, status, output_dir,
                  sensor = None, scores = None,  
-                 folds = None, email = None):
+                 folds = None, email = None, engine = None):
         self.command = command
         self.request_id = request_id
         self.status = status
@@ -363,6 +622,7 @@ class OutputElement():
         self.scores = scores
         self.folds = folds
         self.email = email
+        self.engine = engine
 
     def __str__(self):
         """Returns a human readable version of this request"""
@@ -451,7 +711,8 @@ class RequestElement():
     def __init__(self, command, request_id, recognition=None, email=None, maxtime=None,
                  output_dir=None, binding_ratio_lo=None, binding_ratio_hi=None,
                  maxunknown_percent=None, numfolds_lo=None, numfolds_hi=None,
-                 maxenergy = None, numsolutions = 1 ):
+                 maxenergy = None, numsolutions = 1, engine = None,
+                 strategy = None, beamwidth = None ):
         """This is a class to contain request for the
            search server to perform search requests
 
@@ -478,6 +739,14 @@ class RequestElement():
              most energetic folding in a sensor can exceed the
              free energy released from the recognition binding
              to it's response. Note: this needs to be negative
+           engine -- Optional, the folding backend to use (one of
+             valid_engines, see folding.get_backend()), defaults to
+             hybrid-ss-min
+           strategy -- Optional, how to search (one of valid_strategies,
+             see backtracking.sensorsearch()), defaults to depthfirst
+           beamwidth -- Optional, for the bestfirst strategy, the number
+             of the best nodes found to keep searching, if not given
+             none are dropped
         """
         self.command = command
         self.request_id = request_id
@@ -492,18 +761,26 @@ class RequestElement():
         self.binding_ratio_hi = binding_ratio_hi
         self.maxunknown_percent = maxunknown_percent
         self.maxenergy = maxenergy
+        self.engine = engine
+        self.strategy = strategy
+        self.beamwidth = beamwidth
 
         self.valid_commands = ["BACKTRACKING"]
+        # Not "replay", which only serves the folds of the test cases,
+        # for tests and benchmarks
+        self.valid_engines = ["hybrid-ss-min", "native"]
+        self.valid_strategies = ["depthfirst", "bestfirst"]
 
     def __str__(self):
         return ("CMD: %s, REC: %s, EMAIL: %s, MAXT: %s, DIR: %s, "
-                "#LO: %s, #HI: %s, RATIO_LO:%s, RATIO_HI:%s, MAX: %s" %
+                "#LO: %s, #HI: %s, RATIO_LO:%s, RATIO_HI:%s, MAX: %s, ENGINE: %s, "
+                "STRATEGY: %s, BEAM: %s" %
                 (self.command, self.recognition,
                  self.email, self.maxtime,
                  self.output_dir,
                  self.numfolds_lo, self.numfolds_hi,
                  self.binding_ratio_lo, self.binding_ratio_hi,
-                 self.maxenergy))
+                 self.maxenergy, self.engine, self.strategy, self.beamwidth))
     def valid(self):
         """Determines if this request is valid, according to the specification
            here
@@ -608,7 +885,46 @@ class RequestElement():
             logger.debug("RequestElement.valid(): GOOD - max unknown percent not specified")
             maxunknown = True
 
-        if command and output_dir and maxenergy and recognition and ratio and maxunknown:
+        if self.engine:
+            if self.engine in self.valid_engines:
+                logger.debug("RequestElement.valid(): GOOD - engine %s is valid" %
+                             self.engine)
+                engine = True
+            else:
+                logger.debug("RequestElement.valid(): BAD - engine %s is not valid, not in %s" %
+                             (self.engine, self.valid_engines))
+                engine = False
+        else:
+            logger.debug("RequestElement.valid(): GOOD - engine not specified")
+            engine = True
+
+        if self.strategy:
+            if self.strategy in self.valid_strategies:
+                logger.debug("RequestElement.valid(): GOOD - strategy %s is valid" %
+                             self.strategy)
+                strategy = True
+            else:
+                logger.debug("RequestElement.valid(): BAD - strategy %s is not valid, not in %s" %
+                             (self.strategy, self.valid_strategies))
+                strategy = False
+        else:
+            logger.debug("RequestElement.valid(): GOOD - strategy not specified")
+            strategy = True
+
+        if self.beamwidth is not None:
+            if isinstance(self.beamwidth, int) and self.beamwidth > 0:
+                logger.debug("RequestElement.valid(): GOOD - beam width %d" %
+                             self.beamwidth)
+                beamwidth = True
+            else:
+                logger.debug("RequestElement.valid(): BAD - beam width %s is not a positive integer" %
+                             self.beamwidth)
+                beamwidth = False
+        else:
+            beamwidth = True
+
+        if (command and output_dir and maxenergy and recognition and ratio and
+            maxunknown and engine and strategy and beamwidth):
             return True
         else:
             return False
@@ -13,6 +13,8 @@ import shutil
 import subprocess
 import tempfile
 
+from . import folding, unafold
+
 logger = logging.getLogger(__name__)
 
 class WebOutputError(Exception):
@@ -36,21 +38,16 @@ def failed_output(sensor, output_dir, reason):
         pass
 
 
-def run_unafold(unafold_dir, sensor, cmd="UNAFold.pl"):
+def run_unafold(unafold_dir, sensor, cmd="UNAFold.pl", engine=None,
+                folds=None):
+    """Draw the structures of sensor, folds if given, into unafold_dir
+       with the backend they were folded by, see
+       folding.FoldingBackend.draw()"""
     try:
-        seqfile = open(os.path.join(unafold_dir, str(sensor)),"w")
-        seqfile.write(str(sensor))
-        seqfile.close()
-        command = [cmd,'-n','DNA','--temp=25',
-                   '--sodium=0.15', '--magnesium=0.005',
-                   '--percent=50', str(sensor)]
-        print "running {} in {}".format(command, unafold_dir)
-        result = subprocess.check_output(command,cwd=unafold_dir, stderr=subprocess.STDOUT)
-
-    except (OSError, IOError), err:
+        folding.get_backend(engine).draw(sensor, unafold_dir, folds,
+                                         command=cmd)
+    except folding.FoldingError, err:
         raise RuntimeError(str(err))
-    except subprocess.CalledProcessError,err:
-        print "{} and output as follows: {}".format(err, result)
 
 def convert_substructure_images(unafold_dir, output_dir, convert_cmd="convert"):
     # Convert ps -> png for each substructure
@@ -108,7 +105,7 @@ def add_borders(folds, sensor, output_dir, cmd="convert"):
         
         raise RuntimeError(str(err))
 
-def solution_output(sensor, scores, folds, output_dir):
+def solution_output(sensor, scores, folds, output_dir, engine=None):
     """ This output's a ton of information and graphics
         for a validated sensor, to be used by the web
         front end.
@@ -117,14 +114,36 @@ def solution_output(sensor, scores, folds, output_dir):
     sensor -- a util.Sensor object
     scores -- a dictionary of the sensor's scores, as output
               by a checknode()
-    folds -- a list of all the different folds
+    folds -- a list of all the different folds, if empty the sensor
+             is folded (through folding.fold_cache, if there is one)
+             and scored again
     output_dir -- path to directory to output data, it is the
     caller's responsibility to create this safely.
+    engine -- the folding backend the sensor was folded with, see
+              folding.get_backend()
 
     Returns:
     True, unless error is raised
     """
 
+    if not folds:
+        logger.debug("solution_output(%s, %s): no folds given, refolding" %
+                     (sensor, output_dir))
+        try:
+            folds = folding.fold_sensor(sensor, engine)
+            # This process outputs every solution, so the types found
+            # for one are kept for the next of the same recognition
+            unafold.use_type_cache(sensor.Recognition)
+            scores = unafold.score_sensor(sensor, folds)
+        except (folding.FoldingError, unafold.UNAFoldError, IOError, OSError), err:
+            logger.error("solution_output(%s, %s): unable to fold sensor, %s" %
+                         (sensor, output_dir, str(err)))
+            failed_output(sensor, output_dir, "unable to run UNAfold, permission problem?")
+            return False
+        if folding.fold_cache is not None:
+            logger.info("solution_output(%s, %s): %s" %
+                        (sensor, output_dir, folding.fold_cache))
+
     # Run UNAfold in temp dir  on output 
     logger.info("solution_output(%s, %s): starting output" %
                 (sensor, output_dir))
@@ -140,7 +159,7 @@ def solution_output(sensor, scores, folds, output_dir):
         return False
     try:
         try:
-            run_unafold(unafold_dir, sensor)
+            run_unafold(unafold_dir, sensor, engine=engine, folds=folds)
         except RuntimeError, err:
             logger.error("solution_output(%s, %s): unable to run UNAfold, permission problem or missing binary?, %s" %
                          (sensor, output_dir, str(err)))
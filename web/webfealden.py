@@ -30,6 +30,8 @@ myform = form.Form(
     form.Textbox('binding_ratio_lo', description='Lower bound for ratio of binding foldings vs. nonbinding foldings', value=.9, id="binding_ratio_lo"),
     form.Textbox('binding_ratio_hi', description='Upper bound for ratio of binding foldings vs. nonbinding foldings', value=1.1, id="binding_ratio_hi"),
     form.Textbox('maxenergy', description='Maximum additional energy (kJ/mol)', value=-5.0, id="maxenergy"),
+    form.Dropdown('engine', [('hybrid-ss-min', 'UNAfold (hybrid-ss-min)'), ('native', 'Native')], description='Folding engine', id="engine"),
+    form.Dropdown('strategy', [('depthfirst', 'Depth first'), ('bestfirst', 'Best first')], description='Search strategy', id="strategy"),
     #    form.Textbox("email", description='(optional) email to recieve notifications at',
     #             id="email"),
     form.Button("Run", type="submit")